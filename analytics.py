@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📐 КОЛОНОЧНАЯ АНАЛИТИКА
+
+Видео и выплаты раскладываются по столбцам (код пользователя, код типа,
+сумма, номер дня от 1970-01-01), а группировки «количество и сумма по
+пользователю × типу × дню/неделе/месяцу» считаются векторно через NumPy.
+NumPy — необязательная зависимость: без него тот же API работает на
+чистом Python, только медленнее. Импортируется он при первой раскладке
+по столбцам, а не при импорте модуля (это ~100 мс запуска бота). Для сумм за произвольный диапазон дат
+есть индекс префиксных сумм (деревья Фенвика по дням), который
+обновляется при каждом добавлении и удалении записи.
+
+Модуль не знает о боте: на вход — любые записи с полями
+user, type, amount и created_at ("ГГГГ-ММ-ДД ЧЧ:ММ:СС"), а также готовые
+агрегаты (пользователь, тип, день, количество, сумма) — так в итоги
+попадают записи, которые уже лежат в архиве.
+"""
+
+import functools
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+np = None  # модуль numpy после load_numpy() (None — не загружен или не установлен)
+
+EPOCH = date(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+PERIODS = ('day', 'week', 'month')
+GROUP_KEYS = ('user', 'type', 'period')
+
+
+# ===========================
+# СТОЛБЦЫ
+# ===========================
+@functools.lru_cache(maxsize=None)
+def load_numpy() -> bool:
+    """Импорт NumPy при первом обращении; False — NumPy не установлен"""
+    global np
+    try:
+        import numpy
+    except ImportError:
+        return False
+    np = numpy
+    return True
+
+
+class ColumnTable:
+    """Записи, разложенные по столбцам (массивы NumPy или списки)"""
+    __slots__ = ('users', 'types', 'user_codes', 'type_codes', 'amounts', 'counts', 'days')
+
+    def __init__(self, users, types, user_codes, type_codes, amounts, counts, days):
+        self.users = users            # код → имя пользователя
+        self.types = types            # код → тип
+        self.user_codes = user_codes
+        self.type_codes = type_codes
+        self.amounts = amounts
+        self.counts = counts          # сколько записей в строке (1 или размер агрегата)
+        self.days = days              # номер дня от 1970-01-01
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+
+def day_number(value: date) -> int:
+    """Номер дня от 1970-01-01"""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def iter_rows(records: Iterable, aggregates: Iterable) -> Iterable[Tuple]:
+    """Записи и агрегаты как строки (пользователь, тип, день, количество, сумма)"""
+    for record in records:
+        yield record.user, record.type, record.created_at[:10], 1, record.amount
+    yield from aggregates
+
+
+def build_table(records: Iterable, aggregates: Iterable[Tuple] = ()) -> ColumnTable:
+    """Раскладка записей (и агрегатов) по столбцам с кодированием пользователей и типов"""
+    users: Dict[str, int] = {}
+    types: Dict[str, int] = {}
+    day_cache: Dict[str, int] = {}
+    user_codes, type_codes, amounts, counts, days = [], [], [], [], []
+
+    for user, record_type, day_key, count, amount in iter_rows(records, aggregates):
+        user_codes.append(users.setdefault(user, len(users)))
+        type_codes.append(types.setdefault(record_type, len(types)))
+        amounts.append(amount)
+        counts.append(count)
+        # Дат немного, а записей много — разбор даты кэшируется
+        day = day_cache.get(day_key)
+        if day is None:
+            day = day_cache[day_key] = day_number(date.fromisoformat(day_key))
+        days.append(day)
+
+    if load_numpy():
+        user_codes = np.array(user_codes, dtype=np.int32)
+        type_codes = np.array(type_codes, dtype=np.int32)
+        amounts = np.array(amounts, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        days = np.array(days, dtype=np.int32)
+    return ColumnTable(list(users), list(types), user_codes, type_codes, amounts, counts, days)
+
+
+# ===========================
+# ПЕРИОДЫ
+# ===========================
+def month_index(day: int) -> int:
+    """Номер месяца от 1970-01"""
+    value = EPOCH + timedelta(days=day)
+    return (value.year - 1970) * 12 + value.month - 1
+
+
+def period_indexes(days, period: str):
+    """Номера дней → номера периодов (недели с понедельника)"""
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 — четверг, поэтому сдвиг на 3 дня
+        if np is not None:
+            return (days + 3) // 7
+        return [(day + 3) // 7 for day in days]
+    if period == 'month':
+        if np is not None:
+            return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int32)
+        cache: Dict[int, int] = {}
+        return [cache[day] if day in cache else cache.setdefault(day, month_index(day)) for day in days]
+    raise ValueError(f"неизвестный период: {period}")
+
+
+def period_start(period: str, index: int) -> date:
+    """Первый день периода по его номеру"""
+    if period == 'day':
+        return EPOCH + timedelta(days=index)
+    if period == 'week':
+        return EPOCH + timedelta(days=index * 7 - 3)
+    return date(1970 + index // 12, index % 12 + 1, 1)
+
+
+# ===========================
+# ГРУППИРОВКИ
+# ===========================
+def group_by(table: ColumnTable, by: Sequence[str] = ('user',), period: Optional[str] = None,
+             start: Optional[date] = None, end: Optional[date] = None) -> Dict[Tuple, Dict[str, int]]:
+    """Количество и сумма по комбинациям ключей
+
+    by — подмножество ('user', 'type', 'period'); для 'period' нужен
+    period ('day' | 'week' | 'month'). start/end ограничивают даты
+    (включительно). Результат: {(ключи...): {'count': n, 'sum': s}},
+    ключи периода — первый день периода (date), порядок — по ключам.
+    """
+    for key in by:
+        if key not in GROUP_KEYS:
+            raise ValueError(f"неизвестный ключ группировки: {key}")
+    if 'period' in by and period not in PERIODS:
+        raise ValueError(f"для группировки по периоду нужен period из {PERIODS}")
+    if len(table) == 0:
+        return {}
+
+    if load_numpy():
+        return group_by_numpy(table, by, period, start, end)
+    return group_by_python(table, by, period, start, end)
+
+
+def decode_key(table: ColumnTable, by: Sequence[str], period: Optional[str], codes: Sequence[int]) -> Tuple:
+    decoded = []
+    for key, code in zip(by, codes):
+        if key == 'user':
+            decoded.append(table.users[code])
+        elif key == 'type':
+            decoded.append(table.types[code])
+        else:
+            decoded.append(period_start(period, code))
+    return tuple(decoded)
+
+
+def sort_key(table: ColumnTable, by: Sequence[str], codes: Sequence[int]) -> Tuple:
+    """Порядок результата: пользователи и типы по имени, периоды по времени"""
+    return tuple(
+        table.users[code] if key == 'user' else table.types[code] if key == 'type' else code
+        for key, code in zip(by, codes)
+    )
+
+
+def group_by_numpy(table, by, period, start, end):
+    selected = np.ones(len(table), dtype=bool)
+    if start is not None:
+        selected &= table.days >= day_number(start)
+    if end is not None:
+        selected &= table.days <= day_number(end)
+
+    columns = []
+    for key in by:
+        if key == 'user':
+            columns.append(table.user_codes[selected])
+        elif key == 'type':
+            columns.append(table.type_codes[selected])
+        else:
+            columns.append(period_indexes(table.days[selected], period))
+    amounts = table.amounts[selected]
+    weights = table.counts[selected]
+    if len(amounts) == 0:
+        return {}
+
+    if not columns:
+        return {(): {'count': int(weights.sum()), 'sum': int(amounts.sum())}}
+
+    # Составной ключ: смешанная система счисления по столбцам
+    offsets = [int(column.min()) for column in columns]
+    sizes = [int(column.max()) - offset + 1 for column, offset in zip(columns, offsets)]
+    combined = np.zeros(len(amounts), dtype=np.int64)
+    for column, offset, size in zip(columns, offsets, sizes):
+        combined = combined * size + (column - offset)
+
+    keys, inverse = np.unique(combined, return_inverse=True)
+    counts = np.bincount(inverse, weights=weights)
+    sums = np.bincount(inverse, weights=amounts)
+    parts = np.unravel_index(keys, sizes)
+
+    rows = []
+    for i in range(len(keys)):
+        codes = [int(part[i]) + offset for part, offset in zip(parts, offsets)]
+        rows.append((sort_key(table, by, codes), codes, int(round(counts[i])), int(round(sums[i]))))
+    rows.sort(key=lambda row: row[0])
+    return {
+        decode_key(table, by, period, codes): {'count': count, 'sum': total}
+        for _, codes, count, total in rows
+    }
+
+
+def group_by_python(table, by, period, start, end):
+    first = day_number(start) if start is not None else None
+    last = day_number(end) if end is not None else None
+    periods = period_indexes(table.days, period) if 'period' in by else None
+
+    groups: Dict[Tuple, list] = {}
+    for i, day in enumerate(table.days):
+        if (first is not None and day < first) or (last is not None and day > last):
+            continue
+        codes = tuple(
+            table.user_codes[i] if key == 'user' else table.type_codes[i] if key == 'type' else periods[i]
+            for key in by
+        )
+        entry = groups.get(codes)
+        if entry is None:
+            entry = groups[codes] = [0, 0]
+        entry[0] += table.counts[i]
+        entry[1] += table.amounts[i]
+
+    return {
+        decode_key(table, by, period, codes): {'count': count, 'sum': total}
+        for codes, (count, total) in sorted(groups.items(), key=lambda item: sort_key(table, by, item[0]))
+    }
+
+
+# ===========================
+# ИНДЕКС ПРЕФИКСНЫХ СУММ
+# ===========================
+class FenwickTree:
+    """Дерево Фенвика: изменение точки и сумма префикса за O(log n)"""
+    __slots__ = ('tree',)
+
+    def __init__(self, values: Sequence[int]):
+        # Построение за O(n): каждый узел передаёт сумму родителю
+        tree = [0] + list(values)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def __len__(self) -> int:
+        return len(self.tree) - 1
+
+    def add(self, index: int, delta: int):
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """Сумма элементов [0, index]"""
+        i = min(index + 1, len(self.tree) - 1)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class EarningsIndex:
+    """Количество и сумма записей каждого пользователя по дням
+
+    Для каждого пользователя — два дерева Фенвика (количество и сумма)
+    над днями, начиная с base_day. Сумма за любой диапазон дат и
+    изменение при добавлении/удалении записи — O(log n). Если запись
+    выходит за пределы дней, индекс пересобирается с запасом.
+    """
+    __slots__ = ('base_day', 'size', 'daily', 'counts', 'sums')
+
+    def __init__(self, records: Iterable = (), aggregates: Iterable[Tuple] = (), margin: int = 366):
+        day_cache: Dict[str, int] = {}
+        entries = []
+        for user, _, key, count, amount in iter_rows(records, aggregates):
+            day = day_cache.get(key)
+            if day is None:
+                day = day_cache[key] = day_number(date.fromisoformat(key))
+            entries.append((user, day, count, amount))
+        today = day_number(date.today())
+        days = [day for _, day, _, _ in entries] or [today]
+        self.base_day = min(days)
+        self.size = max(max(days), today) - self.base_day + 1 + margin
+        # Посуточные значения храним отдельно — из них пересобираются деревья
+        self.daily: Dict[str, Tuple[list, list]] = {}
+        for user, day, count, amount in entries:
+            counts, sums = self.user_daily(user)
+            counts[day - self.base_day] += count
+            sums[day - self.base_day] += amount
+        self.rebuild()
+
+    def user_daily(self, user: str) -> Tuple[list, list]:
+        if user not in self.daily:
+            self.daily[user] = ([0] * self.size, [0] * self.size)
+        return self.daily[user]
+
+    def rebuild(self):
+        self.counts = {user: FenwickTree(counts) for user, (counts, _) in self.daily.items()}
+        self.sums = {user: FenwickTree(sums) for user, (_, sums) in self.daily.items()}
+
+    def resize(self, day: int):
+        """Расширение диапазона дней так, чтобы в него попал day"""
+        base_day = min(self.base_day, day - 31)
+        last_day = max(self.base_day + self.size - 1, day + 366)
+        shift = self.base_day - base_day
+        size = last_day - base_day + 1
+        for user, (counts, sums) in self.daily.items():
+            tail = size - shift - len(counts)
+            self.daily[user] = ([0] * shift + counts + [0] * tail, [0] * shift + sums + [0] * tail)
+        self.base_day, self.size = base_day, size
+        self.rebuild()
+
+    def add(self, user: str, created_at: str, amount: int, sign: int = 1):
+        """Учёт добавления (sign=1) или удаления (sign=-1) записи"""
+        day = day_number(date.fromisoformat(created_at[:10]))
+        if not self.base_day <= day < self.base_day + self.size:
+            self.resize(day)
+        counts, sums = self.user_daily(user)
+        if user not in self.counts:
+            self.counts[user] = FenwickTree(counts)
+            self.sums[user] = FenwickTree(sums)
+        offset = day - self.base_day
+        counts[offset] += sign
+        sums[offset] += sign * amount
+        self.counts[user].add(offset, sign)
+        self.sums[user].add(offset, sign * amount)
+
+    def range(self, user: str, start: date, end: date) -> Dict[str, int]:
+        """Количество и сумма записей пользователя с start по end включительно"""
+        if user not in self.counts:
+            return {'count': 0, 'sum': 0}
+        first = max(day_number(start) - self.base_day, 0)
+        last = min(day_number(end) - self.base_day, self.size - 1)
+        if first > last:
+            return {'count': 0, 'sum': 0}
+        counts, sums = self.counts[user], self.sums[user]
+        return {
+            'count': counts.prefix(last) - (counts.prefix(first - 1) if first else 0),
+            'sum': sums.prefix(last) - (sums.prefix(first - 1) if first else 0)
+        }
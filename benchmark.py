@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📏 БЕНЧМАРКИ ГОРЯЧИХ ПУТЕЙ БОТА
+
+Генерирует синтетическую bot_database.json заданного размера, замеряет
+загрузку/сохранение БД (в каждом доступном формате и из бинарного снимка)
+и размер файлов, импорт модуля, расчёт баланса и статистики, колоночную
+аналитику, рейтинг, полную статистику, календари, экспорт в Excel и перенос
+истории в архив и пишет результаты в JSON.
+
+Запуск:
+    python benchmark.py --videos 10000 100000 --output bench.json
+    python benchmark.py --compare old.json new.json
+"""
+
+import os
+import io
+import sys
+import json
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import analytics
+import telegram_bot as bot
+
+VIDEO_TYPES = ['a2e', 'makefilm', 'grok', 'upload']
+VIDEO_TYPE_WEIGHTS = [3, 2, 2, 4]
+DAYOFF_REASONS = ['Личные дела', 'Врач', 'Учёба', 'Семья']
+# Фиксированный конец истории: с датой запуска данные менялись бы день ото дня
+DEFAULT_END_DATE = datetime(2025, 12, 31, 23, 59, 59)
+
+
+# ===========================
+# ГЕНЕРАТОР ДАННЫХ
+# ===========================
+def generate_users(count: int) -> Dict:
+    """Пользователи из конфигурации бота плюс синтетические до нужного числа"""
+    users = {}
+    for i, (name, config) in enumerate(bot.USERS_CONFIG.items()):
+        if i >= count:
+            break
+        users[name] = dict(config, telegram_id=1000 + i)
+    for i in range(len(users), count):
+        users[f"Работница {i + 1}"] = {
+            "role": "creator_uploader",
+            "rates": {"a2e": 300, "makefilm": 400, "grok": 450, "upload": 200},
+            "can_upload": True,
+            "telegram_id": 1000 + i
+        }
+    return users
+
+
+def generate_database(users: int = 6, videos: int = 10000, payments: int = 0,
+                      dayoffs: int = 0, days: int = 365, end_date: datetime = None,
+                      seed: int = 42) -> Dict:
+    """Синтетическая БД в формате bot_database.json
+
+    При одинаковых параметрах и seed данные совпадают, поэтому результаты
+    разных коммитов можно сравнивать между собой.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or DEFAULT_END_DATE
+    start = end_date - timedelta(days=days)
+    span = int((end_date - start).total_seconds())
+
+    user_table = generate_users(users)
+    names = list(user_table.keys())
+    payments = payments if payments else max(1, videos // 50)
+    dayoffs = dayoffs if dayoffs else max(1, users * days // 30)
+
+    timestamps = sorted(rng.randrange(span) for _ in range(videos))
+    video_list = []
+    for i, offset in enumerate(timestamps, 1):
+        user_name = rng.choice(names)
+        video_type = rng.choices(VIDEO_TYPES, VIDEO_TYPE_WEIGHTS)[0]
+        video_list.append({
+            'id': i,
+            'user': user_name,
+            'type': video_type,
+            'name': f"Загрузка #{rng.randint(1, 20)}" if video_type == 'upload' else f"Видео {i}",
+            'amount': user_table[user_name]['rates'][video_type],
+            'created_at': (start + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+    payment_list = []
+    for i, offset in enumerate(sorted(rng.randrange(span) for _ in range(payments)), 1):
+        payment_type = rng.choice(['salary', 'advance'])
+        payment_list.append({
+            'id': i,
+            'user': rng.choice(names),
+            'amount': rng.randint(5, 60) * 100 if payment_type == 'salary' else rng.randint(1, 10) * 100,
+            'type': payment_type,
+            'created_at': (start + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+    requests = []
+    approved = {}
+    for i in range(1, dayoffs + 1):
+        user_name = rng.choice(names)
+        requested = start + timedelta(seconds=rng.randrange(span))
+        date_str = (requested + timedelta(days=rng.randint(1, 14))).strftime("%Y-%m-%d")
+        status = rng.choices(['approved', 'rejected', 'pending'], [6, 2, 1])[0]
+        request = {
+            'id': f"req_{i:03d}",
+            'user': user_name,
+            'date': date_str,
+            'reason': rng.choice(DAYOFF_REASONS),
+            'status': status,
+            'requested_at': requested.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if status == 'approved':
+            request['approved_at'] = (requested + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M:%S")
+            approved.setdefault(user_name, []).append({
+                'date': date_str,
+                'reason': request['reason'],
+                'approved_at': request['approved_at']
+            })
+        requests.append(request)
+
+    admin_dates = sorted({
+        (start + timedelta(days=rng.randrange(days))).strftime("%Y-%m-%d")
+        for _ in range(max(1, days // 30))
+    })
+
+    return {
+        "users": user_table,
+        "videos": video_list,
+        "payments": payment_list,
+        "plans": {},
+        "days_off_requests": requests,
+        "days_off_approved": approved,
+        "admin_days_off": {
+            "admin": admin_dates,
+            "husband": admin_dates[::2]
+        }
+    }
+
+
+# ===========================
+# ЗАМЕРЫ
+# ===========================
+def measure(func: Callable, repeat: int) -> Dict:
+    """Несколько прогонов функции: минимум, медиана и среднее (секунды)"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - started)
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs),
+        'runs': len(runs)
+    }
+
+
+def memory_per_record(rows: List[Dict], record_class) -> Dict:
+    """Память на одну запись: словари из JSON против записей со __slots__ (байты)"""
+    raw = json.dumps(rows, ensure_ascii=False)
+    count = max(1, len(rows))
+
+    tracemalloc.start()
+    parsed = json.loads(raw)
+    as_dicts, _ = tracemalloc.get_traced_memory()
+    del parsed
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    records = [record_class.from_dict(row) for row in json.loads(raw)]
+    as_records, _ = tracemalloc.get_traced_memory()
+    del records
+    tracemalloc.stop()
+
+    return {'dict': as_dicts / count, 'record': as_records / count}
+
+
+def use_database(data: Dict):
+    """Подмена БД бота сгенерированными данными"""
+    bot.db.clear()
+    bot.db.update(bot.database_to_records(data))
+    bot.DB_STATE['loaded'] = True
+    bot.USER_NAME_CACHE.clear()
+    bot.rebuild_indexes()
+    # Синтетические пользователи должны попадать в отчёты, которые идут по USERS_CONFIG
+    for name, config in data['users'].items():
+        bot.USERS_CONFIG.setdefault(name, config)
+
+
+def run_suite(data: Dict, workdir: str, repeat: int, skip: List[str],
+              end_date: datetime = DEFAULT_END_DATE) -> Dict:
+    """Все замеры на одной сгенерированной БД (end_date — конец её истории)"""
+    bot.DB_FILE = os.path.join(workdir, 'bot_database.json')
+    results = {}
+    if 'memory' not in skip:
+        for table, record_class in bot.RECORD_TABLES.items():
+            results[f'{table}_bytes_per_record'] = memory = memory_per_record(data[table], record_class)
+            print(f"  {table + ' память':<20} {memory['dict']:7.0f} → {memory['record']:7.0f} байт/запись")
+    use_database(data)
+    bot.save_database(bot.db)
+
+    user_name = next(iter(bot.USERS_CONFIG))
+    benchmarks = {
+        'load_database': lambda: bot.load_database(),
+        'save_database': lambda: bot.save_database(bot.db),
+        'calculate_balance': lambda: bot.calculate_balance(user_name),
+        'get_user_stats': lambda: bot.get_user_stats(user_name),
+        'ratings': bot.build_ratings_report,
+        'full_statistics': bot.build_full_statistics_report,
+        'calendar_all': bot.build_calendar_all_report,
+        'my_calendar': lambda: bot.build_my_calendar_report(user_name),
+        'analytics_build': lambda: analytics.build_table(bot.db['videos']),
+        'earnings_index_build': lambda: analytics.EarningsIndex(bot.db['videos']),
+        'period_earnings': lambda: bot.period_earnings(end_date - timedelta(days=45), end_date),
+        'analytics_month': lambda: analytics.group_by(
+            bot.analytics_tables()['videos'], ('user', 'type', 'period'), period='month'),
+        'export_excel': lambda: bot.build_excel_workbook().save(io.BytesIO()),
+    }
+
+    for name, func in benchmarks.items():
+        if name in skip:
+            continue
+        # Экспорт в Excel очень долгий на больших БД — одного прогона достаточно
+        runs = 1 if name == 'export_excel' else repeat
+        results[name] = measure(func, runs)
+        print(f"  {name:<20} {results[name]['median'] * 1000:10.2f} мс")
+
+    results['db_file_bytes'] = os.path.getsize(bot.current_database_file()[1])
+
+    # Каждый доступный формат файла БД: сохранение, загрузка, размер
+    if 'formats' not in skip:
+        saved_format = bot.DB_FORMAT
+        for fmt in bot.SERIALIZERS:
+            if not bot.serializer_available(fmt):
+                print(f"  {fmt}: модуль не установлен, пропуск")
+                continue
+            bot.DB_FORMAT = fmt
+            bot.save_database(bot.db)
+            results[f'save_{fmt}'] = measure(lambda: bot.save_database(bot.db), repeat)
+            results[f'load_{fmt}'] = measure(bot.load_database, repeat)
+            results[f'{fmt}_file_bytes'] = os.path.getsize(bot.database_file(fmt))
+            for name in (f'save_{fmt}', f'load_{fmt}'):
+                print(f"  {name:<20} {results[name]['median'] * 1000:10.2f} мс")
+            print(f"  {fmt + '_file_bytes':<20} {results[f'{fmt}_file_bytes']:>10}")
+        bot.DB_FORMAT = saved_format
+        bot.save_database(bot.db)
+
+    # Холодный старт: импорт модуля и загрузка БД из снимка
+    if 'startup' not in skip:
+        bot.save_database(bot.db)
+        bot.write_snapshot(bot.db)
+        results['load_database_snapshot'] = measure(bot.load_database, repeat)
+        results['snapshot_file_bytes'] = os.path.getsize(bot.snapshot_file())
+        results['import_module'] = measure(lambda: import_module(workdir), repeat)
+        for name in ('load_database_snapshot', 'import_module'):
+            print(f"  {name:<20} {results[name]['median'] * 1000:10.2f} мс")
+        os.remove(bot.snapshot_file())
+
+    # Перенос закрытой истории в архив (последним: меняет рабочую БД).
+    # Горизонт отсчитывается от конца истории, а не от даты запуска
+    if 'archive' not in skip:
+        results['archive_rollover'] = measure(lambda: asyncio.run(bot.run_archive_rollover(end_date)), 1)
+        results['hot_videos_after_archive'] = len(bot.db['videos'])
+        results['save_after_archive'] = measure(lambda: bot.save_database(bot.db), repeat)
+        results['hot_db_file_bytes'] = os.path.getsize(bot.current_database_file()[1])
+        for name in ('archive_rollover', 'save_after_archive'):
+            print(f"  {name:<20} {results[name]['median'] * 1000:10.2f} мс")
+        print(f"  {'hot_videos':<20} {results['hot_videos_after_archive']:>10}")
+        shutil.rmtree(bot.archive_dir(), ignore_errors=True)
+
+    return results
+
+
+def import_module(workdir: str):
+    """Импорт telegram_bot в чистом интерпретаторе (рабочий каталог — с тестовой БД)"""
+    subprocess.run(
+        [sys.executable, '-c', 'import telegram_bot'],
+        cwd=workdir, check=True,
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    )
+
+
+def git_commit() -> str:
+    """Текущий коммит репозитория (если доступен git)"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(old_path: str, new_path: str):
+    """Сравнение двух файлов результатов (медианы, новое/старое)"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['commit']} → {new['meta']['commit']}")
+    for size, results in new['results'].items():
+        if size not in old['results']:
+            continue
+        print(f"\n📦 {size} видео")
+        for name, result in results.items():
+            before = old['results'][size].get(name)
+            if not isinstance(result, dict) or not isinstance(before, dict) or 'median' not in result:
+                continue
+            ratio = result['median'] / before['median'] if before['median'] else float('inf')
+            print(f"  {name:<20} {before['median'] * 1000:10.2f} → {result['median'] * 1000:10.2f} мс  (×{ratio:.2f})")
+        for name, value in results.items():
+            if name.endswith('_file_bytes') and name in old['results'][size]:
+                print(f"  {name:<20} {old['results'][size][name]:>10} → {value:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей бота")
+    parser.add_argument('--users', type=int, default=6)
+    parser.add_argument('--videos', type=int, nargs='+', default=[10000])
+    parser.add_argument('--payments', type=int, default=0, help="по умолчанию videos/50")
+    parser.add_argument('--dayoffs', type=int, default=0, help="по умолчанию ~1 в месяц на человека")
+    parser.add_argument('--days', type=int, default=365, help="глубина истории в днях")
+    parser.add_argument('--end-date', help=f"последний день истории ГГГГ-ММ-ДД (по умолчанию {DEFAULT_END_DATE:%Y-%m-%d})")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip', nargs='*', default=[], help="имена замеров, которые пропустить")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    end_date = datetime.strptime(args.end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59) if args.end_date else DEFAULT_END_DATE
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'params': params
+        },
+        'results': {}
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for videos in args.videos:
+            print(f"📦 {videos} видео, {args.users} пользователей")
+            data = generate_database(
+                users=args.users, videos=videos, payments=args.payments,
+                dayoffs=args.dayoffs, days=args.days, end_date=end_date, seed=args.seed
+            )
+            report['results'][str(videos)] = run_suite(data, workdir, args.repeat, args.skip, end_date)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
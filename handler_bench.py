@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔬 МИКРОБЕНЧМАРКИ ОБРАБОТЧИКОВ
+
+Фейковые Update, CallbackQuery и Context плюс бот, записывающий все
+исходящие вызовы, позволяют вызывать обработчики напрямую в цикле.
+Для каждого обработчика на нескольких размерах БД замеряется время
+вызова и выделение памяти (tracemalloc), результаты пишутся в JSON.
+
+Запуск:
+    python handler_bench.py --sizes 1000 10000 100000 --output handlers.json
+    python handler_bench.py --handlers my_income ratings --sizes 50000
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import telegram_bot as bot
+from benchmark import generate_database, use_database, git_commit
+
+
+# ===========================
+# ФЕЙКОВЫЕ ОБЪЕКТЫ TELEGRAM
+# ===========================
+class RecordingBot:
+    """Бот, который ничего не отправляет, а только запоминает вызовы"""
+
+    def __init__(self):
+        self.calls: List[tuple] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(('send_message', chat_id, text))
+        return FakeMessage(self, chat_id, text)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.calls.append(('send_document', chat_id, kwargs.get('filename')))
+        return FakeMessage(self, chat_id, None)
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.first_name = f"User {user_id}"
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.type = 'private'
+
+
+class FakeMessage:
+    """Сообщение с методами ответа, которые пишут в RecordingBot"""
+
+    def __init__(self, recorder: RecordingBot, chat_id: int, text: Optional[str]):
+        self.recorder = recorder
+        self.chat_id = chat_id
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        self.recorder.calls.append(('reply_text', self.chat_id, text))
+        return FakeMessage(self.recorder, self.chat_id, text)
+
+    async def reply_document(self, document, **kwargs):
+        # Файл читается, как это сделал бы настоящий клиент
+        if hasattr(document, 'read'):
+            document.read()
+        self.recorder.calls.append(('reply_document', self.chat_id, kwargs.get('filename')))
+        return FakeMessage(self.recorder, self.chat_id, None)
+
+
+class FakeCallbackQuery:
+    def __init__(self, recorder: RecordingBot, chat_id: int, data: str):
+        self.recorder = recorder
+        self.data = data
+        self.message = FakeMessage(recorder, chat_id, None)
+
+    async def answer(self, *args, **kwargs):
+        self.recorder.calls.append(('answer', self.message.chat_id, None))
+
+    async def edit_message_text(self, text, **kwargs):
+        self.recorder.calls.append(('edit_message_text', self.message.chat_id, text))
+
+
+class FakeUpdate:
+    def __init__(self, recorder: RecordingBot, user_id: int,
+                 text: Optional[str] = None, callback_data: Optional[str] = None):
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeChat(user_id)
+        self.message = FakeMessage(recorder, user_id, text) if text is not None else None
+        self.callback_query = (
+            FakeCallbackQuery(recorder, user_id, callback_data) if callback_data is not None else None
+        )
+
+
+class FakeApplication:
+    def create_task(self, coroutine):
+        return asyncio.ensure_future(coroutine)
+
+
+class FakeContext:
+    """Аналог ContextTypes.DEFAULT_TYPE для прямого вызова обработчиков"""
+
+    def __init__(self, recorder: RecordingBot, user_data: Optional[Dict] = None,
+                 args: Optional[List[str]] = None):
+        self.bot = recorder
+        self.user_data = dict(user_data or {})
+        self.args = args or []
+        self.job_queue = None
+        self.application = FakeApplication()
+
+
+# ===========================
+# СЦЕНАРИИ ОБРАБОТЧИКОВ
+# ===========================
+# role: от чьего имени вызывать; text/callback — входящее сообщение или кнопка;
+# user_data — состояние диалога к моменту вызова; iterations — множитель числа прогонов
+HANDLER_CASES = {
+    'my_income': {'role': 'user', 'text': '💰 Мой доход'},
+    'my_statistics': {'role': 'user', 'text': '📊 Моя статистика'},
+    'since_last_salary': {'role': 'user', 'text': '🧾 С последней зарплаты'},
+    'my_plan': {'role': 'user', 'text': '📅 Мой план'},
+    'plans_overview': {'role': 'admin', 'text': '🎯 Прогресс планов'},
+    'my_calendar': {'role': 'user', 'text': '📅 Мой календарь'},
+    'full_statistics': {'role': 'admin', 'text': '📊 Полная статистика'},
+    'current_balance': {'role': 'admin', 'text': '⚙️ Текущий баланс'},
+    'ratings': {'role': 'admin', 'text': '🏆 Рейтинг девушек'},
+    'ratings_window_selected': {'role': 'admin', 'callback': 'ratings_month'},
+    'calendar_all': {'role': 'admin', 'text': '📅 График выходных'},
+    'ics_export_selected': {'role': 'admin', 'callback': 'ics_export'},
+    'all_videos': {'role': 'admin', 'text': '🎬 Все видео'},
+    'payment_history': {'role': 'admin', 'text': '📈 История выплат'},
+    'salary_payment': {'role': 'admin', 'text': '💸 Выплатить зарплату'},
+    'payroll_selected': {'role': 'admin', 'callback': 'pay_all_preview'},
+    'dayoff_requests': {'role': 'admin', 'text': '🔔 Запросы выходных'},
+    'upload_count_entered': {'role': 'user', 'text': '3', 'user_data': {'user_name': '{user}'}},
+    'video_name_entered': {'role': 'user', 'text': 'Видео бенчмарка',
+                           'user_data': {'user_name': '{user}', 'video_type': 'grok'}},
+    'broadcast_send': {'role': 'admin', 'text': 'Проверка связи'},
+    'export_excel': {'role': 'admin', 'text': '📊 Экспорт в Excel', 'iterations': 0.1},
+}
+
+
+async def call_handler(name: str, case: Dict, user_id: int, user_name: str) -> RecordingBot:
+    """Один вызов обработчика на свежих фейковых объектах"""
+    recorder = RecordingBot()
+    user_data = {
+        key: value.format(user=user_name) if isinstance(value, str) else value
+        for key, value in case.get('user_data', {}).items()
+    }
+    update = FakeUpdate(recorder, user_id, case.get('text'), case.get('callback'))
+    context = FakeContext(recorder, user_data)
+    await getattr(bot, name)(update, context)
+    return recorder
+
+
+async def bench_handler(name: str, case: Dict, iterations: int) -> Dict:
+    """Время и выделения памяти на вызов обработчика"""
+    user_name = next(iter(bot.USERS_CONFIG))
+    user_id = bot.ADMINS[0] if case['role'] == 'admin' else bot.db['users'][user_name]['telegram_id']
+    runs = max(1, int(iterations * case.get('iterations', 1)))
+
+    # Прогрев (ленивые импорты, кэши)
+    recorder = await call_handler(name, case, user_id, user_name)
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await call_handler(name, case, user_id, user_name)
+        timings.append(time.perf_counter() - started)
+
+    # Память меряем отдельно: tracemalloc сам по себе замедляет код
+    tracemalloc.start()
+    peaks = []
+    allocated = []
+    for _ in range(min(runs, 5)):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        await call_handler(name, case, user_id, user_name)
+        after, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        allocated.append(after - before)
+    tracemalloc.stop()
+
+    return {
+        'runs': runs,
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'peak_alloc_kib': statistics.median(peaks) / 1024,
+        'retained_kib': statistics.median(allocated) / 1024,
+        'outgoing_calls': len(recorder.calls)
+    }
+
+
+async def run(sizes: List[int], handlers: List[str], users: int, iterations: int, seed: int) -> Dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        bot.DB_FILE = os.path.join(workdir, 'bot_database.json')
+        for size in sizes:
+            print(f"📦 {size} видео")
+            results[str(size)] = {}
+            for name in handlers:
+                # Каждый обработчик получает одну и ту же исходную БД
+                use_database(generate_database(users=users, videos=size, seed=seed))
+                bot.save_database(bot.db)
+                result = await bench_handler(name, HANDLER_CASES[name], iterations)
+                results[str(size)][name] = result
+                print(f"  {name:<22} {result['median_ms']:10.2f} мс  пик {result['peak_alloc_kib']:10.1f} КиБ")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки обработчиков бота")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--handlers', nargs='+', default=list(HANDLER_CASES), choices=list(HANDLER_CASES))
+    parser.add_argument('--users', type=int, default=6)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='handler_bench_results.json')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sizes, args.handlers, args.users, args.iterations, args.seed))
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'started_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'params': vars(args)
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🚦 НАГРУЗОЧНЫЙ ТЕСТ БОТА БЕЗ СЕТИ
+
+Поднимает локальную заглушку Telegram Bot API (getUpdates, sendMessage,
+editMessageText, answerCallbackQuery, sendDocument), запускает настоящее
+приложение из telegram_bot.build_application() против неё и проигрывает
+сценарии пользователей с заданной интенсивностью: девушки создают и
+загружают видео, админы выплачивают зарплату и делают экспорт.
+
+В конце печатает задержку «обновление → ответ бота» (p50/p95/p99),
+пропускную способность и долю ошибок.
+
+Запуск:
+    python loadtest.py --workers 20 --sessions 500 --rate 10
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+import telegram_bot as bot
+from benchmark import generate_database, use_database
+
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+
+# Сценарии: шаг = (тип, данные, ожидаемые ответы [(метод, префикс текста или None)])
+SESSIONS = {
+    'create_video': ('user', [
+        ('text', '🎬 Создала видео', [('sendMessage', '🎬 Выбери')]),
+        ('callback', 'video_type_{video_type}', [('editMessageText', None)]),
+        ('text', 'Видео нагрузочного теста {n}', [('sendMessage', '✅ Видео добавлено')]),
+    ]),
+    'upload_video': ('user', [
+        ('text', '📤 Загрузила видео', [('sendMessage', '📤')]),
+        ('text', '{count}', [('sendMessage', '✅ Загрузка')]),
+    ]),
+    'my_income': ('user', [
+        ('text', '💰 Мой доход', [('sendMessage', '💰 ТВОЙ ДОХОД')]),
+    ]),
+    'pay_salary': ('admin', [
+        ('text', '💸 Выплатить зарплату', [('sendMessage', '💸 Кому'), ('sendMessage', '✅ Никому')]),
+        ('callback', 'pay_salary_{worker}', [('editMessageText', None)]),
+    ]),
+    'full_statistics': ('admin', [
+        ('text', '📊 Полная статистика', [('sendMessage', '📊 ПОЛНАЯ')]),
+    ]),
+    'export_excel': ('admin', [
+        ('text', '📊 Экспорт в Excel', [('sendDocument', None), ('sendMessage', '❌')]),
+    ]),
+}
+DEFAULT_MIX = "create_video=5,upload_video=2,my_income=2,pay_salary=1,full_statistics=1,export_excel=0.2"
+
+
+# ===========================
+# ЗАГЛУШКА BOT API
+# ===========================
+class FakeBotAPI:
+    """Минимальный HTTP-сервер, отвечающий как Telegram Bot API"""
+
+    def __init__(self):
+        self.updates: List[Dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.callback_chats: Dict[str, int] = {}
+        self.waiters: Dict[int, List[Tuple[List, asyncio.Future]]] = {}
+        self.calls: Dict[str, int] = {}
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    # --- приём обновлений от драйвера ---
+    def push_update(self, payload: Dict) -> int:
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        self.updates.append(dict(payload, update_id=update_id))
+        self.new_updates.set()
+        return update_id
+
+    def message_object(self, chat_id: int, text: str, sender: Dict) -> Dict:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": sender,
+            "text": text
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return message
+
+    def expect(self, chat_id: int, expected: List) -> asyncio.Future:
+        """Ожидание ответа бота в чате, подходящего под один из шаблонов"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(chat_id, []).append((expected, future))
+        return future
+
+    def notify(self, chat_id: int, method: str, params: Dict):
+        text = params.get('text') or params.get('caption') or ''
+        waiters = self.waiters.get(chat_id, [])
+        for item in list(waiters):
+            expected, future = item
+            if future.done():
+                waiters.remove(item)
+                continue
+            for expected_method, prefix in expected:
+                if method == expected_method and (prefix is None or text.startswith(prefix)):
+                    future.set_result((method, params))
+                    waiters.remove(item)
+                    return
+
+    # --- HTTP ---
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                path = request_line.decode('latin-1').split()[1]
+                method = path.rsplit('/', 1)[-1]
+                params = parse_params(headers.get('content-type', ''), body)
+                result = await self.dispatch(method, params)
+
+                payload = json.dumps({"ok": True, "result": result}).encode('utf-8')
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1')
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionResetError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Соединение закрыто клиентом или заглушка останавливается
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, params: Dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method in ('sendMessage', 'sendDocument'):
+            chat_id = int(params['chat_id'])
+            self.notify(chat_id, method, params)
+            return self.message_object(chat_id, params.get('text', ''), BOT_USER)
+        if method == 'editMessageText':
+            chat_id = int(params.get('chat_id', 0))
+            self.notify(chat_id, method, params)
+            return self.message_object(chat_id, params.get('text', ''), BOT_USER)
+        if method == 'answerCallbackQuery':
+            chat_id = self.callback_chats.pop(params.get('callback_query_id'), None)
+            if chat_id is not None:
+                self.notify(chat_id, method, params)
+            return True
+        return True
+
+    async def get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get('offset', 0) or 0)
+        timeout = min(float(params.get('timeout', 0) or 0), 1.0)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+
+def parse_params(content_type: str, body: bytes) -> Dict:
+    """Параметры запроса из form-urlencoded или multipart тела"""
+    params = {}
+    if content_type.startswith('multipart/form-data'):
+        for name, value in re.findall(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', body, re.S):
+            params[name.decode()] = value.decode('utf-8', 'replace')
+    elif body:
+        for key, values in parse_qs(body.decode('utf-8')).items():
+            params[key] = values[0]
+    if 'chat_id' in params:
+        params['chat_id'] = params['chat_id'].strip('"')
+    return params
+
+
+# ===========================
+# ДРАЙВЕР СЦЕНАРИЕВ
+# ===========================
+class Driver:
+    """Проигрывание сценариев пользователей против заглушки"""
+
+    def __init__(self, api: FakeBotAPI, workers: Dict[str, int], admins: List[int],
+                 step_timeout: float, seed: int):
+        self.api = api
+        self.workers = workers
+        self.admins = admins
+        self.step_timeout = step_timeout
+        self.rng = random.Random(seed)
+        self.locks = {chat_id: asyncio.Lock() for chat_id in list(workers.values()) + admins}
+        self.latencies: Dict[str, List[float]] = {}
+        self.steps_ok = 0
+        self.steps_failed = 0
+        self.sessions_ok = 0
+        self.sessions_failed = 0
+        self.counter = 0
+
+    def user_object(self, chat_id: int) -> Dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+
+    def send_text(self, chat_id: int, text: str):
+        self.api.push_update({"message": self.api.message_object(chat_id, text, self.user_object(chat_id))})
+
+    def send_callback(self, chat_id: int, data: str):
+        query_id = f"cq{self.api.next_update_id}"
+        self.api.callback_chats[query_id] = chat_id
+        self.api.push_update({"callback_query": {
+            "id": query_id,
+            "from": self.user_object(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": self.api.message_object(chat_id, "…", BOT_USER)
+        }})
+
+    async def run_session(self, name: str):
+        role, steps = SESSIONS[name]
+        chat_id = self.rng.choice(list(self.workers.values()) if role == 'user' else self.admins)
+        self.counter += 1
+        values = {
+            'video_type': self.rng.choice(['a2e', 'makefilm', 'grok']),
+            'n': self.counter,
+            'count': self.rng.randint(1, 5),
+            'worker': self.rng.choice(list(self.workers))
+        }
+
+        async with self.locks[chat_id]:
+            last_params = None
+            for kind, template, expected in steps:
+                # Кнопки есть только если бот их прислал (например, есть кому платить)
+                if kind == 'callback' and last_params is not None and 'reply_markup' not in last_params:
+                    break
+                future = self.api.expect(chat_id, expected)
+                started = time.perf_counter()
+                payload = template.format(**values)
+                if kind == 'text':
+                    self.send_text(chat_id, payload)
+                else:
+                    self.send_callback(chat_id, payload)
+                try:
+                    _, last_params = await asyncio.wait_for(future, self.step_timeout)
+                except asyncio.TimeoutError:
+                    self.steps_failed += 1
+                    self.sessions_failed += 1
+                    # Сбрасываем незавершённый диалог
+                    self.send_text(chat_id, '/cancel')
+                    return
+                self.latencies.setdefault(f"{name}:{kind}", []).append(time.perf_counter() - started)
+                self.steps_ok += 1
+        self.sessions_ok += 1
+
+    async def run(self, sessions: int, rate: float, mix: Dict[str, float]):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        tasks = []
+        for _ in range(sessions):
+            tasks.append(asyncio.create_task(self.run_session(self.rng.choices(names, weights)[0])))
+            await asyncio.sleep(self.rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Квантиль по отсортированной выборке"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Разбор смеси сценариев «name=weight,…»"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SESSIONS:
+            raise SystemExit(f"Неизвестный сценарий: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def run_load_test(args) -> Dict:
+    """Подъём заглушки и бота, прогон сценариев, сбор результатов"""
+    # Рабочий каталог (БД, снимок, копии) удаляется после прогона
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as workdir:
+        bot.DB_FILE = os.path.join(workdir, 'bot_database.json')
+        data = generate_database(users=args.workers, videos=args.videos, seed=args.seed)
+        use_database(data)
+        bot.save_database(bot.db)
+        workers = {name: config['telegram_id'] for name, config in data['users'].items()}
+
+        api = FakeBotAPI()
+        await api.start()
+        application = bot.build_application(TOKEN, base_url=api.base_url)
+
+        async with application:
+            await bot.on_startup(application)
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=1)
+
+            driver = Driver(api, workers, bot.ADMINS + [bot.HUSBAND_ID], args.timeout, args.seed)
+            started = time.perf_counter()
+            await driver.run(args.sessions, args.rate, parse_mix(args.mix))
+            elapsed = time.perf_counter() - started
+
+            await application.updater.stop()
+            await application.stop()
+            await bot.on_shutdown(application)
+        await api.stop()
+
+    all_latencies = [value for values in driver.latencies.values() for value in values]
+    handler_errors = sum(entry['errors'] for entry in bot.METRICS['handlers'].values())
+    total_steps = driver.steps_ok + driver.steps_failed
+    return {
+        'params': vars(args),
+        'elapsed_seconds': elapsed,
+        'sessions_ok': driver.sessions_ok,
+        'sessions_failed': driver.sessions_failed,
+        'throughput_steps_per_second': driver.steps_ok / elapsed if elapsed else 0.0,
+        'error_rate': driver.steps_failed / total_steps if total_steps else 0.0,
+        'handler_errors': handler_errors,
+        'latency': {
+            'p50': percentile(all_latencies, 0.5),
+            'p95': percentile(all_latencies, 0.95),
+            'p99': percentile(all_latencies, 0.99),
+            'mean': statistics.mean(all_latencies) if all_latencies else 0.0
+        },
+        'latency_by_step': {
+            name: {'count': len(values), 'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+            for name, values in sorted(driver.latencies.items())
+        },
+        'api_calls': api.calls
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument('--workers', type=int, default=20, help="число девушек")
+    parser.add_argument('--videos', type=int, default=10000, help="размер исходной БД")
+    parser.add_argument('--sessions', type=int, default=200, help="сколько сценариев проиграть")
+    parser.add_argument('--rate', type=float, default=5.0, help="новых сценариев в секунду")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="веса сценариев name=weight,…")
+    parser.add_argument('--timeout', type=float, default=30.0, help="таймаут ответа на шаг, с")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load_test(args))
+
+    print(f"⏱️  {result['elapsed_seconds']:.1f} с, сценариев: {result['sessions_ok']} ок / {result['sessions_failed']} с ошибкой")
+    print(f"🚀 Пропускная способность: {result['throughput_steps_per_second']:.1f} шагов/с")
+    print(f"❌ Доля ошибок: {result['error_rate'] * 100:.1f}% (ошибок в обработчиках: {result['handler_errors']})")
+    latency = result['latency']
+    print(f"📈 Задержка p50/p95/p99: {latency['p50'] * 1000:.0f}/{latency['p95'] * 1000:.0f}/{latency['p99'] * 1000:.0f} мс")
+    for name, entry in result['latency_by_step'].items():
+        print(f"  {name:<28} {entry['count']:>6}  p50 {entry['p50'] * 1000:7.0f} мс  p95 {entry['p95'] * 1000:7.0f} мс")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,11 +16,28 @@
 ✅ Экспорт в Excel
 """
 
+import time
+IMPORT_STARTED = time.perf_counter()
+
+import io
 import os
+import sys
+import gzip
+import hmac
 import json
+import hashlib
+import marshal
+import asyncio
+import bisect
+import heapq
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+import ipaddress
+import functools
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, unquote
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     Application,
@@ -31,6 +48,10 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
+
+import analytics
 
 # ===========================
 # НАСТРОЙКА ЛОГИРОВАНИЯ
@@ -56,6 +77,10 @@ ADVANCE_USER, ADVANCE_AMOUNT, ADVANCE_CONFIRM = 400, 401, 402
 DAYOFF_DATE, DAYOFF_REASON, DAYOFF_APPROVE = 500, 501, 502
 ADMIN_DAYOFF_WHO, ADMIN_DAYOFF_DATES = 600, 601
 
+# Ограничения Telegram на длину сообщений
+TELEGRAM_MESSAGE_LIMIT = 4096
+MAX_REPORT_MESSAGES = 10
+
 # Администраторы (Telegram ID)
 ADMINS = [2147091471]  # ЗАМЕНИ НА СВОЙ TELEGRAM ID
 HUSBAND_ID = 2106439695  # ЗАМЕНИ НА TELEGRAM ID МУЖА
@@ -102,19 +127,626 @@ USERS_CONFIG = {
     }
 }
 
+# ===========================
+# МЕТРИКИ
+# ===========================
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_LOG_INTERVAL = 300  # секунд между сводками метрик в логе
+
+def new_histogram() -> Dict:
+    """Пустая гистограмма задержек"""
+    return {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'count': 0, 'sum': 0.0}
+
+def observe(histogram: Dict, seconds: float):
+    """Добавление замера в гистограмму"""
+    histogram['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    histogram['count'] += 1
+    histogram['sum'] += seconds
+
+def histogram_quantile(histogram: Dict, q: float) -> float:
+    """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+    if not histogram['count']:
+        return 0.0
+    rank = q * histogram['count']
+    seen = 0
+    for i, count in enumerate(histogram['buckets']):
+        if seen + count >= rank and count:
+            if i == len(LATENCY_BUCKETS):
+                return LATENCY_BUCKETS[-1]
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+            return lower + (LATENCY_BUCKETS[i] - lower) * (rank - seen) / count
+        seen += count
+    return LATENCY_BUCKETS[-1]
+
+METRICS = {
+    'handlers': {},  # имя обработчика → счётчики и гистограмма
+    'api': {},       # метод Bot API → счётчики и гистограмма
+    'api_retry_after': {},  # метод Bot API → число ответов 429
+    'db_save': new_histogram(),
+    'cache': {},     # имя кэша → попадания и промахи
+    'loop_lag': 0.0,
+    'loop_lag_max': 0.0,
+    'loop_stalls': {},  # обработчик → число блокировок event loop
+    'maintenance': {}   # фоновая задача → запуски, ошибки, превышения бюджета
+}
+
+# Состояние event loop для watchdog: последний «пульс», текущий обработчик
+# и число обработчиков, выполняющихся прямо сейчас
+LOOP_STATE = {'heartbeat': 0.0, 'thread_id': None, 'handler': None, 'active': 0}
+
+# Профилирование по команде /profile (None — выключено)
+PROFILE_STATE = {'profiler': None, 'updates_left': None, 'chat_id': None}
+
+def record_call(group: str, name: str, seconds: float, error: bool = False):
+    """Учёт одного вызова обработчика или метода Bot API"""
+    entry = METRICS[group].get(name)
+    if entry is None:
+        entry = METRICS[group][name] = {'calls': 0, 'errors': 0, 'latency': new_histogram()}
+    entry['calls'] += 1
+    if error:
+        entry['errors'] += 1
+    observe(entry['latency'], seconds)
+
+def count_cache(name: str, hit: bool):
+    """Учёт попадания или промаха кэша"""
+    entry = METRICS['cache'].setdefault(name, {'hits': 0, 'misses': 0})
+    entry['hits' if hit else 'misses'] += 1
+
+def instrument_handler(callback, routed: bool = False):
+    """Обёртка обработчика: число вызовов, ошибки и задержка
+
+    routed — кнопка меню, которую вызывает handle_message: обновление уже
+    посчитано внешней обёрткой, поэтому для профилирования оно не считается.
+    """
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        error = False
+        previous = LOOP_STATE['handler']
+        LOOP_STATE['handler'] = name
+        LOOP_STATE['active'] += 1
+        profiling_updates = not routed and PROFILE_STATE['updates_left'] is not None
+        try:
+            if not DB_STATE['loaded']:
+                # БД ещё грузится в фоне — ждём, не блокируя event loop
+                await asyncio.to_thread(ensure_database)
+            return await callback(update, context)
+        except DatabaseBusy:
+            error = True
+            if update.effective_message:
+                await update.effective_message.reply_text("⏳ Идёт восстановление БД из копии, повтори через минуту")
+        except Exception:
+            error = True
+            raise
+        finally:
+            LOOP_STATE['handler'] = previous
+            LOOP_STATE['active'] -= 1
+            record_call('handlers', name, time.perf_counter() - started, error)
+            if profiling_updates and PROFILE_STATE['updates_left'] is not None:
+                PROFILE_STATE['updates_left'] -= 1
+                if PROFILE_STATE['updates_left'] <= 0:
+                    PROFILE_STATE['updates_left'] = None
+                    context.application.create_task(finish_profiling(context.bot))
+
+    wrapper.instrumented = True
+    return wrapper
+
+def instrument_application(application: Application):
+    """Оборачивание всех зарегистрированных обработчиков (включая диалоги)"""
+    def instrument(handler):
+        if isinstance(handler, ConversationHandler):
+            nested = handler.entry_points + handler.fallbacks
+            for state_handlers in handler.states.values():
+                nested += state_handlers
+            for inner in nested:
+                instrument(inner)
+        elif not getattr(handler.callback, 'instrumented', False):
+            handler.callback = instrument_handler(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+    # Кнопки меню без диалога вызываются из handle_message — метрики по каждой
+    for label, callback in MENU_ROUTES.items():
+        if not getattr(callback, 'instrumented', False):
+            MENU_ROUTES[label] = instrument_handler(callback, routed=True)
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API с замером времени каждого вызова"""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        error = True
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+            error = code >= 400
+            if code == 429:
+                METRICS['api_retry_after'][api_method] = METRICS['api_retry_after'].get(api_method, 0) + 1
+            return code, payload
+        finally:
+            record_call('api', api_method, time.perf_counter() - started, error)
+
+def format_latency(histogram: Dict) -> str:
+    """Квантили задержки в миллисекундах"""
+    return "/".join(
+        f"{histogram_quantile(histogram, q) * 1000:.0f}" for q in (0.5, 0.95, 0.99)
+    )
+
+def build_metrics_report() -> List[List[str]]:
+    """Сборка отчёта по метрикам в виде блоков строк"""
+    blocks = [["📈 МЕТРИКИ", "Задержки: p50/p95/p99, мс"]]
+
+    block = ["⚙️ ОБРАБОТЧИКИ:"]
+    by_total_time = sorted(
+        METRICS['handlers'].items(), key=lambda x: x[1]['latency']['sum'], reverse=True
+    )
+    for name, entry in by_total_time:
+        block.append(
+            f"• {name}: {entry['calls']} выз., {entry['errors']} ош., {format_latency(entry['latency'])}"
+        )
+    blocks.append(block)
+
+    if STARTUP_TIMINGS:
+        blocks.append(["🚀 ЗАПУСК:"] + [
+            f"• {phase}: {seconds * 1000:.0f} мс" for phase, seconds in STARTUP_TIMINGS.items()
+        ] + [f"• источник БД: {DB_STATE['source'] or '—'}"])
+
+    save = METRICS['db_save']
+    blocks.append([
+        "💾 СОХРАНЕНИЕ БД:",
+        f"• {save['count']} раз, всего {save['sum']:.2f} с, {format_latency(save)}"
+    ])
+
+    if METRICS['loop_stalls']:
+        block = [f"🐢 БЛОКИРОВКИ EVENT LOOP (макс. задержка {METRICS['loop_lag_max']:.2f} с):"]
+        for name, count in sorted(METRICS['loop_stalls'].items(), key=lambda x: x[1], reverse=True):
+            block.append(f"• {name}: {count}")
+        blocks.append(block)
+
+    block = ["📡 BOT API:"]
+    for name, entry in sorted(METRICS['api'].items()):
+        block.append(
+            f"• {name}: {entry['calls']} выз., {entry['errors']} ош., {format_latency(entry['latency'])}"
+        )
+    blocks.append(block)
+
+    if METRICS['maintenance']:
+        block = ["🧹 ОБСЛУЖИВАНИЕ:"]
+        for name, entry in sorted(METRICS['maintenance'].items()):
+            block.append(
+                f"• {name}: {entry['runs']} зап., {entry['errors']} ош., "
+                f"{entry['over_budget']} сверх бюджета, {entry['deferred']} отлож., "
+                f"{format_latency(entry['latency'])}"
+            )
+        blocks.append(block)
+
+    return blocks
+
+async def log_metrics_summary(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая сводка метрик в лог"""
+    handlers = METRICS['handlers'].values()
+    calls = sum(entry['calls'] for entry in handlers)
+    errors = sum(entry['errors'] for entry in handlers)
+    api_calls = sum(entry['calls'] for entry in METRICS['api'].values())
+    api_errors = sum(entry['errors'] for entry in METRICS['api'].values())
+    slowest = sorted(
+        METRICS['handlers'].items(),
+        key=lambda x: histogram_quantile(x[1]['latency'], 0.95),
+        reverse=True
+    )[:3]
+    slowest_text = ", ".join(
+        f"{name} {histogram_quantile(entry['latency'], 0.95) * 1000:.0f} мс" for name, entry in slowest
+    )
+    logger.info(
+        f"📈 Метрики: обработчиков вызвано {calls} (ошибок {errors}), "
+        f"сохранений БД {METRICS['db_save']['count']} "
+        f"(p95 {histogram_quantile(METRICS['db_save'], 0.95) * 1000:.0f} мс), "
+        f"вызовов API {api_calls} (ошибок {api_errors}); "
+        f"медленнее всех по p95: {slowest_text or '—'}"
+    )
+
+# ===========================
+# PROMETHEUS-ЭНДПОИНТ
+# ===========================
+# Локальный HTTP-порт с метриками в текстовом формате Prometheus.
+# Выключен по умолчанию: включается переменной окружения METRICS_PORT.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+LOOP_LAG_INTERVAL = 0.25  # секунд между замерами задержки event loop
+
+def prometheus_label(value: str) -> str:
+    """Экранирование значения метки"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_histogram(lines: List[str], name: str, histogram: Dict, labels: str = ""):
+    """Вывод гистограммы в формате Prometheus"""
+    prefix = f"{labels}," if labels else ""
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram["count"]}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram['sum']}")
+    lines.append(f"{name}_count{suffix} {histogram['count']}")
+
+def render_prometheus_metrics(application: Optional[Application] = None) -> str:
+    """Сборка всех метрик в текстовом формате Prometheus"""
+    lines = []
+
+    handlers = sorted(METRICS['handlers'].items())
+    lines.append("# TYPE bot_handler_calls_total counter")
+    for name, entry in handlers:
+        lines.append(f'bot_handler_calls_total{{handler="{prometheus_label(name)}"}} {entry["calls"]}')
+    lines.append("# TYPE bot_handler_errors_total counter")
+    for name, entry in handlers:
+        lines.append(f'bot_handler_errors_total{{handler="{prometheus_label(name)}"}} {entry["errors"]}')
+    lines.append("# TYPE bot_handler_latency_seconds histogram")
+    for name, entry in handlers:
+        prometheus_histogram(lines, "bot_handler_latency_seconds", entry['latency'],
+                             f'handler="{prometheus_label(name)}"')
+
+    lines.append("# TYPE bot_db_save_seconds histogram")
+    prometheus_histogram(lines, "bot_db_save_seconds", METRICS['db_save'])
+    lines.append("# TYPE bot_db_size_bytes gauge")
+    current = current_database_file()
+    db_size = os.path.getsize(current[1]) if current else 0
+    lines.append(f"bot_db_size_bytes {db_size}")
+
+    api = sorted(METRICS['api'].items())
+    lines.append("# TYPE bot_api_calls_total counter")
+    for name, entry in api:
+        lines.append(f'bot_api_calls_total{{method="{prometheus_label(name)}"}} {entry["calls"]}')
+    lines.append("# TYPE bot_api_errors_total counter")
+    for name, entry in api:
+        lines.append(f'bot_api_errors_total{{method="{prometheus_label(name)}"}} {entry["errors"]}')
+    lines.append("# TYPE bot_api_retry_after_total counter")
+    for name, count in sorted(METRICS['api_retry_after'].items()):
+        lines.append(f'bot_api_retry_after_total{{method="{prometheus_label(name)}"}} {count}')
+    lines.append("# TYPE bot_api_latency_seconds histogram")
+    for name, entry in api:
+        prometheus_histogram(lines, "bot_api_latency_seconds", entry['latency'],
+                             f'method="{prometheus_label(name)}"')
+
+    lines.append("# TYPE bot_event_loop_lag_seconds gauge")
+    lines.append(f"bot_event_loop_lag_seconds {METRICS['loop_lag']}")
+    lines.append("# TYPE bot_event_loop_lag_max_seconds gauge")
+    lines.append(f"bot_event_loop_lag_max_seconds {METRICS['loop_lag_max']}")
+
+    caches = sorted(METRICS['cache'].items())
+    lines.append("# TYPE bot_event_loop_stalls_total counter")
+    for name, count in sorted(METRICS['loop_stalls'].items()):
+        lines.append(f'bot_event_loop_stalls_total{{handler="{prometheus_label(name)}"}} {count}')
+
+    lines.append("# TYPE bot_cache_hits_total counter")
+    for name, entry in caches:
+        lines.append(f'bot_cache_hits_total{{cache="{prometheus_label(name)}"}} {entry["hits"]}')
+    lines.append("# TYPE bot_cache_misses_total counter")
+    for name, entry in caches:
+        lines.append(f'bot_cache_misses_total{{cache="{prometheus_label(name)}"}} {entry["misses"]}')
+
+    maintenance = sorted(METRICS['maintenance'].items())
+    for counter in ('runs', 'errors', 'over_budget', 'deferred'):
+        lines.append(f"# TYPE bot_maintenance_{counter}_total counter")
+        for name, entry in maintenance:
+            lines.append(f'bot_maintenance_{counter}_total{{task="{prometheus_label(name)}"}} {entry[counter]}')
+    lines.append("# TYPE bot_maintenance_duration_seconds histogram")
+    for name, entry in maintenance:
+        prometheus_histogram(lines, "bot_maintenance_duration_seconds", entry['latency'],
+                             f'task="{prometheus_label(name)}"')
+
+    lines.append("# TYPE bot_startup_seconds gauge")
+    for phase, seconds in sorted(STARTUP_TIMINGS.items()):
+        lines.append(f'bot_startup_seconds{{phase="{prometheus_label(phase)}"}} {seconds}')
+
+    lines.append("# TYPE bot_queue_depth gauge")
+    if application is not None:
+        lines.append(f'bot_queue_depth{{queue="updates"}} {application.update_queue.qsize()}')
+        outbox = application.bot_data.get('outbox')
+        if outbox is not None:
+            lines.append(f'bot_queue_depth{{queue="outbox"}} {outbox.qsize()}')
+    lines.append(f"bot_reminders_scheduled {len(REMINDERS['heap'])}")
+
+    return "\n".join(lines) + "\n"
+
+async def serve_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                application: Application):
+    """Обработка одного HTTP-запроса к эндпоинту метрик"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки не нужны, просто дочитываем их
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        path = parts[1] if len(parts) > 1 else ''
+        route, _, query = path.partition('?')
+        calendar = ics_route(route, query)
+        if route == '/metrics':
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+            body = render_prometheus_metrics(application).encode('utf-8')
+        elif calendar is not None:
+            # Календарь отдаётся по мере генерации (по месяцам), без Content-Length
+            writer.write(
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/calendar; charset=utf-8\r\n"
+                "Connection: close\r\n\r\n".encode('latin-1')
+            )
+            for chunk in ics_stream(calendar or None):
+                writer.write(chunk)
+                await writer.drain()
+            return
+        else:
+            status = "404 Not Found"
+            content_type = "text/plain; charset=utf-8"
+            body = b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Ошибка эндпоинта метрик: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(application: Application):
+    """Запуск HTTP-эндпоинта метрик, если задан METRICS_PORT"""
+    if not METRICS_PORT:
+        return None
+
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_metrics_request(reader, writer, application),
+        METRICS_HOST, METRICS_PORT
+    )
+    logger.info(f"📈 Метрики Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if ics_http_enabled():
+        logger.info(f"📅 Календарь выходных: http://{METRICS_HOST}:{METRICS_PORT}/calendar.ics")
+    else:
+        logger.warning(f"📅 Календарь по HTTP выключен: METRICS_HOST={METRICS_HOST} без ICS_TOKEN")
+    return server
+
+async def measure_loop_lag():
+    """Фоновый замер задержки планирования event loop"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL)
+        LOOP_STATE['heartbeat'] = time.monotonic()
+        METRICS['loop_lag'] = lag
+        METRICS['loop_lag_max'] = max(METRICS['loop_lag_max'], lag)
+
+# ===========================
+# WATCHDOG EVENT LOOP
+# ===========================
+# Если event loop не отвечает дольше порога, отдельный поток снимает стек
+# потока loop'а и пишет его в лог вместе с именем текущего обработчика.
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '0.5'))  # секунд
+
+def start_loop_watchdog() -> threading.Event:
+    """Запуск потока-сторожа для текущего event loop (возвращает флаг остановки)"""
+    stop = threading.Event()
+    LOOP_STATE['thread_id'] = threading.get_ident()
+    LOOP_STATE['heartbeat'] = time.monotonic()
+
+    def watch():
+        reported = None
+        while not stop.wait(LOOP_STALL_THRESHOLD / 2):
+            heartbeat = LOOP_STATE['heartbeat']
+            stalled = time.monotonic() - heartbeat - LOOP_LAG_INTERVAL
+            if stalled < LOOP_STALL_THRESHOLD or heartbeat == reported:
+                continue
+            # Каждую остановку сообщаем один раз
+            reported = heartbeat
+            report_loop_stall(stalled)
+
+    threading.Thread(target=watch, name="loop-watchdog", daemon=True).start()
+    return stop
+
+def report_loop_stall(stalled: float):
+    """Запись блокирующего вызова: стек потока loop'а и текущий обработчик"""
+    handler = LOOP_STATE['handler'] or '—'
+    frame = sys._current_frames().get(LOOP_STATE['thread_id'])
+    stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен\n"
+    METRICS['loop_stalls'][handler] = METRICS['loop_stalls'].get(handler, 0) + 1
+    logger.warning(
+        f"🐢 Event loop заблокирован {stalled:.2f} с, обработчик: {handler}\n{stack}"
+    )
+
 # ===========================
 # БАЗА ДАННЫХ
 # ===========================
+# Состояние загрузки БД: до первого обращения db — пустой словарь,
+# который заполняется на месте (ссылки на него остаются валидными).
+# version растёт при каждом изменении видео и выплат (для кэшей аналитики).
+# restoring — идёт восстановление копии: сохранение БД запрещено
+DB_STATE = {'loaded': False, 'source': None, 'version': 0, 'restoring': False}
+DB_LOAD_LOCK = threading.Lock()
+STARTUP_TIMINGS = {}  # этап запуска → секунды
+
+# Формат файла БД: auto — компактный msgpack, если модуль установлен, иначе JSON
+DB_FORMAT = os.getenv('DB_FORMAT', 'auto')
+
+# Таблицы, которые в компактном формате хранятся по столбцам
+COLUMNAR_TABLES = ('videos', 'payments', 'days_off_requests')
+
+def rows_to_columns(rows: List[Dict]) -> Dict:
+    """Список однородных записей → столбцы (повторяющиеся строки — через словарь)"""
+    if not rows or any(not isinstance(row, dict) for row in rows):
+        return {'rows': rows}
+    keys = list(rows[0])
+    if any(list(row) != keys for row in rows):
+        return {'rows': rows}
+    columns = {}
+    for key in keys:
+        values = [row[key] for row in rows]
+        unique = set(values) if all(isinstance(v, str) for v in values) else None
+        if unique is not None and len(unique) * 2 <= len(values):
+            dictionary = sorted(unique)
+            codes = {value: i for i, value in enumerate(dictionary)}
+            columns[key] = {'dict': dictionary, 'codes': [codes[v] for v in values]}
+        else:
+            columns[key] = {'values': values}
+    return {'keys': keys, 'columns': columns}
+
+def columns_to_rows(table: Dict) -> List[Dict]:
+    """Обратное преобразование столбцов в список записей"""
+    if 'rows' in table:
+        return table['rows']
+    columns = []
+    for key in table['keys']:
+        column = table['columns'][key]
+        if 'dict' in column:
+            dictionary = column['dict']
+            columns.append([dictionary[code] for code in column['codes']])
+        else:
+            columns.append(column['values'])
+    keys = table['keys']
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+def dump_json(data: Dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def load_json(raw: bytes) -> Dict:
+    return json.loads(raw.decode('utf-8'))
+
+def dump_msgpack(data: Dict) -> bytes:
+    import msgpack
+    packed = dict(data)
+    for table in COLUMNAR_TABLES:
+        if table in packed:
+            packed[table] = rows_to_columns(packed[table])
+    return msgpack.packb({'format': 'columnar-v1', 'data': packed}, use_bin_type=True)
+
+def load_msgpack(raw: bytes) -> Dict:
+    import msgpack
+    payload = msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    if payload.get('format') != 'columnar-v1':
+        raise ValueError(f"неизвестный формат {payload.get('format')}")
+    data = payload['data']
+    for table in COLUMNAR_TABLES:
+        if table in data:
+            data[table] = columns_to_rows(data[table])
+    return data
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# Реестр форматов: имя → расширение файла, сериализация в bytes и обратно.
+# available — проверка наличия необязательного модуля
+SERIALIZERS = {
+    'json': {'extension': '.json', 'dump': dump_json, 'load': load_json, 'available': lambda: True},
+    'msgpack': {'extension': '.msgpack', 'dump': dump_msgpack, 'load': load_msgpack,
+                'available': msgpack_available},
+}
+
+def database_file(fmt: str) -> str:
+    """Путь к файлу БД в заданном формате (рядом с DB_FILE)"""
+    return os.path.splitext(DB_FILE)[0] + SERIALIZERS[fmt]['extension']
+
+@functools.lru_cache(maxsize=None)
+def serializer_available(fmt: str) -> bool:
+    return SERIALIZERS[fmt]['available']()
+
+def save_format() -> str:
+    """Формат, в котором сохраняется БД"""
+    if DB_FORMAT != 'auto':
+        return DB_FORMAT
+    return 'msgpack' if serializer_available('msgpack') else 'json'
+
+def current_database_file() -> Optional[tuple]:
+    """Самый свежий файл БД: (формат, путь)
+
+    Если самый свежий файл прочитать нечем, загружать более старый нельзя —
+    следующее сохранение затёрло бы данные, поэтому выбрасывается RuntimeError.
+    """
+    found = []
+    for fmt in SERIALIZERS:
+        path = database_file(fmt)
+        if os.path.exists(path):
+            found.append((os.stat(path).st_mtime_ns, fmt, path))
+    if not found:
+        return None
+    _, fmt, path = max(found)
+    if not serializer_available(fmt):
+        raise RuntimeError(f"Файл БД {path} нельзя прочитать: модуль {fmt} не установлен")
+    return fmt, path
+
+def snapshot_file() -> str:
+    """Путь к бинарному снимку БД (лежит рядом с файлом БД)"""
+    return f"{DB_FILE}.snapshot"
+
+def snapshot_source() -> Optional[List]:
+    """Ключ актуальности снимка: файл БД, его mtime и размер"""
+    current = current_database_file()
+    if current is None:
+        return None
+    stat = os.stat(current[1])
+    return [current[1], stat.st_mtime_ns, stat.st_size]
+
+def load_snapshot() -> Optional[Dict]:
+    """Загрузка бинарного снимка, если он соответствует текущему файлу БД"""
+    path = snapshot_file()
+    if not os.path.exists(path):
+        return None
+    try:
+        source = snapshot_source()
+        if source is None:
+            return None
+        with open(path, 'rb') as f:
+            snapshot = marshal.loads(f.read())
+        if snapshot.get('source') != source:
+            return None
+        return snapshot['data']
+    except Exception as e:
+        logger.error(f"Ошибка загрузки снимка БД: {e}")
+        return None
+
+def write_snapshot(data: Dict):
+    """Запись бинарного снимка БД для быстрого следующего старта"""
+    try:
+        source = snapshot_source()
+        if source is None or not DB_STATE['loaded'] or DB_STATE['restoring']:
+            return
+        tmp_path = f"{snapshot_file()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(marshal.dumps({'source': source, 'data': database_to_plain(data)}))
+        os.replace(tmp_path, snapshot_file())
+    except Exception as e:
+        logger.error(f"Ошибка записи снимка БД: {e}")
+
 def load_database() -> Dict:
-    """Загрузка базы данных из JSON"""
-    if os.path.exists(DB_FILE):
+    """Загрузка базы данных (свежий бинарный снимок, msgpack или JSON)"""
+    data = load_snapshot()
+    if data is not None:
+        DB_STATE['source'] = 'snapshot'
+        return data
+    
+    current = current_database_file()
+    if current is not None:
+        fmt, path = current
         try:
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(path, 'rb') as f:
+                data = SERIALIZERS[fmt]['load'](f.read())
+            DB_STATE['source'] = fmt
+            return data
         except Exception as e:
             logger.error(f"Ошибка загрузки БД: {e}")
     
     # Инициализация базы данных с выходными
+    DB_STATE['source'] = 'new'
     return {
         "users": USERS_CONFIG.copy(),
         "videos": [],
@@ -125,18 +757,1275 @@ def load_database() -> Dict:
         "admin_days_off": {
             "admin": [],
             "husband": []
-        }
+        },
+        "settlements": {},
+        "archive": empty_archive()
     }
 
+class DatabaseBusy(Exception):
+    """Сохранение БД невозможно: идёт восстановление копии"""
+
+def install_database(data: Dict):
+    """Подмена содержимого db на месте (ссылки на словарь остаются валидными)"""
+    db.clear()
+    db.update(data)
+    rebuild_indexes()
+
+def ensure_database() -> Dict:
+    """Загрузка БД при первом обращении (потокобезопасно)"""
+    if DB_STATE['loaded']:
+        return db
+    with DB_LOAD_LOCK:
+        if not DB_STATE['loaded']:
+            started = time.perf_counter()
+            install_database(database_to_records(load_database()))
+            DB_STATE['loaded'] = True
+            STARTUP_TIMINGS['db_load'] = time.perf_counter() - started
+            logger.info(
+                f"💾 БД загружена за {STARTUP_TIMINGS['db_load'] * 1000:.0f} мс "
+                f"(источник: {DB_STATE['source']}, импорт модуля: {STARTUP_TIMINGS['import'] * 1000:.0f} мс)"
+            )
+    return db
+
 def save_database(db: Dict):
-    """Сохранение базы данных в JSON"""
+    """Сохранение базы данных (формат — save_format())"""
+    # Во время восстановления запись затёрла бы файлы копии содержимым памяти,
+    # которое сейчас будет заменено: вызывающий получает ошибку, а не тихий пропуск
+    if DB_STATE['restoring']:
+        raise DatabaseBusy("идёт восстановление БД из резервной копии")
+    started = time.perf_counter()
     try:
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(db, f, ensure_ascii=False, indent=2)
+        fmt = save_format()
+        path = database_file(fmt)
+        raw = SERIALIZERS[fmt]['dump'](database_to_plain(db))
+        # Запись через временный файл: при сбое старая БД остаётся целой
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+        # Файлы БД в других форматах устарели: без этого запуск без msgpack
+        # подхватил бы старый JSON и затем перезаписал бы им данные
+        for other in SERIALIZERS:
+            other_path = database_file(other)
+            if other != fmt and os.path.exists(other_path):
+                os.remove(other_path)
     except Exception as e:
         logger.error(f"Ошибка сохранения БД: {e}")
+    finally:
+        observe(METRICS['db_save'], time.perf_counter() - started)
+
+db: Dict = {}
+
+# ===========================
+# ХРАНИЛИЩЕ ВИДЕО И ВЫПЛАТ
+# ===========================
+# Видео и выплаты в памяти — объекты со __slots__ вместо словарей:
+# без словаря на каждую запись, имена и типы интернированы.
+# На диске (JSON, msgpack, снимок) — по-прежнему обычные словари
+class Video:
+    """Запись о видео"""
+    __slots__ = ('id', 'user', 'type', 'name', 'amount', 'created_at')
+
+    def __init__(self, id: int, user: str, type: str, name: str, amount: int, created_at: str):
+        self.id = id
+        self.user = sys.intern(user)
+        self.type = sys.intern(type)
+        self.name = name
+        self.amount = amount
+        self.created_at = created_at
+
+    @classmethod
+    def from_dict(cls, row: Dict) -> 'Video':
+        return cls(row['id'], row['user'], row['type'], row['name'], row['amount'], row['created_at'])
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'user': self.user,
+            'type': self.type,
+            'name': self.name,
+            'amount': self.amount,
+            'created_at': self.created_at
+        }
+
+class Payment:
+    """Запись о выплате (зарплата или аванс)"""
+    __slots__ = ('id', 'user', 'amount', 'type', 'created_at')
+
+    def __init__(self, id: int, user: str, amount: int, type: str, created_at: str):
+        self.id = id
+        self.user = sys.intern(user)
+        self.amount = amount
+        self.type = sys.intern(type)
+        self.created_at = created_at
+
+    @classmethod
+    def from_dict(cls, row: Dict) -> 'Payment':
+        return cls(row['id'], row['user'], row['amount'], row['type'], row['created_at'])
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'user': self.user,
+            'amount': self.amount,
+            'type': self.type,
+            'created_at': self.created_at
+        }
+
+RECORD_TABLES = {'videos': Video, 'payments': Payment}
+
+def database_to_records(data: Dict) -> Dict:
+    """Загруженные словари видео и выплат → записи (на месте)"""
+    for table, record_class in RECORD_TABLES.items():
+        data[table] = [
+            row if isinstance(row, record_class) else record_class.from_dict(row)
+            for row in data.get(table, [])
+        ]
+    # БД без расчётных точек (до их появления) — строим по истории выплат
+    if 'settlements' not in data:
+        data['settlements'] = build_settlements(data['videos'], data['payments'])
+    data.setdefault('archive', empty_archive())
+    # Счётчики id: архив может забрать все записи таблицы, и id по последней
+    # горячей записи начались бы заново. Без счётчика (старая БД) — по максимуму
+    # из горячих записей и сегментов архива
+    next_ids = data.setdefault('next_ids', {})
+    for table in RECORD_TABLES:
+        if table not in next_ids:
+            ids = [record.id for record in data[table]]
+            for month in data['archive']['months']:
+                ids.extend(row['id'] for row in load_segment(month).get(table, []))
+            next_ids[table] = max(ids, default=0) + 1
+        if data[table]:
+            next_ids[table] = max(next_ids[table], data[table][-1].id + 1)
+    normalize_dayoff_requests(data)
+    normalize_plans(data)
+    return data
+
+def database_to_plain(data: Dict) -> Dict:
+    """Копия БД, где записи снова словари (для сериализации)"""
+    plain = dict(data)
+    for table in RECORD_TABLES:
+        plain[table] = [
+            row if isinstance(row, dict) else row.to_dict()
+            for row in data.get(table, [])
+        ]
+    return plain
+
+def next_record_id(table: str) -> int:
+    """Следующий id таблицы (счётчик хранится в БД, архив его не сбрасывает)"""
+    number = db['next_ids'][table]
+    db['next_ids'][table] = number + 1
+    return number
+
+def add_video(user_name: str, video_type: str, name: str, amount: int) -> Video:
+    """Добавление видео (сохранение БД — на вызывающем)"""
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    video = Video(next_record_id('videos'), user_name, video_type, name, amount, created_at)
+    db['videos'].append(video)
+    DB_STATE['version'] += 1
+    index_video(video, 1)
+    return video
+
+def add_payment(user_name: str, amount: int, payment_type: str) -> Payment:
+    """Добавление выплаты (сохранение БД — на вызывающем)"""
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    payment = Payment(next_record_id('payments'), user_name, amount, payment_type, created_at)
+    db['payments'].append(payment)
+    DB_STATE['version'] += 1
+    return payment
+
+def iter_videos(user_name: Optional[str] = None, since: Optional[str] = None,
+                start: int = 0) -> Iterable[Video]:
+    """Видео (все или одного пользователя), при since — с этой даты,
+    start — позиция в списке, с которой начинать"""
+    for video in db['videos'][start:] if start else db['videos']:
+        if user_name is not None and video.user != user_name:
+            continue
+        if since is not None and video.created_at < since:
+            continue
+        yield video
+
+def iter_payments(user_name: Optional[str] = None, start: int = 0) -> Iterable[Payment]:
+    """Выплаты (все или одного пользователя), start — позиция в списке"""
+    for payment in db['payments'][start:] if start else db['payments']:
+        if user_name is None or payment.user == user_name:
+            yield payment
+
+def latest_first(records: Iterable, limit: Optional[int] = None) -> List:
+    """Записи от новых к старым (первые limit)"""
+    ordered = sorted(records, key=lambda x: x.created_at, reverse=True)
+    return ordered if limit is None else ordered[:limit]
+
+def delete_video(video: Video) -> bool:
+    """Удаление конкретной записи о видео (сохранение БД — на вызывающем)"""
+    position = next((i for i, v in enumerate(db['videos']) if v is video), None)
+    if position is None:
+        return False
+    del db['videos'][position]
+    unsettle_video(video, position)
+    DB_STATE['version'] += 1
+    index_video(video, -1)
+    return True
+
+# ===========================
+# РАСЧЁТНЫЕ ТОЧКИ
+# ===========================
+# Выплата зарплаты закрывает расчёт с пользователем: в db['settlements']
+# запоминаются итоги на этот момент (перенесённый баланс, видео, заработок
+# по типам) и позиции в списках видео и выплат. Баланс и статистика
+# считаются как итоги точки плюс записи после этих позиций
+NO_SETTLEMENT = {
+    'balance': 0, 'videos': 0, 'earnings': 0, 'by_type': {},
+    'video_pos': 0, 'payment_pos': 0, 'settled_at': None
+}
+
+def get_settlement(user_name: str) -> Dict:
+    """Последняя расчётная точка пользователя (только для чтения)"""
+    return db['settlements'].get(user_name, NO_SETTLEMENT)
+
+def record_settlement(user_name: str):
+    """Расчётная точка сразу после выплаты зарплаты"""
+    stats = get_user_stats(user_name)
+    db['settlements'][user_name] = {
+        'balance': stats['balance'],
+        'videos': stats['total_videos'],
+        'earnings': stats['total_earnings'],
+        'by_type': {t: [data['count'], data['earnings']] for t, data in stats['by_type'].items()},
+        'video_pos': len(db['videos']),
+        'payment_pos': len(db['payments']),
+        'settled_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def unsettle_video(video: Video, position: int):
+    """Сдвиг позиций после удаления видео; удалённое до точки видео вычитается из её итогов"""
+    for user_name, settlement in db['settlements'].items():
+        if position >= settlement['video_pos']:
+            continue
+        settlement['video_pos'] -= 1
+        if user_name == video.user:
+            settlement['balance'] -= video.amount
+            settlement['videos'] -= 1
+            settlement['earnings'] -= video.amount
+            if video.type in settlement['by_type']:
+                settlement['by_type'][video.type][0] -= 1
+                settlement['by_type'][video.type][1] -= video.amount
+
+def build_settlements(videos: List[Video], payments: List[Payment]) -> Dict:
+    """Расчётные точки по последней зарплате каждого пользователя в истории
+
+    Видео до точки — созданные не позже выплаты (списки идут по времени).
+    """
+    last_salary = {}
+    for position, payment in enumerate(payments):
+        if payment.type == 'salary':
+            last_salary[payment.user] = position
+
+    settlements = {}
+    for user_name, payment_position in last_salary.items():
+        paid_at = payments[payment_position].created_at
+        video_pos = bisect.bisect_right(videos, paid_at, key=lambda v: v.created_at)
+        settlement = {
+            'balance': 0, 'videos': 0, 'earnings': 0,
+            'by_type': {t: [0, 0] for t in ['a2e', 'makefilm', 'grok', 'upload']},
+            'video_pos': video_pos, 'payment_pos': payment_position + 1, 'settled_at': paid_at
+        }
+        for video in videos[:video_pos]:
+            if video.user == user_name:
+                settlement['videos'] += 1
+                settlement['earnings'] += video.amount
+                if video.type in settlement['by_type']:
+                    settlement['by_type'][video.type][0] += 1
+                    settlement['by_type'][video.type][1] += video.amount
+        paid = sum(p.amount for p in payments[:payment_position + 1] if p.user == user_name)
+        settlement['balance'] = settlement['earnings'] - paid
+        settlements[user_name] = settlement
+    return settlements
+
+# ===========================
+# АРХИВ
+# ===========================
+# Видео и выплаты старше ARCHIVE_HORIZON_DAYS, уже закрытые расчётной
+# точкой, переносятся в помесячные сжатые сегменты рядом с БД. В горячей
+# БД от них остаются только агрегаты по дням (db['archive']), из которых
+# строятся индексы и аналитика; сами записи читаются из сегментов по запросу
+ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', '180'))
+# Рассмотренные запросы выходных хранятся в рабочей БД столько дней после даты выходного
+DAYOFF_REQUESTS_RETENTION_DAYS = int(os.getenv('DAYOFF_REQUESTS_RETENTION_DAYS', '30'))
+# Перенос в архив и резервное копирование не должны идти одновременно:
+# копия должна видеть сегменты и рабочую БД в согласованном состоянии.
+# Удаление видео тоже ждёт блокировку: иначе запись, удалённая во время
+# записи сегментов, осталась бы в архиве
+ARCHIVE_LOCK = asyncio.Lock()
+
+def empty_archive() -> Dict:
+    """Агрегаты архива: месяцы и {день: {пользователь: {тип: [количество, сумма]}}}"""
+    return {'months': [], 'videos': {}, 'payments': {}}
+
+def archive_dir() -> str:
+    """Каталог сегментов архива (рядом с файлом БД)"""
+    return os.path.splitext(DB_FILE)[0] + '_archive'
+
+def segment_file(month: str, fmt: str) -> str:
+    return os.path.join(archive_dir(), f"{month}{SERIALIZERS[fmt]['extension']}.gz")
+
+def find_segment(month: str) -> Optional[tuple]:
+    """Файл сегмента месяца в любом доступном формате: (формат, путь)"""
+    for fmt in SERIALIZERS:
+        path = segment_file(month, fmt)
+        if os.path.exists(path) and serializer_available(fmt):
+            return fmt, path
+    return None
+
+# Таблица сегмента → поле времени, по которому она упорядочена. Кроме видео
+# и выплат в сегменты попадают рассмотренные запросы выходных (журнал)
+SEGMENT_TABLES = {'videos': 'created_at', 'payments': 'created_at', 'days_off_requests': 'requested_at'}
+
+def load_segment(month: str) -> Dict:
+    """Записи месяца из архива {'videos': [...], 'payments': [...], ...} (словари)"""
+    found = find_segment(month)
+    if found is None:
+        return {'videos': [], 'payments': []}
+    fmt, path = found
+    with open(path, 'rb') as f:
+        return SERIALIZERS[fmt]['load'](gzip.decompress(f.read()))
+
+def write_segment(month: str, batch: Dict[str, List]):
+    """Дописывание записей в сегмент месяца (повторно перенесённые — без дублей)"""
+    found = find_segment(month)
+    segment = load_segment(month)
+    for table, time_key in SEGMENT_TABLES.items():
+        if table not in batch:
+            continue
+        rows = segment.setdefault(table, [])
+        seen = {(row['id'], row[time_key]) for row in rows}
+        for record in batch[table]:
+            row = record if isinstance(record, dict) else record.to_dict()
+            if (row['id'], row[time_key]) not in seen:
+                rows.append(row)
+        rows.sort(key=lambda row: row[time_key])
+    
+    fmt = save_format()
+    path = segment_file(month, fmt)
+    os.makedirs(archive_dir(), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(gzip.compress(SERIALIZERS[fmt]['dump'](segment)))
+    os.replace(tmp_path, path)
+    # Сегмент был в другом формате — он полностью переписан в новый
+    if found and found[1] != path:
+        os.remove(found[1])
+
+def archive_aggregates(table: str) -> Iterable[tuple]:
+    """Агрегаты архива строками (пользователь, тип, день, количество, сумма)"""
+    for day, users in db['archive'][table].items():
+        for user_name, types in users.items():
+            for record_type, (count, total) in types.items():
+                yield user_name, record_type, day, count, total
+
+def iter_archived(table: str) -> Iterable:
+    """Записи таблицы из всех сегментов архива (от старых к новым)"""
+    record_class = RECORD_TABLES.get(table)
+    for month in sorted(db['archive']['months']):
+        for row in load_segment(month).get(table, []):
+            yield record_class.from_dict(row) if record_class else row
+
+def iter_history(table: str) -> Iterable:
+    """Вся история таблицы: архив, затем горячая БД"""
+    yield from iter_archived(table)
+    yield from db[table]
+
+def select_archivable(cutoff: str) -> Dict[str, Dict[str, List]]:
+    """Закрытые расчётом записи старше cutoff, по месяцам"""
+    batches = {}
+    for table, position_key in (('videos', 'video_pos'), ('payments', 'payment_pos')):
+        for position, record in enumerate(db[table]):
+            # Списки идут по времени — дальше только более новые записи
+            if record.created_at >= cutoff:
+                break
+            if position >= get_settlement(record.user)[position_key]:
+                continue
+            month = record.created_at[:7]
+            batches.setdefault(month, {'videos': [], 'payments': []})[table].append(record)
+    return batches
+
+def commit_archive(batches: Dict[str, Dict[str, List]]) -> Dict[str, int]:
+    """Удаление перенесённых записей из горячей БД с учётом их в агрегатах"""
+    archive = db['archive']
+    moved = {}
+    for table, position_key in (('videos', 'video_pos'), ('payments', 'payment_pos')):
+        selected = {id(record) for batch in batches.values() for record in batch[table]}
+        removed_positions = [i for i, record in enumerate(db[table]) if id(record) in selected]
+        for i in removed_positions:
+            record = db[table][i]
+            users = archive[table].setdefault(record.created_at[:10], {})
+            entry = users.setdefault(record.user, {}).setdefault(record.type, [0, 0])
+            entry[0] += 1
+            entry[1] += record.amount
+        db[table] = [record for record in db[table] if id(record) not in selected]
+        # Позиции расчётных точек сдвигаются на число удалённых перед ними
+        for settlement in db['settlements'].values():
+            settlement[position_key] -= bisect.bisect_left(removed_positions, settlement[position_key])
+        moved[table] = len(removed_positions)
+    archive['months'] = sorted(set(archive['months']) | set(batches))
+    rebuild_indexes()
+    return moved
+
+async def run_archive_rollover(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Перенос закрытой истории старше горизонта в архив
+
+    now — от какого момента отсчитывается горизонт (по умолчанию — сейчас;
+    бенчмарк передаёт конец сгенерированной истории).
+    """
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=ARCHIVE_HORIZON_DAYS)).strftime("%Y-%m-%d")
+    async with ARCHIVE_LOCK:
+        batches = select_archivable(cutoff)
+        if not batches:
+            return {'videos': 0, 'payments': 0}
+        
+        # Сжатие и запись сегментов — в отдельном потоке, чтобы не блокировать цикл
+        for month, batch in sorted(batches.items()):
+            await asyncio.to_thread(write_segment, month, batch)
+        moved = commit_archive(batches)
+        save_database(db)
+    logger.info(
+        f"📦 В архив перенесено {moved['videos']} видео и {moved['payments']} выплат "
+        f"(до {cutoff}, месяцев: {len(batches)})"
+    )
+    return moved
+
+def select_archivable_requests(cutoff: str) -> Dict[str, Dict[str, List]]:
+    """Рассмотренные запросы выходных с датой раньше cutoff, по месяцу запроса"""
+    batches = {}
+    for request in db['days_off_requests']:
+        if request['status'] != 'pending' and request['date'] < cutoff:
+            month = request['requested_at'][:7]
+            batches.setdefault(month, {'days_off_requests': []})['days_off_requests'].append(request)
+    return batches
+
+async def run_dayoff_requests_rollover() -> int:
+    """Перенос старых рассмотренных запросов выходных в журнал архива"""
+    cutoff = (datetime.now() - timedelta(days=DAYOFF_REQUESTS_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    async with ARCHIVE_LOCK:
+        batches = select_archivable_requests(cutoff)
+        if not batches:
+            return 0
+        for month, batch in sorted(batches.items()):
+            await asyncio.to_thread(write_segment, month, batch)
+        # Одобренные выходные остаются в days_off_approved
+        moved = {id(r) for batch in batches.values() for r in batch['days_off_requests']}
+        db['days_off_requests'] = [r for r in db['days_off_requests'] if id(r) not in moved]
+        db['archive']['months'] = sorted(set(db['archive']['months']) | set(batches))
+        save_database(db)
+    logger.info(f"📦 В журнал архива перенесено {len(moved)} запросов выходных (до {cutoff})")
+    return len(moved)
+
+# ===========================
+# РЕЗЕРВНЫЕ КОПИИ
+# ===========================
+# Каждая копия — манифест backup_ГГГГММДД_ЧЧММСС.json со списком файлов
+# (рабочая БД и сегменты архива) и их sha256. Содержимое лежит в objects/
+# под своим хешем, поэтому неизменившиеся файлы не копируются повторно,
+# а копия без изменений не создаётся вовсе. Файлы БД пишутся атомарно
+# (os.replace), поэтому чтение в отдельном потоке видит целую версию
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', str(6 * 3600)))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '28'))
+
+def backup_dir() -> str:
+    """Каталог резервных копий (рядом с файлом БД)"""
+    return os.getenv('BACKUP_DIR') or os.path.splitext(DB_FILE)[0] + '_backups'
+
+def backup_sources() -> Dict[str, str]:
+    """Файлы для копирования: путь относительно каталога БД → полный путь"""
+    base = os.path.dirname(os.path.abspath(DB_FILE))
+    sources = {}
+    current = current_database_file()
+    if current:
+        sources[os.path.relpath(current[1], base)] = current[1]
+    if os.path.isdir(archive_dir()):
+        for name in sorted(os.listdir(archive_dir())):
+            if not name.endswith('.tmp'):
+                path = os.path.join(archive_dir(), name)
+                sources[os.path.relpath(path, base)] = path
+    return sources
+
+def list_backups() -> List[str]:
+    """Имена копий от старых к новым"""
+    if not os.path.isdir(backup_dir()):
+        return []
+    return sorted(
+        name[:-len('.json')] for name in os.listdir(backup_dir())
+        if name.startswith('backup_') and name.endswith('.json')
+    )
+
+def read_manifest(name: str) -> Dict:
+    with open(os.path.join(backup_dir(), f"{name}.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+def create_backup() -> Optional[str]:
+    """Новая копия (в рабочем потоке); None, если с прошлой копии ничего не изменилось"""
+    objects = os.path.join(backup_dir(), 'objects')
+    os.makedirs(objects, exist_ok=True)
+    
+    files = {}
+    for rel_path, path in backup_sources().items():
+        with open(path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        # Сегменты архива уже сжаты — их храним как есть
+        compressed = not path.endswith('.gz')
+        object_name = f"{digest}.gz" if compressed else digest
+        object_path = os.path.join(objects, object_name)
+        if not os.path.exists(object_path):
+            tmp_path = f"{object_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(raw) if compressed else raw)
+            os.replace(tmp_path, object_path)
+        files[rel_path] = {'sha256': digest, 'object': object_name, 'size': len(raw)}
+    
+    backups = list_backups()
+    if backups and read_manifest(backups[-1])['files'] == files:
+        return None
+    
+    name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    manifest_path = os.path.join(backup_dir(), f"{name}.json")
+    with open(f"{manifest_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'files': files},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    rotate_backups()
+    return name
+
+def rotate_backups():
+    """Удаление старых копий сверх BACKUP_KEEP и объектов, на которые никто не ссылается"""
+    backups = list_backups()
+    for name in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(backup_dir(), f"{name}.json"))
+    used = {
+        entry['object']
+        for name in list_backups()
+        for entry in read_manifest(name)['files'].values()
+    }
+    objects = os.path.join(backup_dir(), 'objects')
+    for object_name in os.listdir(objects):
+        if object_name not in used:
+            os.remove(os.path.join(objects, object_name))
+
+def read_backup_file(entry: Dict) -> bytes:
+    """Содержимое файла из копии с проверкой sha256"""
+    with open(os.path.join(backup_dir(), 'objects', entry['object']), 'rb') as f:
+        raw = f.read()
+    if entry['object'].endswith('.gz'):
+        raw = gzip.decompress(raw)
+    if hashlib.sha256(raw).hexdigest() != entry['sha256']:
+        raise ValueError("хеш не совпадает")
+    return raw
+
+def verify_backup(name: str) -> List[str]:
+    """Проверка копии: хеши всех файлов и читаемость БД; возвращает список проблем"""
+    problems = []
+    for rel_path, entry in read_manifest(name)['files'].items():
+        try:
+            raw = read_backup_file(entry)
+            fmt = next((f for f, options in SERIALIZERS.items()
+                        if rel_path.endswith(options['extension'])), None)
+            if fmt and serializer_available(fmt):
+                SERIALIZERS[fmt]['load'](raw)
+        except Exception as e:
+            problems.append(f"{rel_path}: {e}")
+    return problems
+
+def read_backup(name: str) -> Dict[str, bytes]:
+    """Все файлы копии в памяти: путь относительно каталога БД → содержимое"""
+    files = read_manifest(name)['files']
+    return {rel_path: read_backup_file(entry) for rel_path, entry in files.items()}
+
+def restore_backup(contents: Dict[str, bytes]):
+    """Запись файлов копии (read_backup) на место рабочих"""
+    base = os.path.dirname(os.path.abspath(DB_FILE))
+    restored = set()
+    for rel_path, raw in contents.items():
+        path = os.path.join(base, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(raw)
+        os.replace(f"{path}.tmp", path)
+        restored.add(os.path.abspath(path))
+    # Файлы, которых не было на момент копии, мешали бы выбору БД и архиву
+    for path in backup_sources().values():
+        if os.path.abspath(path) not in restored:
+            os.remove(path)
+    for fmt in SERIALIZERS:
+        path = database_file(fmt)
+        if os.path.exists(path) and os.path.abspath(path) not in restored:
+            os.remove(path)
+    if os.path.exists(snapshot_file()):
+        os.remove(snapshot_file())
+
+async def restore_database(name: str) -> str:
+    """Восстановление копии с перечитыванием БД; возвращает копию прежнего состояния
+
+    Файлы и чтение БД — в отдельном потоке, подмена db — в event loop, где
+    работают обработчики. Пока идёт восстановление, save_database выбрасывает
+    DatabaseBusy. При сбое БД перечитывается с диска.
+    """
+    # Копия читается в память до страховочной копии: её ротация может
+    # удалить восстанавливаемую копию, если она самая старая
+    contents = await asyncio.to_thread(read_backup, name)
+    DB_STATE['restoring'] = True
+    try:
+        # Текущее состояние тоже сохраняем — восстановление можно откатить
+        current = await asyncio.to_thread(create_backup) or list_backups()[-1]
+        await asyncio.to_thread(restore_backup, contents)
+        data = await asyncio.to_thread(lambda: database_to_records(load_database()))
+    except Exception:
+        install_database(await asyncio.to_thread(lambda: database_to_records(load_database())))
+        raise
+    else:
+        install_database(data)
+    finally:
+        DB_STATE['restoring'] = False
+        USER_NAME_CACHE.clear()
+    return current
+
+async def run_backup() -> Optional[str]:
+    """Резервная копия в отдельном потоке (обработка обновлений не блокируется)"""
+    async with ARCHIVE_LOCK:
+        name = await asyncio.to_thread(create_backup)
+    if name:
+        logger.info(f"💾 Резервная копия {name} создана")
+    else:
+        logger.info("💾 Резервная копия не нужна: изменений нет")
+    return name
+
+# ===========================
+# АНАЛИТИКА
+# ===========================
+# Колоночные таблицы видео и выплат для группировок (см. analytics.py);
+# пересобираются только после изменения записей
+ANALYTICS_CACHE = {'version': None}
+
+def analytics_tables() -> Dict:
+    """Колоночные таблицы {'videos': ..., 'payments': ...} для текущей БД"""
+    hit = ANALYTICS_CACHE['version'] == DB_STATE['version']
+    count_cache('analytics', hit)
+    if not hit:
+        ANALYTICS_CACHE['videos'] = analytics.build_table(db['videos'], archive_aggregates('videos'))
+        ANALYTICS_CACHE['payments'] = analytics.build_table(db['payments'], archive_aggregates('payments'))
+        ANALYTICS_CACHE['version'] = DB_STATE['version']
+    return ANALYTICS_CACHE
+
+def user_totals() -> Dict[str, Dict]:
+    """Видео, заработок, выплаты и баланс по каждому пользователю за всё время"""
+    tables = analytics_tables()
+    earned = analytics.group_by(tables['videos'], ('user',))
+    paid = analytics.group_by(tables['payments'], ('user',))
+    totals = {}
+    for user_name in USERS_CONFIG.keys():
+        videos = earned.get((user_name,), {'count': 0, 'sum': 0})
+        payments = paid.get((user_name,), {'count': 0, 'sum': 0})
+        totals[user_name] = {
+            'videos': videos['count'],
+            'earnings': videos['sum'],
+            'paid': payments['sum'],
+            'balance': videos['sum'] - payments['sum']
+        }
+    return totals
+
+# Индекс заработка по дням для сумм за произвольный период
+EARNINGS_INDEX = {'videos': analytics.EarningsIndex()}
+
+def rebuild_indexes():
+    """Пересборка индексов после загрузки или подмены БД"""
+    DB_STATE['version'] += 1
+    EARNINGS_INDEX['videos'] = analytics.EarningsIndex(db['videos'], archive_aggregates('videos'))
+    LEADERBOARDS.clear()
+    rebuild_dayoff_index()
+    rebuild_reminders()
+
+def index_video(video: Video, sign: int):
+    """Учёт добавленного (sign=1) или удалённого (sign=-1) видео в индексах"""
+    # Рейтинги — первыми: при смене периода они пересобираются по индексу,
+    # который ещё не содержит это видео
+    update_leaderboards(video, sign)
+    EARNINGS_INDEX['videos'].add(video.user, video.created_at, video.amount, sign)
+    update_plan_progress(video, sign)
+
+def period_earnings(start: datetime, end: datetime) -> Dict[str, Dict]:
+    """Количество видео и заработок каждого пользователя с start по end включительно"""
+    return {
+        user_name: EARNINGS_INDEX['videos'].range(user_name, start.date(), end.date())
+        for user_name in USERS_CONFIG.keys()
+    }
+
+# ===========================
+# РЕЙТИНГИ ПО ПЕРИОДАМ
+# ===========================
+# Для каждого окна — итоги пользователей с начала периода и два списка,
+# отсортированных по убыванию (видео и заработок). Списки обновляются
+# точечно через bisect при каждом видео, а при смене недели/месяца окно
+# пересобирается по индексу заработка — без прохода по всей истории
+LEADERBOARD_WINDOWS = {
+    'week': {'button': "📅 Неделя", 'title': "ЗА НЕДЕЛЮ"},
+    'month': {'button': "🗓 Месяц", 'title': "ЗА МЕСЯЦ"},
+    'all': {'button': "🏆 Всё время", 'title': "ЗА ВСЁ ВРЕМЯ"},
+}
+LEADERBOARD_TOP = 10
+LEADERBOARDS = {}  # окно → {'start', 'totals', 'by_videos', 'by_earnings'}
+
+def window_start(window: str) -> datetime:
+    """Начало текущего периода окна (полночь)"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == 'week':
+        return today - timedelta(days=today.weekday())
+    if window == 'month':
+        return today.replace(day=1)
+    return datetime.min
+
+def rebuild_leaderboard(window: str) -> Dict:
+    """Пересборка окна по индексу заработка (O(пользователи × log n))"""
+    start = window_start(window)
+    index = EARNINGS_INDEX['videos']
+    totals = {}
+    for user_name in USERS_CONFIG.keys():
+        entry = index.range(user_name, start.date(), datetime.max.date())
+        totals[user_name] = [entry['count'], entry['sum']]
+    board = {
+        'start': start,
+        'totals': totals,
+        'by_videos': sorted((-count, name) for name, (count, _) in totals.items()),
+        'by_earnings': sorted((-earned, name) for name, (_, earned) in totals.items())
+    }
+    LEADERBOARDS[window] = board
+    return board
+
+def get_leaderboard(window: str) -> Dict:
+    """Рейтинг окна за текущий период (с переходом на новый период)"""
+    board = LEADERBOARDS.get(window)
+    if board is None or board['start'] != window_start(window):
+        board = rebuild_leaderboard(window)
+    return board
+
+def move_ranking(ranking: List[tuple], old: Optional[tuple], new: tuple):
+    """Перестановка записи в отсортированном списке"""
+    if old is not None:
+        del ranking[bisect.bisect_left(ranking, old)]
+    bisect.insort(ranking, new)
+
+def update_leaderboards(video: Video, sign: int):
+    """Точечное обновление всех окон, в период которых попадает видео"""
+    for window in LEADERBOARD_WINDOWS:
+        board = get_leaderboard(window)
+        if video.created_at < board['start'].date().isoformat():
+            continue
+        totals = board['totals'].get(video.user)
+        old_count, old_earned = totals if totals else (None, None)
+        count = (old_count or 0) + sign
+        earned = (old_earned or 0) + sign * video.amount
+        board['totals'][video.user] = [count, earned]
+        move_ranking(board['by_videos'], None if totals is None else (-old_count, video.user), (-count, video.user))
+        move_ranking(board['by_earnings'], None if totals is None else (-old_earned, video.user), (-earned, video.user))
+
+def monthly_breakdown() -> Dict:
+    """Количество и сумма видео по месяцам за всю историю"""
+    return analytics.group_by(analytics_tables()['videos'], ('period',), period='month')
+
+# ===========================
+# КАЛЕНДАРЬ ВЫХОДНЫХ
+# ===========================
+# Индекс поверх days_off_approved, admin_days_off и days_off_requests:
+# дата → кто выходной, пользователь → отсортированные даты, месяц →
+# отсортированные записи календаря и ожидающие запросы по id. Одобрение
+# и новые запросы обновляют его точечно; version растёт при каждом
+# изменении календаря
+DAYOFF_INDEX = {'version': 0, 'by_date': {}, 'by_user': {}, 'by_month': {}, 'pending': {}}
+ADMIN_DAYOFF_REASONS = {'admin': 'Выходной админа', 'husband': 'Выходной мужа админа'}
 
-db = load_database()
+def add_calendar_entry(date_str: str, kind: str, who: str, reason: str):
+    """Запись в корзину месяца (kind: user, admin или husband)"""
+    bisect.insort(DAYOFF_INDEX['by_month'].setdefault(date_str[:7], []), (date_str, kind, who, reason))
+
+def index_approved_dayoff(user_name: str, dayoff: Dict):
+    """Учёт одобренного выходного девушки"""
+    DAYOFF_INDEX['by_date'].setdefault(dayoff['date'], set()).add(user_name)
+    bisect.insort(DAYOFF_INDEX['by_user'].setdefault(user_name, []), dayoff['date'])
+    add_calendar_entry(dayoff['date'], 'user', user_name, dayoff['reason'])
+    DAYOFF_INDEX['version'] += 1
+
+def rebuild_dayoff_index():
+    """Пересборка индекса выходных по БД"""
+    DAYOFF_INDEX.update(by_date={}, by_user={}, by_month={})
+    for user_name, daysoff_list in db.get('days_off_approved', {}).items():
+        for dayoff in daysoff_list:
+            index_approved_dayoff(user_name, dayoff)
+    for who, reason in ADMIN_DAYOFF_REASONS.items():
+        for date_str in db.get('admin_days_off', {}).get(who, []):
+            add_calendar_entry(date_str, who, who, reason)
+    DAYOFF_INDEX['pending'] = {
+        r['id']: r for r in db.get('days_off_requests', []) if r['status'] == 'pending'
+    }
+    DAYOFF_INDEX['version'] += 1
+
+def normalize_dayoff_requests(data: Dict):
+    """Счётчик id запросов выходных; повторяющиеся id старых БД получают новые
+
+    Раньше id брался из длины списка и мог повториться. Первый запрос с
+    таким id сохраняет его (кнопки в чатах вели именно к нему)
+    """
+    requests = data.setdefault('days_off_requests', [])
+    numbers = [len(requests)]
+    for request in requests:
+        prefix, _, number = request['id'].rpartition('_')
+        if prefix == 'req' and number.isdigit():
+            numbers.append(int(number))
+    next_id = max(data.get('days_off_next_id', 1), max(numbers) + 1)
+    seen = set()
+    for request in requests:
+        if request['id'] in seen:
+            logger.warning(f"Повторяющийся id запроса выходного {request['id']} → req_{next_id:03d}")
+            request['id'] = f"req_{next_id:03d}"
+            next_id += 1
+        seen.add(request['id'])
+    data['days_off_next_id'] = next_id
+
+def users_off_on(date_str: str) -> set:
+    """Девушки с одобренным выходным в этот день"""
+    return DAYOFF_INDEX['by_date'].get(date_str, set())
+
+def admins_off_on(date_str: str) -> List[str]:
+    """Кто из администрации не на связи в этот день"""
+    return [who for who in ADMIN_DAYOFF_REASONS if date_str in db['admin_days_off'].get(who, [])]
+
+def has_dayoff(user_name: str, date_str: str) -> bool:
+    dates = DAYOFF_INDEX['by_user'].get(user_name, [])
+    position = bisect.bisect_left(dates, date_str)
+    return position < len(dates) and dates[position] == date_str
+
+def dayoff_conflicts(user_name: str, date_str: str) -> List[str]:
+    """Кто ещё отдыхает в этот день (для решения по запросу)"""
+    lines = []
+    others = sorted(users_off_on(date_str) - {user_name})
+    if others:
+        lines.append(f"👥 Уже выходные в этот день ({len(others)}): {', '.join(others)}")
+    for who in admins_off_on(date_str):
+        lines.append(f"⚠️ {ADMIN_DAYOFF_REASONS[who]}")
+    return lines
+
+# ===========================
+# ПЛАНЫ
+# ===========================
+# План девушки: цель, период [start, deadline] (даты ГГГГ-ММ-ДД), какие
+# типы видео засчитываются (types, None — любые) и счётчик completed,
+# который обновляется при добавлении и удалении каждого видео
+PLAN_TYPE_WORDS = {
+    'видео': ['a2e', 'makefilm', 'grok'],
+    'любых': None, 'любые': None, 'любое': None,
+    'загрузок': ['upload'], 'загрузки': ['upload'],
+    'a2e': ['a2e'], 'makefilm': ['makefilm'], 'grok': ['grok'], 'upload': ['upload'],
+}
+# Начало названия дня недели в любом падеже и сокращение
+PLAN_WEEKDAYS = (('понед', 'пн'), ('вторн', 'вт'), ('сред', 'ср'), ('четв', 'чт'),
+                 ('пятн', 'пт'), ('субб', 'сб'), ('воскр', 'вс'))
+
+def parse_deadline(text: str, today: datetime) -> datetime:
+    """Дедлайн «пятницы», «вс» или «ДД.ММ» → ближайшая такая дата (не раньше today)"""
+    text = text.strip().lower()
+    if not text:
+        return today + timedelta(days=6 - today.weekday())
+    if '.' in text:
+        day, month = text.split('.')[:2]
+        deadline = datetime(today.year, int(month), int(day))
+        return deadline if deadline >= today else deadline.replace(year=today.year + 1)
+    for weekday, (stem, short) in enumerate(PLAN_WEEKDAYS):
+        if text.startswith(stem) or text == short:
+            return today + timedelta(days=(weekday - today.weekday()) % 7)
+    raise ValueError(f"непонятный дедлайн: {text}")
+
+def plan_matches(plan: Dict, video: Video) -> bool:
+    """Засчитывается ли видео в план (период и тип)"""
+    return (
+        plan['start'] <= video.created_at[:10] <= plan['deadline']
+        and (plan['types'] is None or video.type in plan['types'])
+    )
+
+def count_plan_progress(plan: Dict, videos: Iterable[Video]) -> int:
+    """Полный пересчёт выполненного (при создании плана и для старых БД)"""
+    return sum(1 for video in videos if video.user == plan['user'] and plan_matches(plan, video))
+
+def update_plan_progress(video: Video, sign: int):
+    """Точечное обновление счётчика плана при добавлении/удалении видео"""
+    plan = db['plans'].get(video.user)
+    if plan is not None and plan_matches(plan, video):
+        plan['completed'] += sign
+
+def normalize_plans(data: Dict):
+    """Планы старого формата (дедлайн текстом, completed не считался) → с датами и счётчиком"""
+    for plan in data.setdefault('plans', {}).values():
+        if 'start' in plan:
+            continue
+        created = datetime.strptime(plan['created_at'][:10], "%Y-%m-%d")
+        try:
+            deadline = parse_deadline(plan['deadline'] if plan['deadline'] != "неделю" else "", created)
+        except ValueError:
+            deadline = created + timedelta(days=6)
+        plan['start'] = created.strftime("%Y-%m-%d")
+        plan['deadline'] = deadline.strftime("%Y-%m-%d")
+        plan['types'] = PLAN_TYPE_WORDS.get(plan['video_type'])
+        plan['completed'] = count_plan_progress(plan, data['videos'])
+
+def plan_progress_line(plan: Dict) -> str:
+    """Прогресс плана одной строкой для обзора"""
+    target = plan['target_count']
+    percent = min(100, int(plan['completed'] / target * 100)) if target else 100
+    today = datetime.now().strftime("%Y-%m-%d")
+    if plan['completed'] >= target:
+        status = "🎉"
+    elif plan['deadline'] < today:
+        status = "⌛"
+    else:
+        status = "⏳"
+    return (
+        f"{status} {plan['user']}: {plan['completed']}/{target} {plan['video_type']} ({percent}%), "
+        f"до {format_date(plan['deadline'])}"
+    )
+
+# ===========================
+# НАПОМИНАНИЯ
+# ===========================
+# Все напоминания — в одной куче (время, срок годности, ключ). Задача
+# JobQueue раз в REMINDER_TICK секунд снимает с вершины наступившие и
+# кладёт сообщения в исходящую очередь; пока ничего не наступило, проверка
+# стоит O(1). Кучу можно пересобрать по планам и выходным в любой момент
+# (после загрузки БД), а отправленные ключи хранятся в db['reminders_sent'],
+# поэтому после перезапуска напоминания не повторяются. Ключ отмечается
+# отправленным, только когда очередь обработала все его сообщения: то, что
+# осталось в очереди при остановке, уйдёт после перезапуска.
+# Ключи: plan|<имя>|<создан>|<дней до дедлайна>, dayoff|<имя>|<дата>,
+# admin|<кто>|<дата>
+REMINDER_TICK = 60
+PLAN_REMINDER_DAYS = (2,)      # за сколько дней до дедлайна напоминать
+PLAN_REMINDER_HOUR = 10
+DAYOFF_REMINDER_HOUR = 19      # вечер накануне выходного
+OUTBOX_RATE = 20               # сообщений в секунду из исходящей очереди
+# in_flight: ключ → [сообщений ещё в очереди, срок годности]
+REMINDERS = {'heap': [], 'queued': set(), 'in_flight': {}}
+
+def push_reminder(due: datetime, valid_until: datetime, key: str):
+    """Постановка напоминания (повторная постановка и уже отправленные — пропускаются)"""
+    if key in REMINDERS['queued'] or key in REMINDERS['in_flight'] or key in db.get('reminders_sent', {}):
+        return
+    if valid_until <= datetime.now():
+        return
+    REMINDERS['queued'].add(key)
+    heapq.heappush(REMINDERS['heap'], (due, valid_until, key))
+
+def schedule_plan_reminders(plan: Dict):
+    deadline = datetime.strptime(plan['deadline'], "%Y-%m-%d")
+    created = datetime.strptime(plan['created_at'], "%Y-%m-%d %H:%M:%S")
+    for days in PLAN_REMINDER_DAYS:
+        due = deadline - timedelta(days=days) + timedelta(hours=PLAN_REMINDER_HOUR)
+        if due > created:
+            push_reminder(due, deadline + timedelta(days=1),
+                          f"plan|{plan['user']}|{plan['created_at']}|{days}")
+
+def schedule_dayoff_reminder(kind: str, who: str, date_str: str):
+    """Напоминание вечером накануне выходного (kind: dayoff или admin)"""
+    day = datetime.strptime(date_str, "%Y-%m-%d")
+    push_reminder(day - timedelta(days=1) + timedelta(hours=DAYOFF_REMINDER_HOUR), day,
+                  f"{kind}|{who}|{date_str}")
+
+def rebuild_reminders():
+    """Пересборка кучи по планам и выходным; просроченные отметки об отправке удаляются"""
+    now = datetime.now()
+    sent = db.get('reminders_sent', {})
+    for key in [key for key, valid_until in sent.items() if valid_until < now.strftime("%Y-%m-%d %H:%M:%S")]:
+        del sent[key]
+    REMINDERS['heap'] = []
+    REMINDERS['queued'] = set()
+    for plan in db.get('plans', {}).values():
+        if 'start' in plan:
+            schedule_plan_reminders(plan)
+    for user_name, dates in DAYOFF_INDEX['by_user'].items():
+        for date_str in dates:
+            schedule_dayoff_reminder('dayoff', user_name, date_str)
+    for who in ADMIN_DAYOFF_REASONS:
+        for date_str in db.get('admin_days_off', {}).get(who, []):
+            schedule_dayoff_reminder('admin', who, date_str)
+
+def girls_chat_ids() -> List[int]:
+    return [
+        data['telegram_id'] for data in db['users'].values()
+        if data.get('telegram_id') and not is_admin(data['telegram_id'])
+    ]
+
+def reminder_messages(key: str) -> List[tuple]:
+    """Сообщения напоминания [(chat_id, текст)]; пусто, если оно уже не актуально"""
+    kind, who, *rest = key.split('|')
+    if kind == 'plan':
+        created_at, _ = rest
+        plan = db['plans'].get(who)
+        chat_id = db['users'].get(who, {}).get('telegram_id')
+        if not plan or plan['created_at'] != created_at or not chat_id:
+            return []
+        if plan['completed'] >= plan['target_count']:
+            return []
+        days_left = (datetime.strptime(plan['deadline'], "%Y-%m-%d").date() - datetime.now().date()).days
+        return [(chat_id,
+                 f"⏰ НАПОМИНАНИЕ О ПЛАНЕ\n\n"
+                 f"До дедлайна ({format_date(plan['deadline'])}) осталось дней: {days_left}\n"
+                 f"✅ Выполнено: {plan['completed']}/{plan['target_count']} {plan['video_type']}\n\n"
+                 f"Ты успеешь! 💪")]
+    date_str = rest[0]
+    if kind == 'dayoff':
+        chat_id = db['users'].get(who, {}).get('telegram_id')
+        if not chat_id or not has_dayoff(who, date_str):
+            return []
+        return [(chat_id, f"🏖️ Завтра ({format_date(date_str)}) у тебя выходной. Хорошего отдыха!")]
+    if date_str not in db['admin_days_off'].get(who, []):
+        return []
+    who_name = "Администратор" if who == "admin" else "Муж администратора"
+    text = f"📅 Завтра ({format_date(date_str)}) {who_name.lower()} не на связи"
+    return [(chat_id, text) for chat_id in girls_chat_ids()]
+
+def due_reminders(now: datetime) -> List[tuple]:
+    """Снятие наступивших напоминаний с кучи → сообщения (chat_id, текст, ключ)"""
+    heap = REMINDERS['heap']
+    messages = []
+    sent = db.setdefault('reminders_sent', {})
+    while heap and heap[0][0] <= now:
+        _, valid_until, key = heapq.heappop(heap)
+        REMINDERS['queued'].discard(key)
+        if valid_until <= now:
+            continue
+        valid_until = valid_until.strftime("%Y-%m-%d %H:%M:%S")
+        key_messages = reminder_messages(key)
+        if key_messages:
+            REMINDERS['in_flight'][key] = [len(key_messages), valid_until]
+            messages.extend((chat_id, text, key) for chat_id, text in key_messages)
+        else:
+            # Напоминание уже не актуально — отправлять нечего
+            sent[key] = valid_until
+    return messages
+
+def reminder_processed(key: str):
+    """Сообщение напоминания обработано очередью; после последнего ключ отмечается отправленным"""
+    entry = REMINDERS['in_flight'].get(key)
+    if entry is None:
+        return
+    entry[0] -= 1
+    if entry[0] <= 0:
+        del REMINDERS['in_flight'][key]
+        db.setdefault('reminders_sent', {})[key] = entry[1]
+        try:
+            save_database(db)
+        except DatabaseBusy:
+            # После восстановления ключ возьмётся из копии — напоминание может повториться
+            logger.warning(f"⏰ Отметка об отправке {key} не сохранена: идёт восстановление БД")
+
+async def reminder_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Проверка вершины кучи и отправка наступивших напоминаний через очередь"""
+    heap = REMINDERS['heap']
+    if not DB_STATE['loaded'] or DB_STATE['restoring'] or not heap or heap[0][0] > datetime.now():
+        return
+    messages = due_reminders(datetime.now())
+    save_database(db)
+    outbox = context.application.bot_data.get('outbox')
+    for chat_id, text, key in messages:
+        if outbox is not None:
+            outbox.put_nowait((chat_id, text, key))
+        else:
+            await send_outgoing(context.bot, chat_id, text)
+            reminder_processed(key)
+    logger.info(f"⏰ Напоминаний отправлено в очередь: {len(messages)}")
+
+async def send_outgoing(bot, chat_id: int, text: str) -> bool:
+    """Отправка одного сообщения; при 429 — ждём, сколько просит Telegram, и повторяем"""
+    for attempt in range(3):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return True
+        except RetryAfter as e:
+            if attempt == 2:
+                logger.error(f"Не удалось отправить сообщение {chat_id}: 429 после 3 попыток ({e})")
+                return False
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+            return False
+
+async def run_outbox(application: Application):
+    """Исходящая очередь: не больше OUTBOX_RATE сообщений в секунду"""
+    outbox = application.bot_data['outbox']
+    while True:
+        chat_id, text, key = await outbox.get()
+        started = time.perf_counter()
+        await send_outgoing(application.bot, chat_id, text)
+        reminder_processed(key)
+        await asyncio.sleep(max(0.0, 1 / OUTBOX_RATE - (time.perf_counter() - started)))
+
+# ===========================
+# ОБСЛУЖИВАНИЕ
+# ===========================
+# Фоновые задачи на JobQueue: ночью — архив, снимок, сверка и чистка,
+# утром — прогрев кэшей для отчётов админа, каждые несколько часов —
+# резервная копия. Запуск сдвигается на случайный jitter, а если бот
+# в этот момент обрабатывает обновления, задача откладывается. Бюджет —
+# ожидаемое время работы: задачи с циклами прерываются по нему сами,
+# превышение попадает в метрики
+MAINTENANCE_BUSY_DELAY = 60  # секунд до повторной попытки, если бот занят
+MAINTENANCE_MAX_DEFERRALS = 10
+
+class MaintenanceBudgetExceeded(Exception):
+    """Задача исчерпала бюджет времени и остановилась"""
+
+def check_budget(deadline: float):
+    if time.perf_counter() > deadline:
+        raise MaintenanceBudgetExceeded()
+
+async def compact_database(deadline: float, bot) -> str:
+    """Перенос закрытой истории в архив и свежий снимок для быстрого старта"""
+    moved = await run_archive_rollover()
+    check_budget(deadline)
+    await asyncio.to_thread(write_snapshot, db)
+    return f"в архив: {moved['videos']} видео, {moved['payments']} выплат"
+
+async def verify_ledgers(deadline: float, bot) -> str:
+    """Сверка баланса и статистики (от расчётных точек) с полной историей и индексами"""
+    totals = user_totals()
+    indexed = period_earnings(datetime.min, datetime.max)
+    problems = []
+    for user_name, expected in totals.items():
+        check_budget(deadline)
+        stats = get_user_stats(user_name)
+        checks = {
+            'видео': (stats['total_videos'], expected['videos']),
+            'заработок': (stats['total_earnings'], expected['earnings']),
+            'баланс': (stats['balance'], expected['balance']),
+            'индекс видео': (indexed[user_name]['count'], expected['videos']),
+            'индекс заработка': (indexed[user_name]['sum'], expected['earnings']),
+        }
+        for what, (actual, full) in checks.items():
+            if actual != full:
+                problems.append(f"{user_name}: {what} {actual} ≠ {full}")
+    
+    if not problems:
+        return f"расхождений нет ({len(totals)} польз.)"
+    
+    # Индексы и рейтинги строятся заново; расчётные точки — только вручную
+    rebuild_indexes()
+    logger.error("❗ Сверка итогов: " + "; ".join(problems))
+    for admin_id in ADMINS:
+        try:
+            await bot.send_message(
+                chat_id=admin_id,
+                text="❗ СВЕРКА ИТОГОВ: НАЙДЕНЫ РАСХОЖДЕНИЯ\n\n" + "\n".join(problems[:30])
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    return f"расхождений: {len(problems)}"
+
+async def archive_dayoff_requests(deadline: float, bot) -> str:
+    """Перенос рассмотренных запросов выходных, чья дата давно прошла, в журнал архива"""
+    moved = await run_dayoff_requests_rollover()
+    return f"в журнал: {moved} запросов"
+
+async def prewarm_caches(deadline: float, bot) -> str:
+    """Прогрев таблиц аналитики и рейтингов перед утренними отчётами"""
+    analytics_tables()
+    for window in LEADERBOARD_WINDOWS:
+        check_budget(deadline)
+        get_leaderboard(window)
+    monthly_breakdown()
+    return f"версия данных {DB_STATE['version']}"
+
+async def backup_and_rotate(deadline: float, bot) -> str:
+    """Резервная копия (с ротацией старых копий)"""
+    name = await run_backup()
+    return name or "без изменений"
+
+# Задача → подпись, функция, время запуска (at — ежедневно, ЧЧ:ММ местного
+# времени, или interval — каждые N секунд), бюджет и jitter в секундах
+MAINTENANCE_TASKS = {
+    'compaction': {'title': "Архив и снимок БД", 'run': compact_database,
+                   'at': "03:30", 'budget': 120, 'jitter': 900},
+    'dayoff_archive': {'title': "Архив запросов выходных", 'run': archive_dayoff_requests,
+                       'at': "04:00", 'budget': 10, 'jitter': 600},
+    'verify': {'title': "Сверка итогов", 'run': verify_ledgers,
+               'at': "04:30", 'budget': 30, 'jitter': 900},
+    'prewarm': {'title': "Прогрев кэшей", 'run': prewarm_caches,
+                'at': "07:30", 'budget': 30, 'jitter': 600},
+    'backup': {'title': "Резервная копия", 'run': backup_and_rotate,
+               'interval': BACKUP_INTERVAL, 'budget': 120, 'jitter': 600},
+}
+
+def maintenance_stats(name: str) -> Dict:
+    entry = METRICS['maintenance'].get(name)
+    if entry is None:
+        entry = METRICS['maintenance'][name] = {
+            'runs': 0, 'errors': 0, 'over_budget': 0, 'deferred': 0,
+            'latency': new_histogram(), 'last_run': None, 'last_result': None
+        }
+    return entry
+
+def bot_is_busy(application: Application) -> bool:
+    """Есть необработанные обновления или выполняющиеся обработчики"""
+    return LOOP_STATE['active'] > 0 or application.update_queue.qsize() > 0
+
+async def run_maintenance(name: str, bot) -> str:
+    """Запуск задачи обслуживания с замером времени и учётом бюджета"""
+    task = MAINTENANCE_TASKS[name]
+    stats = maintenance_stats(name)
+    if not DB_STATE['loaded']:
+        await asyncio.to_thread(ensure_database)
+    
+    started = time.perf_counter()
+    try:
+        result = await task['run'](started + task['budget'], bot)
+    except MaintenanceBudgetExceeded:
+        result = "прервано: исчерпан бюджет"
+    except Exception as e:
+        stats['errors'] += 1
+        result = f"ошибка: {e}"
+        logger.error(f"🧹 Ошибка задачи {name}: {e}")
+    elapsed = time.perf_counter() - started
+    
+    stats['runs'] += 1
+    observe(stats['latency'], elapsed)
+    stats['last_run'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stats['last_result'] = result
+    if elapsed > task['budget']:
+        stats['over_budget'] += 1
+        logger.warning(f"🧹 {name}: {elapsed:.1f} с при бюджете {task['budget']} с")
+    logger.info(f"🧹 {task['title']}: {result} ({elapsed * 1000:.0f} мс)")
+    return result
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """Запуск по расписанию; пока бот занят — повтор через MAINTENANCE_BUSY_DELAY"""
+    name, deferrals = context.job.data['task'], context.job.data.get('deferrals', 0)
+    if bot_is_busy(context.application) and deferrals < MAINTENANCE_MAX_DEFERRALS:
+        maintenance_stats(name)['deferred'] += 1
+        context.job_queue.run_once(
+            maintenance_job, MAINTENANCE_BUSY_DELAY,
+            data={'task': name, 'deferrals': deferrals + 1}, name=f"maintenance_{name}"
+        )
+        return
+    await run_maintenance(name, context.bot)
+
+def schedule_maintenance(job_queue):
+    """Постановка всех задач обслуживания в JobQueue"""
+    local_tz = datetime.now().astimezone().tzinfo
+    for name, task in MAINTENANCE_TASKS.items():
+        options = {
+            'data': {'task': name},
+            'name': f"maintenance_{name}",
+            'job_kwargs': {'jitter': task['jitter']}
+        }
+        if 'at' in task:
+            at = datetime.strptime(task['at'], "%H:%M").time().replace(tzinfo=local_tz)
+            job_queue.run_daily(maintenance_job, at, **options)
+        else:
+            job_queue.run_repeating(maintenance_job, interval=task['interval'],
+                                    first=task['interval'], **options)
 
 # ===========================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -146,45 +2035,56 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMINS or user_id == HUSBAND_ID
     logger.info(f"🔑 Проверка админа: user_id={user_id}, ADMINS={ADMINS}, HUSBAND_ID={HUSBAND_ID}, is_admin={user_id in ADMINS or user_id == HUSBAND_ID}")
 
+# Кэш Telegram ID → имя (проверяется по БД при каждом попадании)
+USER_NAME_CACHE = {}
+
 def get_user_name(user_id: int) -> Optional[str]:
     """Получение имени пользователя по Telegram ID"""
+    name = USER_NAME_CACHE.get(user_id)
+    if name is not None and db['users'].get(name, {}).get('telegram_id') == user_id:
+        count_cache('user_name', True)
+        return name
+    
+    count_cache('user_name', False)
     for name, data in db['users'].items():
         if data.get('telegram_id') == user_id:
+            USER_NAME_CACHE[user_id] = name
             return name
     return None
 
 def calculate_balance(user_name: str) -> int:
-    """Расчёт текущего баланса пользователя"""
-    total = 0
+    """Расчёт текущего баланса пользователя (от последней расчётной точки)"""
+    settlement = get_settlement(user_name)
+    total = settlement['balance']
     
     # Добавляем доход от видео
-    for video in db['videos']:
-        if video['user'] == user_name:
-            total += video['amount']
+    for video in iter_videos(user_name, start=settlement['video_pos']):
+        total += video.amount
     
     # Вычитаем выплаты
-    for payment in db['payments']:
-        if payment['user'] == user_name:
-            total -= payment['amount']
+    for payment in iter_payments(user_name, start=settlement['payment_pos']):
+        total -= payment.amount
     
     return total
 
 def get_user_stats(user_name: str) -> Dict:
-    """Получение статистики пользователя"""
-    videos = [v for v in db['videos'] if v['user'] == user_name]
+    """Получение статистики пользователя (итоги расчётной точки + видео после неё)"""
+    settlement = get_settlement(user_name)
+    videos = list(iter_videos(user_name, start=settlement['video_pos']))
     
     stats = {
-        'total_videos': len(videos),
-        'total_earnings': sum(v['amount'] for v in videos),
+        'total_videos': settlement['videos'] + len(videos),
+        'total_earnings': settlement['earnings'] + sum(v.amount for v in videos),
         'by_type': {},
         'balance': calculate_balance(user_name)
     }
     
     for video_type in ['a2e', 'makefilm', 'grok', 'upload']:
-        type_videos = [v for v in videos if v['type'] == video_type]
+        type_videos = [v for v in videos if v.type == video_type]
+        carried_count, carried_earnings = settlement['by_type'].get(video_type, (0, 0))
         stats['by_type'][video_type] = {
-            'count': len(type_videos),
-            'earnings': sum(v['amount'] for v in type_videos)
+            'count': carried_count + len(type_videos),
+            'earnings': carried_earnings + sum(v.amount for v in type_videos)
         }
     
     return stats
@@ -198,27 +2098,89 @@ def format_date(date_str: str) -> str:
     except:
         return date_str
 
+def message_length(text: str) -> int:
+    """Длина текста так, как её считает Telegram (в UTF-16 единицах)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def split_report(blocks: Iterable[List[str]], limit: int = TELEGRAM_MESSAGE_LIMIT,
+                 max_messages: int = MAX_REPORT_MESSAGES) -> List[str]:
+    """Разбиение отчёта на сообщения по границам блоков
+
+    Каждый блок — список строк, первая строка блока считается заголовком
+    (месяц, пользователь). Если блок не помещается в одно сообщение,
+    заголовок повторяется в начале следующего сообщения.
+    """
+    chunks = []
+    current = ""
+
+    def flush():
+        nonlocal current
+        if current:
+            chunks.append(current)
+            current = ""
+
+    def add(text: str, sep: str):
+        nonlocal current
+        current = f"{current}{sep}{text}" if current else text
+
+    for block in blocks:
+        if not block:
+            continue
+        text = "\n".join(block)
+        if message_length(current) + message_length(text) + 2 <= limit:
+            add(text, "\n\n")
+            continue
+        if message_length(text) <= limit:
+            flush()
+            current = text
+            continue
+
+        # Блок длиннее одного сообщения — режем по строкам с повтором заголовка
+        header = block[0]
+        continuation = f"{header} (продолжение)"
+        sep = "\n\n"
+        for index, line in enumerate(block):
+            pieces = []
+            while message_length(line) > limit:
+                pieces.append(line[:limit // 2])
+                line = line[limit // 2:]
+            pieces.append(line)
+            for piece in pieces:
+                if not current or message_length(current) + len(sep) + message_length(piece) <= limit:
+                    add(piece, sep)
+                else:
+                    flush()
+                    # Заголовок повторяем, только если он уже был и помещается вместе со строкой
+                    if index and message_length(continuation) + 1 + message_length(piece) <= limit:
+                        current = f"{continuation}\n{piece}"
+                    else:
+                        current = piece
+                sep = "\n"
+    flush()
+
+    if len(chunks) > max_messages:
+        note = f"\n\n⚠️ Отчёт обрезан: показано {max_messages} из {len(chunks)} сообщений"
+        chunks = chunks[:max_messages]
+        last = chunks[-1]
+        while message_length(last) + message_length(note) > limit:
+            last = last[:last.rfind("\n")] if "\n" in last else last[:limit // 2 - len(note)]
+        chunks[-1] = last + note
+
+    return chunks
+
+async def send_report(message, blocks: Iterable[List[str]], **kwargs):
+    """Отправка длинного отчёта несколькими сообщениями по порядку"""
+    chunks = split_report(blocks)
+    for i, chunk in enumerate(chunks):
+        # Клавиатуру и прочие параметры прикрепляем к последнему сообщению
+        if i == len(chunks) - 1:
+            await message.reply_text(chunk, **kwargs)
+        else:
+            await message.reply_text(chunk)
+
 def get_main_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     """Получение главной клавиатуры в зависимости от роли"""
-    if is_admin(user_id):
-        keyboard = [
-            ['📊 Полная статистика', '⚙️ Текущий баланс'],
-            ['💸 Выплатить зарплату', '💰 Выплатить аванс'],
-            ['📈 История выплат', '🗑️ Удалить видео'],
-            ['🎬 Все видео', '📊 Экспорт в Excel'],
-            ['🏆 Рейтинг девушек', '📅 План на неделю'],
-            ['📅 График выходных', '📅 Мои выходные'],
-            ['🔔 Запросы выходных', '📢 Срочное сообщение']
-        ]
-    else:
-        keyboard = [
-            ['🎬 Создала видео', '📤 Загрузила видео'],
-            ['💰 Мой доход', '📊 Моя статистика'],
-            ['📅 Мой план', '📅 Мой календарь'],
-            ['📅 Запросить выходной']
-        ]
-    
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return MAIN_KEYBOARDS['admin' if is_admin(user_id) else 'user']
 
 # ===========================
 # КОМАНДА /start
@@ -355,15 +2317,7 @@ async def video_name_entered(update: Update, context: ContextTypes.DEFAULT_TYPE)
     price = db['users'][user_name]['rates'][video_type]
     
     # Сохраняем видео в БД
-    video_entry = {
-        'id': len(db['videos']) + 1,
-        'user': user_name,
-        'type': video_type,
-        'name': video_name,
-        'amount': price,
-        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    db['videos'].append(video_entry)
+    add_video(user_name, video_type, video_name, price)
     save_database(db)
     
     # Обновляем баланс
@@ -442,15 +2396,7 @@ async def upload_count_entered(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # Сохраняем каждое загруженное видео
     for i in range(count):
-        video_entry = {
-            'id': len(db['videos']) + 1,
-            'user': user_name,
-            'type': 'upload',
-            'name': f"Загрузка #{i+1}",
-            'amount': upload_rate,
-            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        db['videos'].append(video_entry)
+        add_video(user_name, 'upload', f"Загрузка #{i+1}", upload_rate)
     
     save_database(db)
     
@@ -493,6 +2439,48 @@ async def my_income(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message)
 
+# ===========================
+# С ПОСЛЕДНЕЙ ЗАРПЛАТЫ
+# ===========================
+async def since_last_salary(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Видео, заработок и авансы после последней выплаты зарплаты"""
+    user_id = update.effective_user.id
+    user_name = get_user_name(user_id)
+    
+    if not user_name:
+        await update.message.reply_text("❌ Сначала зарегистрируйся через /start")
+        return
+    
+    settlement = get_settlement(user_name)
+    videos = list(iter_videos(user_name, start=settlement['video_pos']))
+    advances = sum(p.amount for p in iter_payments(user_name, start=settlement['payment_pos']))
+    
+    message = f"🧾 С ПОСЛЕДНЕЙ ЗАРПЛАТЫ\n\n"
+    if settlement['settled_at']:
+        paid_at = datetime.strptime(settlement['settled_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+        message += f"📅 Последняя зарплата: {paid_at}\n"
+    else:
+        message += f"📅 Зарплата ещё не выплачивалась\n"
+    if settlement['balance']:
+        message += f"↪️ Перенесено: {settlement['balance']} грн\n"
+    message += f"🎬 Видео: {len(videos)}\n"
+    message += f"💰 Заработано: {sum(v.amount for v in videos)} грн\n"
+    if advances:
+        message += f"💳 Авансы: {advances} грн\n"
+    message += f"💵 К выплате: {calculate_balance(user_name)} грн\n"
+    
+    by_type = {}
+    for video in videos:
+        entry = by_type.setdefault(video.type, [0, 0])
+        entry[0] += 1
+        entry[1] += video.amount
+    if by_type:
+        message += f"\n📈 ПО ТИПАМ:\n"
+        for video_type, (count, earnings) in by_type.items():
+            message += f"• {video_type.upper()}: {count} шт. — {earnings} грн\n"
+    
+    await update.message.reply_text(message)
+
 # ===========================
 # МОЯ СТАТИСТИКА
 # ===========================
@@ -506,10 +2494,8 @@ async def my_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     stats = get_user_stats(user_name)
-    videos = [v for v in db['videos'] if v['user'] == user_name]
-    
     # Последние 5 видео
-    recent_videos = sorted(videos, key=lambda x: x['created_at'], reverse=True)[:5]
+    recent_videos = latest_first(iter_videos(user_name), 5)
     
     message = f"📊 ТВОЯ СТАТИСТИКА\n\n"
     message += f"💵 Баланс: {stats['balance']} грн\n"
@@ -519,32 +2505,44 @@ async def my_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if recent_videos:
         message += f"📹 ПОСЛЕДНИЕ ВИДЕО:\n"
         for v in recent_videos:
-            date = datetime.strptime(v['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
-            message += f"• {date} | {v['type'].upper()} | {v['name'][:20]} | +{v['amount']} грн\n"
+            date = datetime.strptime(v.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
+            message += f"• {date} | {v.type.upper()} | {v.name[:20]} | +{v.amount} грн\n"
     
     await update.message.reply_text(message)
 
 # ===========================
 # ПОЛНАЯ СТАТИСТИКА (АДМИН)
 # ===========================
+def build_full_statistics_report() -> List[List[str]]:
+    """Сборка полной статистики в виде блоков строк"""
+    blocks = [["📊 ПОЛНАЯ СТАТИСТИКА"]]
+
+    for user_name, stats in user_totals().items():
+        blocks.append([
+            f"👤 {user_name}:",
+            f"   💵 Баланс: {stats['balance']} грн",
+            f"   🎬 Видео: {stats['videos']}",
+            f"   💰 Заработано: {stats['earnings']} грн"
+        ])
+
+    months = monthly_breakdown()
+    if months:
+        block = ["📅 ПО МЕСЯЦАМ:"]
+        for (month,), entry in months.items():
+            block.append(f"   {month.strftime('%m.%Y')}: {entry['count']} видео, {entry['sum']} грн")
+        blocks.append(block)
+
+    return blocks
+
 async def full_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ полной статистики (только для админа)"""
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
-        await update.message.reply_text("❌ Доступно только администратору")
-        return
-    
-    message = "📊 ПОЛНАЯ СТАТИСТИКА\n\n"
-    
-    for user_name in USERS_CONFIG.keys():
-        stats = get_user_stats(user_name)
-        message += f"👤 {user_name}:\n"
-        message += f"   💵 Баланс: {stats['balance']} грн\n"
-        message += f"   🎬 Видео: {stats['total_videos']}\n"
-        message += f"   💰 Заработано: {stats['total_earnings']} грн\n\n"
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
     
-    await update.message.reply_text(message)
+    await send_report(update.message, build_full_statistics_report())
 
 # ===========================
 # ТЕКУЩИЙ БАЛАНС (АДМИН)
@@ -596,6 +2594,9 @@ async def salary_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("✅ Никому не нужно выплачивать зарплату")
         return
     
+    if len(keyboard) > 1:
+        keyboard.append([InlineKeyboardButton("💸 Выплатить всем", callback_data="pay_all_preview")])
+    
     await update.message.reply_text(
         "💸 Кому выплатить зарплату?",
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -613,15 +2614,9 @@ async def process_salary_payment(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("❌ У этого пользователя нет баланса для выплаты")
         return
     
-    # Создаём запись о выплате
-    payment_entry = {
-        'id': len(db['payments']) + 1,
-        'user': user_name,
-        'amount': balance,
-        'type': 'salary',
-        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    db['payments'].append(payment_entry)
+    # Создаём запись о выплате и закрываем расчёт
+    add_payment(user_name, balance, 'salary')
+    record_settlement(user_name)
     save_database(db)
     
     # Уведомление пользователю
@@ -644,6 +2639,114 @@ async def process_salary_payment(update: Update, context: ContextTypes.DEFAULT_T
         f"💰 Сумма: {balance} грн"
     )
 
+# ===========================
+# ВЫПЛАТА ВСЕМ (АДМИН)
+# ===========================
+# Все положительные балансы считаются одним проходом (user_totals), админ
+# подтверждает сводку, выплаты и расчётные точки записываются разом одним
+# сохранением БД, а уведомления уходят параллельно с прогрессом в сообщении.
+# В кнопку подтверждения зашит отпечаток показанных сумм: если с момента
+# сводки балансы изменились (в том числе после перезапуска бота), сводка
+# показывается заново
+PAYROLL_CONCURRENCY = 8
+PAYROLL_PROGRESS_INTERVAL = 1.0  # секунд между обновлениями прогресса
+
+def payroll_balances() -> Dict[str, int]:
+    """Положительные балансы всех девушек"""
+    return {
+        user_name: totals['balance']
+        for user_name, totals in user_totals().items() if totals['balance'] > 0
+    }
+
+def payroll_digest(balances: Dict[str, int]) -> str:
+    """Отпечаток сводки {девушка: сумма} для кнопки подтверждения"""
+    raw = json.dumps(sorted(balances.items()), ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+def payroll_summary(balances: Dict[str, int]) -> tuple:
+    """Текст сводки и клавиатура подтверждения"""
+    lines = ["💸 ВЫПЛАТА ВСЕМ", ""]
+    lines += [f"• {user_name} — {amount} грн" for user_name, amount in balances.items()]
+    lines += ["", f"👥 Девушек: {len(balances)}", f"💰 Всего: {sum(balances.values())} грн"]
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Выплатить", callback_data=f"pay_all_confirm_{payroll_digest(balances)}"),
+        InlineKeyboardButton("❌ Отмена", callback_data="pay_all_cancel")
+    ]])
+    return "\n".join(lines), keyboard
+
+async def edit_progress(query, text: str):
+    """Обновление сообщения с прогрессом (сбой не прерывает рассылку)"""
+    try:
+        await query.edit_message_text(text)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.error(f"Не удалось обновить прогресс выплаты: {e}")
+
+async def payroll_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка, подтверждение и проведение выплаты всем"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not is_admin(update.effective_user.id):
+        return
+    
+    if query.data == "pay_all_cancel":
+        await query.edit_message_text("❌ Выплата всем отменена")
+        return
+    
+    balances = payroll_balances()
+    if not balances:
+        await query.edit_message_text("✅ Никому не нужно выплачивать зарплату")
+        return
+    
+    confirmed_digest = query.data.replace("pay_all_confirm_", "") if query.data.startswith("pay_all_confirm_") else None
+    if confirmed_digest != payroll_digest(balances):
+        text, keyboard = payroll_summary(balances)
+        if confirmed_digest is not None:
+            text = "⚠️ Балансы изменились, проверь сводку ещё раз\n\n" + text
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
+    
+    # Все выплаты — без await между ними и одним сохранением
+    for user_name, amount in balances.items():
+        add_payment(user_name, amount, 'salary')
+        record_settlement(user_name)
+    save_database(db)
+    total = sum(balances.values())
+    logger.info(f"💸 Выплата всем: {len(balances)} девушек, {total} грн")
+    
+    recipients = [
+        (user_name, db['users'][user_name].get('telegram_id')) for user_name in balances
+    ]
+    recipients = [(user_name, chat_id) for user_name, chat_id in recipients if chat_id]
+    header = f"✅ Выплачено {len(balances)} девушкам, всего {total} грн\n\n"
+    progress = {'done': 0, 'delivered': 0, 'shown_at': time.perf_counter()}
+    semaphore = asyncio.Semaphore(PAYROLL_CONCURRENCY)
+    
+    async def notify(user_name: str, chat_id: int):
+        async with semaphore:
+            delivered = await send_outgoing(
+                context.bot, chat_id,
+                f"💸 ВЫПЛАТА ЗАРПЛАТЫ\n\n"
+                f"Тебе выплачено: {balances[user_name]} грн\n"
+                f"Твой баланс обнулён.\n\n"
+                f"Удачи! 💪"
+            )
+        progress['done'] += 1
+        progress['delivered'] += delivered
+        if time.perf_counter() - progress['shown_at'] >= PAYROLL_PROGRESS_INTERVAL:
+            progress['shown_at'] = time.perf_counter()
+            await edit_progress(query, header + f"📨 Уведомления: {progress['done']}/{len(recipients)}")
+    
+    await edit_progress(query, header + f"📨 Уведомления: 0/{len(recipients)}")
+    await asyncio.gather(*(notify(user_name, chat_id) for user_name, chat_id in recipients))
+    await edit_progress(
+        query,
+        header
+        + "\n".join(f"• {user_name} — {amount} грн" for user_name, amount in balances.items())
+        + f"\n\n📨 Уведомлено: {progress['delivered']}/{len(recipients)}"
+    )
+
 # ===========================
 # ВЫПЛАТА АВАНСА (АДМИН)
 # ===========================
@@ -753,14 +2856,7 @@ async def advance_confirmed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     amount = context.user_data['advance_amount']
     
     # Создаём запись о выплате
-    payment_entry = {
-        'id': len(db['payments']) + 1,
-        'user': user_name,
-        'amount': amount,
-        'type': 'advance',
-        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    db['payments'].append(payment_entry)
+    add_payment(user_name, amount, 'advance')
     save_database(db)
     
     new_balance = calculate_balance(user_name)
@@ -800,7 +2896,7 @@ async def payment_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    payments = sorted(db['payments'], key=lambda x: x['created_at'], reverse=True)[:20]
+    payments = latest_first(iter_payments(), 20)
     
     if not payments:
         await update.message.reply_text("📈 История выплат пуста")
@@ -809,10 +2905,10 @@ async def payment_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = "📈 ИСТОРИЯ ВЫПЛАТ\n\n"
     
     for payment in payments:
-        date = datetime.strptime(payment['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
-        payment_type = "💸 Зарплата" if payment['type'] == 'salary' else "💰 Аванс"
+        date = datetime.strptime(payment.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
+        payment_type = "💸 Зарплата" if payment.type == 'salary' else "💰 Аванс"
         message += f"{payment_type} | {date}\n"
-        message += f"   👤 {payment['user']} — {payment['amount']} грн\n\n"
+        message += f"   👤 {payment.user} — {payment.amount} грн\n\n"
     
     await update.message.reply_text(message)
 
@@ -827,7 +2923,7 @@ async def all_videos(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    videos = sorted(db['videos'], key=lambda x: x['created_at'], reverse=True)[:20]
+    videos = latest_first(iter_videos(), 20)
     
     if not videos:
         await update.message.reply_text("🎬 Видео ещё нет")
@@ -836,11 +2932,11 @@ async def all_videos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = "🎬 ВСЕ ВИДЕО (последние 20)\n\n"
     
     for video in videos:
-        date = datetime.strptime(video['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
-        message += f"#{video['id']} | {date}\n"
-        message += f"   👤 {video['user']} | {video['type'].upper()}\n"
-        message += f"   📹 {video['name'][:30]}\n"
-        message += f"   💰 {video['amount']} грн\n\n"
+        date = datetime.strptime(video.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
+        message += f"#{video.id} | {date}\n"
+        message += f"   👤 {video.user} | {video.type.upper()}\n"
+        message += f"   📹 {video.name[:30]}\n"
+        message += f"   💰 {video.amount} грн\n\n"
     
     await update.message.reply_text(message)
 
@@ -855,7 +2951,7 @@ async def delete_video_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Доступно только администратору")
         return ConversationHandler.END
     
-    videos = sorted(db['videos'], key=lambda x: x['created_at'], reverse=True)[:10]
+    videos = latest_first(iter_videos(), 10)
     
     if not videos:
         await update.message.reply_text("🎬 Видео нет для удаления")
@@ -865,10 +2961,10 @@ async def delete_video_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     message += "Последние 10 видео:\n\n"
     
     for i, video in enumerate(videos, 1):
-        date = datetime.strptime(video['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
-        message += f"{i}. {video['user']} | {date} | {video['type'].upper()}\n"
-        message += f"   📹 {video['name'][:30]}\n"
-        message += f"   💰 +{video['amount']} грн\n\n"
+        date = datetime.strptime(video.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
+        message += f"{i}. {video.user} | {date} | {video.type.upper()}\n"
+        message += f"   📹 {video.name[:30]}\n"
+        message += f"   💰 +{video.amount} грн\n\n"
     
     message += "Напиши номер видео для удаления (1-10):"
     
@@ -903,15 +2999,15 @@ async def delete_video_selected(update: Update, context: ContextTypes.DEFAULT_TY
         [InlineKeyboardButton("❌ Отмена", callback_data="delete_confirm_no")]
     ]
     
-    date = datetime.strptime(video['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
+    date = datetime.strptime(video.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m %H:%M")
     
     await update.message.reply_text(
         f"🗑️ ПОДТВЕРЖДЕНИЕ УДАЛЕНИЯ\n\n"
-        f"#{video['id']} | {date}\n"
-        f"👤 {video['user']}\n"
-        f"🎬 {video['type'].upper()}\n"
-        f"📹 {video['name']}\n"
-        f"💰 -{video['amount']} грн\n\n"
+        f"#{video.id} | {date}\n"
+        f"👤 {video.user}\n"
+        f"🎬 {video.type.upper()}\n"
+        f"📹 {video.name}\n"
+        f"💰 -{video.amount} грн\n\n"
         f"Точно удалить?",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -930,30 +3026,36 @@ async def delete_video_confirmed(update: Update, context: ContextTypes.DEFAULT_T
     
     video = context.user_data['delete_video']
     
-    # Удаляем видео из БД
-    db['videos'] = [v for v in db['videos'] if v['id'] != video['id']]
-    save_database(db)
+    # Удаляем видео из БД (не во время переноса в архив)
+    async with ARCHIVE_LOCK:
+        deleted = delete_video(video)
+        if deleted:
+            save_database(db)
+    if not deleted:
+        await query.edit_message_text(f"⚠️ Видео #{video.id} уже удалено или перенесено в архив")
+        context.user_data.clear()
+        return ConversationHandler.END
     
     # Уведомление пользователю
-    user_telegram_id = db['users'][video['user']].get('telegram_id')
+    user_telegram_id = db['users'][video.user].get('telegram_id')
     if user_telegram_id:
         try:
             await context.bot.send_message(
                 chat_id=user_telegram_id,
                 text=f"⚠️ ВИДЕО УДАЛЕНО АДМИНОМ\n\n"
-                     f"📹 Название: {video['name']}\n"
-                     f"🎬 Тип: {video['type'].upper()}\n"
-                     f"💰 Сумма: -{video['amount']} грн\n\n"
+                     f"📹 Название: {video.name}\n"
+                     f"🎬 Тип: {video.type.upper()}\n"
+                     f"💰 Сумма: -{video.amount} грн\n\n"
                      f"Причина: ошибка при вводе"
             )
         except Exception as e:
-            logger.error(f"Не удалось отправить уведомление {video['user']}: {e}")
+            logger.error(f"Не удалось отправить уведомление {video.user}: {e}")
     
     await query.edit_message_text(
         f"✅ Видео удалено!\n\n"
-        f"#{video['id']} | {video['user']}\n"
-        f"📹 {video['name']}\n"
-        f"💰 -{video['amount']} грн"
+        f"#{video.id} | {video.user}\n"
+        f"📹 {video.name}\n"
+        f"💰 -{video.amount} грн"
     )
     
     context.user_data.clear()
@@ -962,6 +3064,37 @@ async def delete_video_confirmed(update: Update, context: ContextTypes.DEFAULT_T
 # ===========================
 # РЕЙТИНГ ДЕВУШЕК (АДМИН)
 # ===========================
+def build_ratings_report(window: str = 'all') -> List[List[str]]:
+    """Сборка рейтинга девушек за период окна в виде блоков строк"""
+    board = get_leaderboard(window)
+    title = f"🏆 РЕЙТИНГ ДЕВУШЕК {LEADERBOARD_WINDOWS[window]['title']}"
+    if window != 'all':
+        title += f" (с {board['start'].strftime('%d.%m')})"
+    
+    block = ["📊 ПО КОЛИЧЕСТВУ ВИДЕО:"]
+    for i, (count, name) in enumerate(board['by_videos'][:LEADERBOARD_TOP], 1):
+        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "  "
+        block.append(f"{emoji} {i}. {name} — {-count} видео")
+    blocks = [[title], block]
+    
+    block = ["💰 ПО ЗАРАБОТКУ:"]
+    for i, (earned, name) in enumerate(board['by_earnings'][:LEADERBOARD_TOP], 1):
+        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "  "
+        block.append(f"{emoji} {i}. {name} — {-earned} грн")
+    blocks.append(block)
+    
+    return blocks
+
+def ratings_keyboard(window: str) -> InlineKeyboardMarkup:
+    """Кнопки переключения окна рейтинга (текущее отмечено)"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(
+            f"• {options['button']} •" if name == window else options['button'],
+            callback_data=f"ratings_{name}"
+        )
+        for name, options in LEADERBOARD_WINDOWS.items()
+    ]])
+
 async def ratings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ рейтинга девушек (только для админа)"""
     user_id = update.effective_user.id
@@ -970,35 +3103,26 @@ async def ratings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    # Собираем статистику
-    users_stats = []
-    for user_name in USERS_CONFIG.keys():
-        stats = get_user_stats(user_name)
-        users_stats.append({
-            'name': user_name,
-            'videos': stats['total_videos'],
-            'earnings': stats['total_earnings']
-        })
-    
-    # Сортируем по видео
-    by_videos = sorted(users_stats, key=lambda x: x['videos'], reverse=True)
-    
-    # Сортируем по доходу
-    by_earnings = sorted(users_stats, key=lambda x: x['earnings'], reverse=True)
-    
-    message = "🏆 РЕЙТИНГ ДЕВУШЕК\n\n"
+    await send_report(update.message, build_ratings_report(), reply_markup=ratings_keyboard('all'))
+
+async def ratings_window_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переключение окна рейтинга кнопками (только для админа)"""
+    query = update.callback_query
+    await query.answer()
     
-    message += "📊 ПО КОЛИЧЕСТВУ ВИДЕО:\n"
-    for i, user in enumerate(by_videos, 1):
-        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "  "
-        message += f"{emoji} {i}. {user['name']} — {user['videos']} видео\n"
+    if not is_admin(update.effective_user.id):
+        return
     
-    message += "\n💰 ПО ЗАРАБОТКУ:\n"
-    for i, user in enumerate(by_earnings, 1):
-        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else "  "
-        message += f"{emoji} {i}. {user['name']} — {user['earnings']} грн\n"
+    window = query.data.replace("ratings_", "")
+    if window not in LEADERBOARD_WINDOWS:
+        return
     
-    await update.message.reply_text(message)
+    # Рейтинг короткий — редактируем сообщение его первой частью
+    text = split_report(build_ratings_report(window))[0]
+    try:
+        await query.edit_message_text(text, reply_markup=ratings_keyboard(window))
+    except BadRequest:
+        pass  # Повторное нажатие той же кнопки: сообщение не изменилось
 
 # ===========================
 # ПЛАН НА НЕДЕЛЮ (АДМИН)
@@ -1040,11 +3164,13 @@ async def plan_user_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.edit_message_text(
         f"📅 План для {user_name}\n\n"
         f"Напиши план в формате:\n"
-        f"<количество> <тип> до <день недели>\n\n"
+        f"<количество> <тип> до <день недели или ДД.ММ>\n\n"
         f"Примеры:\n"
         f"• 5 видео до пятницы\n"
         f"• 3 grok до среды\n"
-        f"• 10 любых до воскресенья"
+        f"• 10 любых до воскресенья\n"
+        f"• 20 загрузок до 28.02\n\n"
+        f"Типы: видео (a2e, makefilm, grok), любых, загрузок, a2e, makefilm, grok"
     )
     
     return PLAN_DETAILS
@@ -1054,29 +3180,39 @@ async def plan_details_entered(update: Update, context: ContextTypes.DEFAULT_TYP
     user_name = context.user_data['plan_user']
     plan_text = update.message.text
     
-    # Парсим план (упрощённо)
     # Формат: "5 видео до пятницы"
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     try:
         parts = plan_text.lower().split()
         count = int(parts[0])
-        video_type = parts[1] if len(parts) > 1 else "видео"
-        deadline = " ".join(parts[parts.index("до")+1:]) if "до" in parts else "неделю"
-    except:
-        count = 5
-        video_type = "видео"
-        deadline = "неделю"
+        video_type = parts[1] if len(parts) > 1 and parts[1] != "до" else "видео"
+        if video_type not in PLAN_TYPE_WORDS or count <= 0:
+            raise ValueError(video_type)
+        deadline_date = parse_deadline(" ".join(parts[parts.index("до")+1:]) if "до" in parts else "", today)
+    except (ValueError, IndexError):
+        await update.message.reply_text(
+            "❌ Не получилось разобрать план!\n\n"
+            "Формат: <количество> <тип> до <день недели или ДД.ММ>\n"
+            "Пример: 5 видео до пятницы"
+        )
+        return PLAN_DETAILS
+    deadline = format_date(deadline_date.strftime("%Y-%m-%d"))
     
-    # Сохраняем план
+    # Сохраняем план; уже снятые с начала дня видео сразу засчитываются
     plan_entry = {
         'user': user_name,
         'target_count': count,
         'video_type': video_type,
-        'deadline': deadline,
+        'types': PLAN_TYPE_WORDS[video_type],
+        'start': today.strftime("%Y-%m-%d"),
+        'deadline': deadline_date.strftime("%Y-%m-%d"),
         'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         'completed': 0
     }
+    plan_entry['completed'] = count_plan_progress(plan_entry, iter_videos(user_name, since=plan_entry['start']))
     
     db['plans'][user_name] = plan_entry
+    schedule_plan_reminders(plan_entry)
     save_database(db)
     
     # Уведомление пользователю
@@ -1104,6 +3240,24 @@ async def plan_details_entered(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data.clear()
     return ConversationHandler.END
 
+async def plans_overview(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Прогресс всех планов одним сообщением (только для админа)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
+    
+    plans = [db['plans'][name] for name in USERS_CONFIG if name in db['plans']]
+    if not plans:
+        await update.message.reply_text("🎯 Планов пока нет\n\nУстанови через «📅 План на неделю»")
+        return
+    
+    done = sum(1 for plan in plans if plan['completed'] >= plan['target_count'])
+    await send_report(update.message, [
+        ["🎯 ПРОГРЕСС ПЛАНОВ"],
+        [plan_progress_line(plan) for plan in plans],
+        [f"Выполнено планов: {done} из {len(plans)}"]
+    ])
+
 # ===========================
 # МОЙ ПЛАН (ДЕВУШКИ)
 # ===========================
@@ -1125,24 +3279,22 @@ async def my_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Считаем прогресс (упрощённо - все видео за последние 7 дней)
-    week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-    recent_videos = [
-        v for v in db['videos']
-        if v['user'] == user_name and v['created_at'] >= week_ago
-    ]
-    completed = len(recent_videos)
+    completed = plan['completed']
     target = plan['target_count']
     progress = min(100, int(completed / target * 100))
+    days_left = (datetime.strptime(plan['deadline'], "%Y-%m-%d").date() - datetime.now().date()).days
     
     message = f"📅 МОЙ ПЛАН НА НЕДЕЛЮ\n\n"
     message += f"🎯 Цель: {target} {plan['video_type']}\n"
-    message += f"⏰ Дедлайн: {plan['deadline']}\n"
+    message += f"⏰ Дедлайн: {format_date(plan['deadline'])}"
+    message += f" (осталось дней: {days_left})\n" if days_left >= 0 else "\n"
     message += f"✅ Выполнено: {completed}/{target}\n"
     message += f"📊 Прогресс: {progress}%\n\n"
     
     if completed >= target:
         message += "🎉 План выполнен! Отличная работа!"
+    elif days_left < 0:
+        message += "⌛ Срок плана истёк"
     elif progress >= 75:
         message += "💪 Почти готово! Осталось совсем чуть-чуть!"
     elif progress >= 50:
@@ -1155,6 +3307,12 @@ async def my_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===========================
 # ЗАПРОС ВЫХОДНОГО (ДЕВУШКИ)
 # ===========================
+def next_dayoff_request_id() -> str:
+    """Новый id запроса выходного (счётчик не уменьшается при переносе запросов в архив)"""
+    number = db['days_off_next_id']
+    db['days_off_next_id'] = number + 1
+    return f"req_{number:03d}"
+
 async def request_dayoff_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало запроса выходного"""
     user_id = update.effective_user.id
@@ -1192,6 +3350,16 @@ async def dayoff_date_entered(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return DAYOFF_DATE
     
+    user_name = context.user_data['dayoff_user']
+    if has_dayoff(user_name, date_str) or any(
+        r['user'] == user_name and r['date'] == date_str for r in DAYOFF_INDEX['pending'].values()
+    ):
+        await update.message.reply_text(
+            f"❌ На {format_date(date_str)} у тебя уже есть выходной или запрос\n\n"
+            "Напиши другую дату в формате ДД.ММ"
+        )
+        return DAYOFF_DATE
+    
     context.user_data['dayoff_date'] = date_str
     
     await update.message.reply_text(
@@ -1211,7 +3379,7 @@ async def dayoff_reason_entered(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Создаём запрос
     request_entry = {
-        'id': f"req_{len(db['days_off_requests']) + 1:03d}",
+        'id': next_dayoff_request_id(),
         'user': user_name,
         'date': date_str,
         'reason': reason,
@@ -1219,7 +3387,9 @@ async def dayoff_reason_entered(update: Update, context: ContextTypes.DEFAULT_TY
         'requested_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
     db['days_off_requests'].append(request_entry)
+    DAYOFF_INDEX['pending'][request_entry['id']] = request_entry
     save_database(db)
+    conflicts = "".join(f"{line}\n" for line in dayoff_conflicts(user_name, date_str))
     
     # Уведомление админу
     for admin_id in ADMINS + [HUSBAND_ID]:
@@ -1232,11 +3402,8 @@ async def dayoff_reason_entered(update: Update, context: ContextTypes.DEFAULT_TY
             ]
             
             balance = calculate_balance(user_name)
-            week_videos = len([
-                v for v in db['videos']
-                if v['user'] == user_name and
-                v['created_at'] >= (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-            ])
+            week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+            week_videos = sum(1 for _ in iter_videos(user_name, since=week_ago))
             
             await context.bot.send_message(
                 chat_id=admin_id,
@@ -1245,7 +3412,8 @@ async def dayoff_reason_entered(update: Update, context: ContextTypes.DEFAULT_TY
                      f"📅 Дата: {format_date(date_str)}\n"
                      f"📝 Причина: {reason}\n\n"
                      f"💵 Баланс: {balance} грн\n"
-                     f"📊 Видео за неделю: {week_videos}\n\n"
+                     f"📊 Видео за неделю: {week_videos}\n"
+                     f"{conflicts}\n"
                      f"Одобрить запрос?",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
@@ -1275,14 +3443,11 @@ async def dayoff_approve_reject(update: Update, context: ContextTypes.DEFAULT_TY
     request_id = "_".join(query.data.split("_")[2:])
     
     # Находим запрос
-    request = next((r for r in db['days_off_requests'] if r['id'] == request_id), None)
+    request = DAYOFF_INDEX['pending'].pop(request_id, None)
     
     if not request:
-        await query.edit_message_text("❌ Запрос не найден")
-        return
-    
-    if request['status'] != 'pending':
-        await query.edit_message_text("❌ Запрос уже обработан")
+        processed = any(r['id'] == request_id for r in db['days_off_requests'])
+        await query.edit_message_text("❌ Запрос уже обработан" if processed else "❌ Запрос не найден")
         return
     
     if action == "approve":
@@ -1294,11 +3459,14 @@ async def dayoff_approve_reject(update: Update, context: ContextTypes.DEFAULT_TY
         if request['user'] not in db['days_off_approved']:
             db['days_off_approved'][request['user']] = []
         
-        db['days_off_approved'][request['user']].append({
+        dayoff = {
             'date': request['date'],
             'reason': request['reason'],
             'approved_at': request['approved_at']
-        })
+        }
+        db['days_off_approved'][request['user']].append(dayoff)
+        index_approved_dayoff(request['user'], dayoff)
+        schedule_dayoff_reminder('dayoff', request['user'], request['date'])
         
         save_database(db)
         
@@ -1316,11 +3484,13 @@ async def dayoff_approve_reject(update: Update, context: ContextTypes.DEFAULT_TY
             except Exception as e:
                 logger.error(f"Не удалось отправить уведомление {request['user']}: {e}")
         
+        off_count = len(users_off_on(request['date']))
         await query.edit_message_text(
             f"✅ Выходной одобрен!\n\n"
             f"👤 {request['user']}\n"
             f"📅 Дата: {format_date(request['date'])}\n"
-            f"📝 Причина: {request['reason']}"
+            f"📝 Причина: {request['reason']}\n"
+            f"👥 Всего выходных в этот день: {off_count}"
         )
     
     else:
@@ -1358,18 +3528,22 @@ async def dayoff_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    pending = [r for r in db['days_off_requests'] if r['status'] == 'pending']
+    pending = list(DAYOFF_INDEX['pending'].values())
     
     if not pending:
         await update.message.reply_text("✅ Нет ожидающих запросов на выходные")
         return
     
-    message = "🔔 ЗАПРОСЫ НА ВЫХОДНЫЕ\n\n"
+    await update.message.reply_text(f"🔔 ЗАПРОСЫ НА ВЫХОДНЫЕ: {len(pending)}")
     
     for req in pending:
-        message += f"👤 {req['user']}\n"
-        message += f"📅 Дата: {format_date(req['date'])}\n"
-        message += f"📝 Причина: {req['reason']}\n\n"
+        # Подробности и пересечения — в том же сообщении, что и кнопки решения
+        lines = [
+            f"👤 {req['user']}",
+            f"📅 Дата: {format_date(req['date'])}",
+            f"📝 Причина: {req['reason']}"
+        ]
+        lines += dayoff_conflicts(req['user'], req['date'])
         
         keyboard = [
             [
@@ -1379,7 +3553,7 @@ async def dayoff_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         
         await update.message.reply_text(
-            f"Запрос от {req['user']}:",
+            "\n".join(lines),
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
@@ -1443,198 +3617,805 @@ async def admin_dayoff_dates_entered(update: Update, context: ContextTypes.DEFAU
         except:
             continue
     
-    if not dates:
-        await update.message.reply_text(
-            "❌ Неверный формат дат!\n\n"
-            "Напиши даты через запятую в формате ДД.ММ\n"
-            "Пример: 10.02, 15.02"
-        )
-        return ADMIN_DAYOFF_DATES
+    if not dates:
+        await update.message.reply_text(
+            "❌ Неверный формат дат!\n\n"
+            "Напиши даты через запятую в формате ДД.ММ\n"
+            "Пример: 10.02, 15.02"
+        )
+        return ADMIN_DAYOFF_DATES
+    
+    # Сохраняем выходные
+    db['admin_days_off'][who] = dates
+    rebuild_dayoff_index()
+    for date_str in dates:
+        schedule_dayoff_reminder('admin', who, date_str)
+    save_database(db)
+    
+    # Уведомления всем девушкам
+    who_name = "Администратор" if who == "admin" else "Муж администратора"
+    
+    for user_name, user_data in db['users'].items():
+        user_telegram_id = user_data.get('telegram_id')
+        if user_telegram_id and not is_admin(user_telegram_id):
+            try:
+                dates_list = "\n".join([f"• {format_date(d)}" for d in dates])
+                await context.bot.send_message(
+                    chat_id=user_telegram_id,
+                    text=f"📅 ВЫХОДНЫЕ АДМИНИСТРАЦИИ\n\n"
+                         f"{who_name} не будет на связи:\n{dates_list}"
+                )
+            except Exception as e:
+                logger.error(f"Не удалось отправить уведомление {user_name}: {e}")
+    
+    dates_formatted = ", ".join([format_date(d) for d in dates])
+    
+    await update.message.reply_text(
+        f"✅ Выходные установлены!\n\n"
+        f"👤 {who_name}\n"
+        f"📅 Даты: {dates_formatted}\n\n"
+        f"Все девушки уведомлены.",
+        reply_markup=get_main_keyboard(update.effective_user.id)
+    )
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
+# ===========================
+# МОЙ КАЛЕНДАРЬ (ДЕВУШКИ)
+# ===========================
+def build_my_calendar_report(user_name: str) -> List[List[str]]:
+    """Сборка персонального календаря в виде блоков строк (по месяцам)"""
+    labels = {
+        'user': "🏖️ МОЙ ВЫХОДНОЙ",
+        'admin': "🔴 АДМИН НЕ НА СВЯЗИ",
+        'husband': "🔵 МУЖ АДМИНА НЕ НА СВЯЗИ"
+    }
+    blocks = [["📅 МОЙ КАЛЕНДАРЬ"]]
+    
+    for month_key, entries in sorted(DAYOFF_INDEX['by_month'].items()):
+        mine = [
+            (date_str, kind) for date_str, kind, who, _ in entries
+            if kind != 'user' or who == user_name
+        ]
+        if not mine:
+            continue
+        month_name = datetime.strptime(month_key, "%Y-%m").strftime("%B %Y").upper()
+        block = [f"🗓️ {month_name}:"]
+        for date_str, kind in mine:
+            block.append(f"• {format_date(date_str)} — {labels[kind]}")
+        blocks.append(block)
+    
+    if len(blocks) == 1:
+        return []
+    
+    blocks.append([
+        "✅ Ты видишь:",
+        "• Свои выходные",
+        "• Выходные администратора",
+        "• Выходные мужа администратора"
+    ])
+    
+    return blocks
+
+async def my_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ персонального календаря (только свои выходные + админы)"""
+    user_id = update.effective_user.id
+    user_name = get_user_name(user_id)
+    
+    if not user_name:
+        await update.message.reply_text("❌ Сначала зарегистрируйся через /start")
+        return
+    
+    blocks = build_my_calendar_report(user_name)
+    
+    if not blocks:
+        await update.message.reply_text(
+            "📅 МОЙ КАЛЕНДАРЬ\n\n"
+            "Нет запланированных выходных"
+        )
+        return
+    
+    await send_report(update.message, blocks, reply_markup=ics_keyboard())
+
+# ===========================
+# ГРАФИК ВЫХОДНЫХ (АДМИН)
+# ===========================
+def build_calendar_all_report() -> List[List[str]]:
+    """Сборка графика выходных всех девушек в виде блоков строк (по месяцам)"""
+    if not DAYOFF_INDEX['by_month']:
+        return []
+    
+    labels = {'admin': '🔴 АДМИН', 'husband': '🔵 МУЖ АДМИНА'}
+    blocks = [["📅 ГРАФИК ВЫХОДНЫХ (ВСЕ)"]]
+    
+    for month_key, entries in sorted(DAYOFF_INDEX['by_month'].items()):
+        month_name = datetime.strptime(month_key, "%Y-%m").strftime("%B %Y").upper()
+        block = [f"🗓️ {month_name}:"]
+        
+        for date_str, kind, who, reason in entries:
+            if kind == 'user':
+                block.append(f"• {format_date(date_str)} — {who} ({reason})")
+            else:
+                block.append(f"• {format_date(date_str)} — {labels[kind]} (Выходной)")
+        
+        blocks.append(block)
+    
+    # Статистика
+    block = ["📊 СТАТИСТИКА ВЫХОДНЫХ:"]
+    for user_name in USERS_CONFIG.keys():
+        count = len(DAYOFF_INDEX['by_user'].get(user_name, []))
+        block.append(f"• {user_name}: {count} дней")
+    blocks.append(block)
+    
+    return blocks
+
+async def calendar_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ графика выходных всех девушек (только для админа)"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
+    
+    blocks = build_calendar_all_report()
+    
+    if not blocks:
+        await update.message.reply_text(
+            "📅 ГРАФИК ВЫХОДНЫХ\n\n"
+            "Нет запланированных выходных"
+        )
+        return
+    
+    await send_report(update.message, blocks, reply_markup=ics_keyboard())
+
+# ===========================
+# КАЛЕНДАРЬ .ICS
+# ===========================
+# Выходные в формате iCalendar: файл в чат (/ics или кнопка под календарём)
+# или подписка по HTTP с того же порта, что и метрики:
+#   /calendar.ics — все выходные, /calendar/<имя>.ics — календарь девушки.
+# Если задан ICS_TOKEN, в ссылке нужен ?token=<ICS_TOKEN>. Без токена
+# календари по HTTP отдаются только при METRICS_HOST на loopback.
+# Файл собирается по месяцам и кэшируется до следующего изменения календаря
+ICS_TOKEN = os.getenv('ICS_TOKEN', '')
+ICS_CACHE = {}  # (имя девушки или None — все, свой ли календарь) → (версия календаря, bytes)
+ICS_SUMMARIES = {
+    'admin': "🔴 Админ не на связи",
+    'husband': "🔵 Муж админа не на связи"
+}
+
+def ics_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_line(line: str) -> bytes:
+    """Строка iCalendar со свёрткой по 75 байт (не разрывая символы UTF-8)"""
+    parts, current, size, limit = [], [], 0, 75
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > limit:
+            parts.append("".join(current))
+            current, size, limit = [], 0, 74  # продолжение начинается с пробела
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts).encode('utf-8') + b"\r\n"
+
+def ics_event(date_str: str, kind: str, who: str, reason: str, personal: bool, stamp: str) -> bytes:
+    """VEVENT на весь день; UID стабилен, чтобы клиенты обновляли события, а не дублировали"""
+    day = datetime.strptime(date_str, "%Y-%m-%d")
+    if kind == 'user':
+        summary = "🏖️ Мой выходной" if personal else f"🏖️ {who} — выходной"
+    else:
+        summary = ICS_SUMMARIES[kind]
+    uid = hashlib.sha1(f"{date_str}|{kind}|{who}".encode('utf-8')).hexdigest()[:20]
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:dayoff-{uid}@telegram-bot",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;VALUE=DATE:{day.strftime('%Y%m%d')}",
+        f"DTEND;VALUE=DATE:{(day + timedelta(days=1)).strftime('%Y%m%d')}",
+        f"SUMMARY:{ics_escape(summary)}",
+        f"DESCRIPTION:{ics_escape(reason)}",
+        "TRANSP:TRANSPARENT",
+        "END:VEVENT"
+    ]
+    return b"".join(ics_line(line) for line in lines)
+
+def generate_ics(user_name: Optional[str], personal: bool = False) -> Iterable[bytes]:
+    """Календарь по частям: заголовок, события каждого месяца, окончание
+
+    personal — календарь запросила сама девушка («Мой выходной» вместо имени).
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    title = f"Выходные — {user_name}" if user_name else "Выходные (все)"
+    yield b"".join(ics_line(line) for line in (
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//telegram-bot//days off//RU",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{ics_escape(title)}"
+    ))
+    for _, entries in sorted(DAYOFF_INDEX['by_month'].items()):
+        chunk = b"".join(
+            ics_event(date_str, kind, who, reason, personal, stamp)
+            for date_str, kind, who, reason in entries
+            if user_name is None or kind != 'user' or who == user_name
+        )
+        if chunk:
+            yield chunk
+    yield ics_line("END:VCALENDAR")
+
+def ics_stream(user_name: Optional[str], personal: bool = False) -> Iterable[bytes]:
+    """Готовый файл из кэша или генерация с сохранением в кэш по окончании"""
+    version = DAYOFF_INDEX['version']
+    cached = ICS_CACHE.get((user_name, personal))
+    count_cache('ics', cached is not None and cached[0] == version)
+    if cached is not None and cached[0] == version:
+        yield cached[1]
+        return
+    chunks = []
+    for chunk in generate_ics(user_name, personal):
+        chunks.append(chunk)
+        yield chunk
+    ICS_CACHE[(user_name, personal)] = (version, b"".join(chunks))
+
+def build_ics(user_name: Optional[str], personal: bool = False) -> bytes:
+    return b"".join(ics_stream(user_name, personal))
+
+def ics_http_enabled() -> bool:
+    """Календари по HTTP: с токеном — всегда, без токена — только на loopback"""
+    if ICS_TOKEN:
+        return True
+    if METRICS_HOST == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(METRICS_HOST).is_loopback
+    except ValueError:
+        return False
+
+def ics_route(route: str, query: str) -> Optional[str]:
+    """Календарь HTTP-пути: '' — все выходные, имя — девушка, None — не календарь"""
+    if not ics_http_enabled():
+        return None
+    if ICS_TOKEN:
+        token = parse_qs(query).get('token', [''])[0]
+        if not hmac.compare_digest(token, ICS_TOKEN):
+            return None
+    if route == '/calendar.ics':
+        return ''
+    if route.startswith('/calendar/') and route.endswith('.ics'):
+        user_name = unquote(route[len('/calendar/'):-len('.ics')])
+        if user_name in USERS_CONFIG:
+            return user_name
+    return None
+
+def ics_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("📥 Файл .ics", callback_data="ics_export")]])
+
+async def send_ics(message, user_id: int, requested: Optional[str] = None):
+    """Отправка календаря файлом: админу — всех (или одной девушки), девушке — свой"""
+    if is_admin(user_id):
+        user_name = requested
+        if user_name is not None and user_name not in USERS_CONFIG:
+            await message.reply_text(f"❌ Пользователь {user_name} не найден")
+            return
+        personal = False
+    else:
+        user_name = get_user_name(user_id)
+        if not user_name:
+            await message.reply_text("❌ Сначала зарегистрируйся через /start")
+            return
+        personal = True
+    
+    filename = "dayoffs.ics" if user_name is None else f"dayoffs_{user_name}.ics"
+    await message.reply_document(
+        document=io.BytesIO(build_ics(user_name, personal)),
+        filename=filename,
+        caption="📅 Выходные в формате календаря (Google, Apple, Outlook)"
+    )
+
+async def ics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/ics — файл календаря выходных (админ: /ics [имя])"""
+    requested = context.args[0] if context.args else None
+    await send_ics(update.message, update.effective_user.id, requested)
+
+async def ics_export_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка «Файл .ics» под календарём"""
+    query = update.callback_query
+    await query.answer()
+    await send_ics(query.message, update.effective_user.id)
+
+# ===========================
+# ЭКСПОРТ В EXCEL (АДМИН)
+# ===========================
+def build_excel_workbook():
+    """Сборка книги Excel со статистикой, видео и выплатами"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+    
+    wb = Workbook()
+    
+    # Лист 1: Статистика пользователей
+    ws1 = wb.active
+    ws1.title = "Статистика"
+    
+    headers = ['Имя', 'Видео', 'Заработано', 'Баланс']
+    ws1.append(headers)
+    
+    for col in range(1, len(headers) + 1):
+        cell = ws1.cell(1, col)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    
+    for user_name, stats in user_totals().items():
+        ws1.append([
+            user_name,
+            stats['videos'],
+            stats['earnings'],
+            stats['balance']
+        ])
+    
+    # Лист 1а: Помесячная разбивка по пользователям и типам
+    ws_months = wb.create_sheet("По месяцам")
+    
+    headers = ['Месяц', 'Пользователь', 'Тип', 'Видео', 'Сумма']
+    ws_months.append(headers)
+    
+    for col in range(1, len(headers) + 1):
+        cell = ws_months.cell(1, col)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    
+    breakdown = analytics.group_by(analytics_tables()['videos'], ('period', 'user', 'type'), period='month')
+    for (month, user_name, video_type), entry in breakdown.items():
+        ws_months.append([month.strftime('%m.%Y'), user_name, video_type.upper(), entry['count'], entry['sum']])
+    
+    # Лист 2: Все видео
+    ws2 = wb.create_sheet("Видео")
+    
+    headers = ['ID', 'Дата', 'Пользователь', 'Тип', 'Название', 'Сумма']
+    ws2.append(headers)
+    
+    for col in range(1, len(headers) + 1):
+        cell = ws2.cell(1, col)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    
+    for video in latest_first(iter_history('videos')):
+        date = datetime.strptime(video.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+        ws2.append([
+            video.id,
+            date,
+            video.user,
+            video.type.upper(),
+            video.name,
+            video.amount
+        ])
+    
+    # Лист 3: Выплаты
+    ws3 = wb.create_sheet("Выплаты")
+    
+    headers = ['ID', 'Дата', 'Пользователь', 'Тип', 'Сумма']
+    ws3.append(headers)
+    
+    for col in range(1, len(headers) + 1):
+        cell = ws3.cell(1, col)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    
+    for payment in latest_first(iter_history('payments')):
+        date = datetime.strptime(payment.created_at, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
+        payment_type = "Зарплата" if payment.type == 'salary' else "Аванс"
+        ws3.append([
+            payment.id,
+            date,
+            payment.user,
+            payment_type,
+            payment.amount
+        ])
+    
+    return wb
+
+def build_excel_xlsx() -> bytes:
+    """Готовый файл .xlsx со статистикой (вызывается в отдельном потоке)"""
+    buffer = io.BytesIO()
+    build_excel_workbook().save(buffer)
+    return buffer.getvalue()
+
+async def export_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт статистики в Excel (только для админа)"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
+    
+    try:
+        # Сборка и сохранение книги — в отдельном потоке, чтобы не блокировать цикл
+        content = await asyncio.to_thread(build_excel_xlsx)
+        filename = f"statistic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        await update.message.reply_document(
+            document=io.BytesIO(content),
+            filename=filename,
+            caption="📊 Экспорт статистики в Excel"
+        )
+        
+    except ImportError:
+        await update.message.reply_text(
+            "❌ Модуль openpyxl не установлен!\n\n"
+            "Установи через:\n"
+            "pip install openpyxl"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка экспорта в Excel: {e}")
+        await update.message.reply_text(f"❌ Ошибка экспорта: {e}")
+
+# ===========================
+# ЗАРАБОТОК ЗА ПЕРИОД (АДМИН)
+# ===========================
+PERIOD_USAGE = (
+    "Использование: /period ДД.ММ[.ГГГГ] ДД.ММ[.ГГГГ] [имя] [excel]\n"
+    "Пример: /period 01.10 15.10 Вика"
+)
+PERIOD_MAX_DAYS = 3 * 366  # разбивка по дням идёт циклом по каждому дню периода
+
+def parse_day(text: str) -> datetime:
+    """Дата «ДД.ММ» (текущий год) или «ДД.ММ.ГГГГ»"""
+    parts = text.split('.')
+    if len(parts) == 2:
+        return datetime(datetime.now().year, int(parts[1]), int(parts[0]))
+    day, month, year = parts
+    return datetime(int(year), int(month), int(day))
+
+def build_period_report(start: datetime, end: datetime, user_names: List[str]) -> List[List[str]]:
+    """Заработок за период по пользователям в виде блоков строк"""
+    earnings = period_earnings(start, end)
+    block = []
+    total_videos = total_sum = 0
+    for user_name in user_names:
+        entry = earnings[user_name]
+        total_videos += entry['count']
+        total_sum += entry['sum']
+        block.append(f"👤 {user_name}: {entry['count']} видео, {entry['sum']} грн")
+    blocks = [[f"📆 ЗАРАБОТОК {start.strftime('%d.%m.%Y')} — {end.strftime('%d.%m.%Y')}"], block]
+    if len(user_names) > 1:
+        blocks.append([f"💰 Всего: {total_videos} видео, {total_sum} грн"])
+    return blocks
+
+def build_period_workbook(start: datetime, end: datetime, user_names: List[str]):
+    """Книга Excel: итоги за период и разбивка по дням"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+    
+    wb = Workbook()
+    ws1 = wb.active
+    ws1.title = "Итоги"
+    ws2 = wb.create_sheet("По дням")
+    ws1.append(['Пользователь', 'Видео', 'Сумма'])
+    ws2.append(['Дата', 'Пользователь', 'Видео', 'Сумма'])
+    
+    for ws in (ws1, ws2):
+        for col in range(1, ws.max_column + 1):
+            cell = ws.cell(1, col)
+            cell.font = Font(bold=True)
+            cell.alignment = Alignment(horizontal='center')
+    
+    earnings = period_earnings(start, end)
+    for user_name in user_names:
+        ws1.append([user_name, earnings[user_name]['count'], earnings[user_name]['sum']])
+    
+    index = EARNINGS_INDEX['videos']
+    day = start.date()
+    while day <= end.date():
+        for user_name in user_names:
+            entry = index.range(user_name, day, day)
+            if entry['count']:
+                ws2.append([day.strftime("%d.%m.%Y"), user_name, entry['count'], entry['sum']])
+        day += timedelta(days=1)
+    
+    return wb
+
+def build_period_xlsx(start: datetime, end: datetime, user_names: List[str]) -> bytes:
+    """Готовый файл .xlsx за период (вызывается в отдельном потоке)"""
+    buffer = io.BytesIO()
+    build_period_workbook(start, end, user_names).save(buffer)
+    return buffer.getvalue()
+
+async def period_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Заработок за произвольный период: /period 01.10 15.10 [имя] [excel] (только для админа)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
+    
+    args = list(context.args)
+    as_excel = bool(args) and args[-1].lower() == 'excel'
+    if as_excel:
+        args.pop()
     
-    # Сохраняем выходные
-    db['admin_days_off'][who] = dates
-    save_database(db)
+    try:
+        start, end = parse_day(args[0]), parse_day(args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text(f"❌ Неверный формат!\n\n{PERIOD_USAGE}")
+        return
+    if start > end:
+        start, end = end, start
+    if (end - start).days >= PERIOD_MAX_DAYS:
+        await update.message.reply_text(f"❌ Период не может быть длиннее {PERIOD_MAX_DAYS} дней")
+        return
     
-    # Уведомления всем девушкам
-    who_name = "Администратор" if who == "admin" else "Муж администратора"
+    user_names = list(USERS_CONFIG.keys())
+    if len(args) > 2:
+        if args[2] not in USERS_CONFIG:
+            await update.message.reply_text(f"❌ Пользователь {args[2]} не найден")
+            return
+        user_names = [args[2]]
     
-    for user_name, user_data in db['users'].items():
-        user_telegram_id = user_data.get('telegram_id')
-        if user_telegram_id and not is_admin(user_telegram_id):
-            try:
-                dates_list = "\n".join([f"• {format_date(d)}" for d in dates])
-                await context.bot.send_message(
-                    chat_id=user_telegram_id,
-                    text=f"📅 ВЫХОДНЫЕ АДМИНИСТРАЦИИ\n\n"
-                         f"{who_name} не будет на связи:\n{dates_list}"
-                )
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление {user_name}: {e}")
+    if not as_excel:
+        await send_report(update.message, build_period_report(start, end, user_names))
+        return
     
-    dates_formatted = ", ".join([format_date(d) for d in dates])
+    try:
+        # Цикл по дням и сохранение книги — в отдельном потоке, чтобы не блокировать цикл
+        content = await asyncio.to_thread(build_period_xlsx, start, end, user_names)
+        await update.message.reply_document(
+            document=io.BytesIO(content),
+            filename=f"period_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.xlsx",
+            caption=f"📆 Заработок {start.strftime('%d.%m.%Y')} — {end.strftime('%d.%m.%Y')}"
+        )
+    except ImportError:
+        await update.message.reply_text(
+            "❌ Модуль openpyxl не установлен!\n\n"
+            "Установи через:\n"
+            "pip install openpyxl"
+        )
+
+# ===========================
+# АРХИВ (АДМИН)
+# ===========================
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перенос закрытой истории в архив прямо сейчас (только для админа)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
     
+    moved = await run_archive_rollover()
+    moved_requests = await run_dayoff_requests_rollover()
+    months = db['archive']['months']
     await update.message.reply_text(
-        f"✅ Выходные установлены!\n\n"
-        f"👤 {who_name}\n"
-        f"📅 Даты: {dates_formatted}\n\n"
-        f"Все девушки уведомлены.",
-        reply_markup=get_main_keyboard(update.effective_user.id)
+        f"📦 АРХИВ\n\n"
+        f"Перенесено сейчас: {moved['videos']} видео, {moved['payments']} выплат, "
+        f"{moved_requests} запросов выходных\n"
+        f"Горизонт: {ARCHIVE_HORIZON_DAYS} дн.\n"
+        f"Месяцев в архиве: {len(months)}"
+        + (f" ({months[0]} — {months[-1]})" if months else "") + "\n"
+        f"В рабочей БД: {len(db['videos'])} видео, {len(db['payments'])} выплат"
     )
-    
-    context.user_data.clear()
-    return ConversationHandler.END
 
 # ===========================
-# МОЙ КАЛЕНДАРЬ (ДЕВУШКИ)
+# РЕЗЕРВНЫЕ КОПИИ (АДМИН)
 # ===========================
-async def my_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ персонального календаря (только свои выходные + админы)"""
-    user_id = update.effective_user.id
-    user_name = get_user_name(user_id)
-    
-    if not user_name:
-        await update.message.reply_text("❌ Сначала зарегистрируйся через /start")
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/backup — копия сейчас, /backup list — список, /backup verify [имя] — проверка"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    # Собираем выходные
-    my_daysoff = db['days_off_approved'].get(user_name, [])
-    admin_daysoff = db['admin_days_off'].get('admin', [])
-    husband_daysoff = db['admin_days_off'].get('husband', [])
+    action = context.args[0].lower() if context.args else 'now'
+    
+    if action == 'list':
+        backups = list_backups()
+        if not backups:
+            await update.message.reply_text("💾 Резервных копий ещё нет")
+            return
+        lines = ["💾 РЕЗЕРВНЫЕ КОПИИ"]
+        for name in backups[-10:]:
+            files = read_manifest(name)['files']
+            size = sum(entry['size'] for entry in files.values())
+            lines.append(f"• {name} — файлов: {len(files)}, {size / 1024 / 1024:.1f} МБ")
+        await update.message.reply_text("\n".join(lines))
+        return
     
-    # Группируем по месяцам
-    from collections import defaultdict
-    by_month = defaultdict(list)
+    if action == 'verify':
+        backups = list_backups()
+        name = context.args[1] if len(context.args) > 1 else (backups[-1] if backups else None)
+        if name not in backups:
+            await update.message.reply_text("❌ Копия не найдена")
+            return
+        problems = await asyncio.to_thread(verify_backup, name)
+        if problems:
+            await update.message.reply_text(f"❌ Копия {name} повреждена:\n" + "\n".join(problems))
+        else:
+            await update.message.reply_text(f"✅ Копия {name} цела")
+        return
     
-    for dayoff in my_daysoff:
-        date_obj = datetime.strptime(dayoff['date'], "%Y-%m-%d")
-        month_key = date_obj.strftime("%Y-%m")
-        by_month[month_key].append({
-            'date': dayoff['date'],
-            'type': 'my',
-            'reason': dayoff['reason']
-        })
+    name = await run_backup()
+    await update.message.reply_text(
+        f"✅ Резервная копия {name} создана" if name else "✅ Изменений с прошлой копии нет"
+    )
+
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/restore <имя> — проверка и восстановление копии (только для админа)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
     
-    for date_str in admin_daysoff:
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        month_key = date_obj.strftime("%Y-%m")
-        by_month[month_key].append({
-            'date': date_str,
-            'type': 'admin',
-            'reason': 'Выходной админа'
-        })
-    
-    for date_str in husband_daysoff:
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        month_key = date_obj.strftime("%Y-%m")
-        by_month[month_key].append({
-            'date': date_str,
-            'type': 'husband',
-            'reason': 'Выходной мужа админа'
-        })
-    
-    if not by_month:
+    backups = list_backups()
+    if not context.args or context.args[0] not in backups:
         await update.message.reply_text(
-            "📅 МОЙ КАЛЕНДАРЬ\n\n"
-            "Нет запланированных выходных"
+            "Использование: /restore <имя копии>\n"
+            "Список копий: /backup list"
         )
         return
+    name = context.args[0]
+    
+    problems = await asyncio.to_thread(verify_backup, name)
+    if problems:
+        await update.message.reply_text(f"❌ Копия {name} повреждена, восстановление отменено:\n" + "\n".join(problems))
+        return
     
-    message = "📅 МОЙ КАЛЕНДАРЬ\n\n"
+    try:
+        async with ARCHIVE_LOCK:
+            current = await restore_database(name)
+    except Exception as e:
+        logger.error(f"Ошибка восстановления копии {name}: {e}")
+        await update.message.reply_text(f"❌ Восстановление копии {name} не удалось: {e}\nБД перечитана с диска")
+        return
     
-    for month_key in sorted(by_month.keys()):
-        month_name = datetime.strptime(month_key, "%Y-%m").strftime("%B %Y").upper()
-        message += f"🗓️ {month_name}:\n"
-        
-        for entry in sorted(by_month[month_key], key=lambda x: x['date']):
-            emoji = "🏖️" if entry['type'] == 'my' else "🔴" if entry['type'] == 'admin' else "🔵"
-            prefix = "МОЙ ВЫХОДНОЙ" if entry['type'] == 'my' else "АДМИН НЕ НА СВЯЗИ" if entry['type'] == 'admin' else "МУЖ АДМИНА НЕ НА СВЯЗИ"
-            message += f"• {format_date(entry['date'])} — {emoji} {prefix}\n"
-        
-        message += "\n"
+    logger.info(f"💾 Восстановлена копия {name}")
+    await update.message.reply_text(
+        f"✅ Восстановлена копия {name}\n"
+        f"🎬 Видео: {len(db['videos'])}, 💸 выплат: {len(db['payments'])}\n"
+        f"Предыдущее состояние сохранено в копии {current}"
+    )
+
+# ===========================
+# ОБСЛУЖИВАНИЕ (АДМИН)
+# ===========================
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/maintenance — состояние фоновых задач, /maintenance <задача> — запуск сейчас"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
     
-    message += "✅ Ты видишь:\n"
-    message += "• Свои выходные\n"
-    message += "• Выходные администратора\n"
-    message += "• Выходные мужа администратора"
+    if context.args:
+        name = context.args[0]
+        if name not in MAINTENANCE_TASKS:
+            await update.message.reply_text(
+                f"❌ Нет задачи {name}\nЗадачи: {', '.join(MAINTENANCE_TASKS)}"
+            )
+            return
+        result = await run_maintenance(name, context.bot)
+        await update.message.reply_text(f"🧹 {MAINTENANCE_TASKS[name]['title']}: {result}")
+        return
     
-    await update.message.reply_text(message)
+    lines = ["🧹 ОБСЛУЖИВАНИЕ", ""]
+    for name, task in MAINTENANCE_TASKS.items():
+        schedule = f"в {task['at']}" if 'at' in task else f"каждые {task['interval'] // 3600} ч"
+        stats = METRICS['maintenance'].get(name)
+        lines.append(f"• {name} — {task['title']} ({schedule}, бюджет {task['budget']} с)")
+        if stats and stats['last_run']:
+            lines.append(f"   последний запуск {stats['last_run']}: {stats['last_result']}")
+    lines.append("")
+    lines.append("Запустить сейчас: /maintenance <задача>")
+    await update.message.reply_text("\n".join(lines))
 
 # ===========================
-# ГРАФИК ВЫХОДНЫХ (АДМИН)
+# МЕТРИКИ (АДМИН)
 # ===========================
-async def calendar_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ графика выходных всех девушек (только для админа)"""
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ метрик обработчиков, БД и Bot API (только для админа)"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Доступно только администратору")
+        return
+    
+    await send_report(update.message, build_metrics_report())
+
+# ===========================
+# ПРОФИЛИРОВАНИЕ (АДМИН)
+# ===========================
+PROFILE_DEFAULT_SECONDS = 30
+MEMSNAP_DEFAULT_SECONDS = 60
+PROFILE_TOP_FUNCTIONS = 40
+MEMSNAP_TOP_LINES = 30
+
+async def send_text_document(bot, chat_id: int, text: str, filename: str, caption: str):
+    """Отправка текстового отчёта документом"""
+    await bot.send_document(
+        chat_id=chat_id,
+        document=text.encode('utf-8'),
+        filename=filename,
+        caption=caption
+    )
+
+def parse_capture_limit(args: List[str], default_seconds: int):
+    """Разбор аргумента: «30» или «30s» — секунды, «100u» — число обновлений"""
+    if not args:
+        return default_seconds, None
+    arg = args[0].lower()
+    if arg.endswith('u'):
+        return None, int(arg[:-1])
+    return int(arg.rstrip('s')), None
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запуск cProfile на N секунд или N обновлений (только для админа)"""
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
         await update.message.reply_text("❌ Доступно только администратору")
         return
     
-    # Собираем выходные
-    from collections import defaultdict
-    by_month = defaultdict(list)
+    if PROFILE_STATE['profiler']:
+        await update.message.reply_text("⏳ Профилирование уже идёт")
+        return
     
-    # Выходные девушек
-    for user_name, daysoff_list in db['days_off_approved'].items():
-        for dayoff in daysoff_list:
-            date_obj = datetime.strptime(dayoff['date'], "%Y-%m-%d")
-            month_key = date_obj.strftime("%Y-%m")
-            by_month[month_key].append({
-                'date': dayoff['date'],
-                'user': user_name,
-                'reason': dayoff['reason']
-            })
-    
-    # Выходные админов
-    for date_str in db['admin_days_off'].get('admin', []):
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        month_key = date_obj.strftime("%Y-%m")
-        by_month[month_key].append({
-            'date': date_str,
-            'user': '🔴 АДМИН',
-            'reason': 'Выходной'
-        })
-    
-    for date_str in db['admin_days_off'].get('husband', []):
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        month_key = date_obj.strftime("%Y-%m")
-        by_month[month_key].append({
-            'date': date_str,
-            'user': '🔵 МУЖ АДМИНА',
-            'reason': 'Выходной'
-        })
-    
-    if not by_month:
+    try:
+        seconds, updates = parse_capture_limit(context.args, PROFILE_DEFAULT_SECONDS)
+        if (seconds or updates or 0) <= 0:
+            raise ValueError
+    except ValueError:
         await update.message.reply_text(
-            "📅 ГРАФИК ВЫХОДНЫХ\n\n"
-            "Нет запланированных выходных"
+            "❌ Неверный формат!\n\n"
+            "/profile 30 — на 30 секунд\n"
+            "/profile 100u — на 100 обновлений"
         )
         return
     
-    message = "📅 ГРАФИК ВЫХОДНЫХ (ВСЕ)\n\n"
+    if seconds and not context.job_queue:
+        await update.message.reply_text("❌ JobQueue недоступен, используй /profile <N>u")
+        return
     
-    for month_key in sorted(by_month.keys()):
-        month_name = datetime.strptime(month_key, "%Y-%m").strftime("%B %Y").upper()
-        message += f"🗓️ {month_name}:\n"
-        
-        for entry in sorted(by_month[month_key], key=lambda x: x['date']):
-            message += f"• {format_date(entry['date'])} — {entry['user']} ({entry['reason']})\n"
-        
-        message += "\n"
+    import cProfile
     
-    # Статистика
-    message += "📊 СТАТИСТИКА ВЫХОДНЫХ:\n"
-    for user_name in USERS_CONFIG.keys():
-        count = len(db['days_off_approved'].get(user_name, []))
-        message += f"• {user_name}: {count} дней\n"
+    profiler = cProfile.Profile()
+    PROFILE_STATE['profiler'] = profiler
+    PROFILE_STATE['chat_id'] = update.effective_chat.id
+    PROFILE_STATE['updates_left'] = updates
+    profiler.enable()
     
-    await update.message.reply_text(message)
+    if seconds:
+        context.job_queue.run_once(finish_profile_job, seconds)
+        limit_text = f"{seconds} с"
+    else:
+        limit_text = f"{updates} обновлений"
+    
+    await update.message.reply_text(f"🔬 Профилирование запущено на {limit_text}")
 
-# ===========================
-# ЭКСПОРТ В EXCEL (АДМИН)
-# ===========================
-async def export_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Экспорт статистики в Excel (только для админа)"""
+async def finish_profile_job(context: ContextTypes.DEFAULT_TYPE):
+    """Остановка профилирования по таймеру"""
+    await finish_profiling(context.bot)
+
+async def finish_profiling(bot):
+    """Остановка cProfile и отправка отчёта админу"""
+    profiler = PROFILE_STATE['profiler']
+    if not profiler:
+        return
+    profiler.disable()
+    PROFILE_STATE['profiler'] = None
+    PROFILE_STATE['updates_left'] = None
+    
+    import pstats
+    
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stream.write("=== ПО КУМУЛЯТИВНОМУ ВРЕМЕНИ ===\n")
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    stream.write("\n=== ПО СОБСТВЕННОМУ ВРЕМЕНИ ===\n")
+    stats.sort_stats('tottime').print_stats(PROFILE_TOP_FUNCTIONS)
+    
+    try:
+        await send_text_document(
+            bot, PROFILE_STATE['chat_id'], stream.getvalue(),
+            f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+            "🔬 Профиль cProfile"
+        )
+    except Exception as e:
+        logger.error(f"Не удалось отправить профиль: {e}")
+
+async def memsnap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Разница снимков tracemalloc за N секунд (только для админа)"""
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
@@ -1642,100 +4423,59 @@ async def export_excel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment
-        
-        wb = Workbook()
-        
-        # Лист 1: Статистика пользователей
-        ws1 = wb.active
-        ws1.title = "Статистика"
-        
-        headers = ['Имя', 'Видео', 'Заработано', 'Баланс']
-        ws1.append(headers)
-        
-        for col in range(1, len(headers) + 1):
-            cell = ws1.cell(1, col)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for user_name in USERS_CONFIG.keys():
-            stats = get_user_stats(user_name)
-            ws1.append([
-                user_name,
-                stats['total_videos'],
-                stats['total_earnings'],
-                stats['balance']
-            ])
-        
-        # Лист 2: Все видео
-        ws2 = wb.create_sheet("Видео")
-        
-        headers = ['ID', 'Дата', 'Пользователь', 'Тип', 'Название', 'Сумма']
-        ws2.append(headers)
-        
-        for col in range(1, len(headers) + 1):
-            cell = ws2.cell(1, col)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for video in sorted(db['videos'], key=lambda x: x['created_at'], reverse=True):
-            date = datetime.strptime(video['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-            ws2.append([
-                video['id'],
-                date,
-                video['user'],
-                video['type'].upper(),
-                video['name'],
-                video['amount']
-            ])
-        
-        # Лист 3: Выплаты
-        ws3 = wb.create_sheet("Выплаты")
-        
-        headers = ['ID', 'Дата', 'Пользователь', 'Тип', 'Сумма']
-        ws3.append(headers)
-        
-        for col in range(1, len(headers) + 1):
-            cell = ws3.cell(1, col)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        for payment in sorted(db['payments'], key=lambda x: x['created_at'], reverse=True):
-            date = datetime.strptime(payment['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-            payment_type = "Зарплата" if payment['type'] == 'salary' else "Аванс"
-            ws3.append([
-                payment['id'],
-                date,
-                payment['user'],
-                payment_type,
-                payment['amount']
-            ])
-        
-        # Сохраняем файл
-        filename = f"statistic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        wb.save(filename)
-        
-        # Отправляем файл
-        with open(filename, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=filename,
-                caption="📊 Экспорт статистики в Excel"
-            )
-        
-        # Удаляем файл
-        os.remove(filename)
-        
-    except ImportError:
+        seconds, _ = parse_capture_limit(context.args, MEMSNAP_DEFAULT_SECONDS)
+        if not seconds or seconds <= 0:
+            raise ValueError
+    except ValueError:
         await update.message.reply_text(
-            "❌ Модуль openpyxl не установлен!\n\n"
-            "Установи через:\n"
-            "pip install openpyxl"
+            "❌ Неверный формат!\n\n"
+            "/memsnap 60 — разница снимков памяти за 60 секунд"
+        )
+        return
+    
+    if not context.job_queue:
+        await update.message.reply_text("❌ JobQueue недоступен")
+        return
+    
+    import tracemalloc
+    
+    if tracemalloc.is_tracing():
+        await update.message.reply_text("⏳ Снимок памяти уже снимается")
+        return
+    
+    tracemalloc.start()
+    context.job_queue.run_once(
+        finish_memsnap_job, seconds,
+        chat_id=update.effective_chat.id,
+        data=tracemalloc.take_snapshot()
+    )
+    
+    await update.message.reply_text(f"🧠 Трассировка памяти запущена на {seconds} с")
+
+async def finish_memsnap_job(context: ContextTypes.DEFAULT_TYPE):
+    """Второй снимок tracemalloc, разница и отправка отчёта админу"""
+    import tracemalloc
+    
+    first = context.job.data
+    second = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    
+    lines = ["=== РОСТ ПАМЯТИ ЗА ПЕРИОД ==="]
+    for stat in second.compare_to(first, 'lineno')[:MEMSNAP_TOP_LINES]:
+        lines.append(str(stat))
+    lines.append("")
+    lines.append("=== КРУПНЕЙШИЕ МЕСТА ВЫДЕЛЕНИЯ ===")
+    for stat in second.statistics('lineno')[:MEMSNAP_TOP_LINES]:
+        lines.append(str(stat))
+    
+    try:
+        await send_text_document(
+            context.bot, context.job.chat_id, "\n".join(lines),
+            f"memsnap_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+            "🧠 Снимок памяти tracemalloc"
         )
     except Exception as e:
-        logger.error(f"Ошибка экспорта в Excel: {e}")
-        await update.message.reply_text(f"❌ Ошибка экспорта: {e}")
+        logger.error(f"Не удалось отправить снимок памяти: {e}")
 
 # ===========================
 # ОТМЕНА ОПЕРАЦИИ
@@ -1799,6 +4539,135 @@ async def broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     return ConversationHandler.END
 
+# ===========================
+# РЕЕСТР КОМАНД МЕНЮ
+# ===========================
+# Ввод текста внутри диалогов
+TEXT_INPUT = filters.TEXT & ~filters.COMMAND
+
+# Каждая кнопка меню описана один раз: подпись, обработчик, роль, ряд клавиатуры
+# и (для диалогов) состояния ConversationHandler. Из реестра строятся клавиатуры,
+# словарь маршрутов handle_message и точки входа диалогов.
+MENU_COMMANDS = [
+    # Администратор
+    {'label': '📊 Полная статистика', 'handler': full_statistics, 'role': 'admin', 'row': 0},
+    {'label': '⚙️ Текущий баланс', 'handler': current_balance, 'role': 'admin', 'row': 0},
+    {'label': '💸 Выплатить зарплату', 'handler': salary_payment, 'role': 'admin', 'row': 1},
+    {'label': '💰 Выплатить аванс', 'handler': advance_payment_start, 'role': 'admin', 'row': 1,
+     'conversation': {
+         'name': 'advance_payment',
+         'states': {
+             ADVANCE_USER: [CallbackQueryHandler(advance_user_selected, pattern='^advance_user_')],
+             ADVANCE_AMOUNT: [MessageHandler(TEXT_INPUT, advance_amount_entered)],
+             ADVANCE_CONFIRM: [CallbackQueryHandler(advance_confirmed, pattern='^advance_confirm_')]
+         }
+     }},
+    {'label': '📈 История выплат', 'handler': payment_history, 'role': 'admin', 'row': 2},
+    {'label': '🗑️ Удалить видео', 'handler': delete_video_start, 'role': 'admin', 'row': 2,
+     'conversation': {
+         'name': 'delete_video',
+         'states': {
+             DELETE_VIDEO_SELECT: [MessageHandler(TEXT_INPUT, delete_video_selected)],
+             DELETE_VIDEO_CONFIRM: [CallbackQueryHandler(delete_video_confirmed, pattern='^delete_confirm_')]
+         }
+     }},
+    {'label': '🎬 Все видео', 'handler': all_videos, 'role': 'admin', 'row': 3},
+    {'label': '📊 Экспорт в Excel', 'handler': export_excel, 'role': 'admin', 'row': 3},
+    {'label': '🏆 Рейтинг девушек', 'handler': ratings, 'role': 'admin', 'row': 4},
+    {'label': '📅 План на неделю', 'handler': plan_week_start, 'role': 'admin', 'row': 4,
+     'conversation': {
+         'name': 'plan_week',
+         'states': {
+             PLAN_USER: [CallbackQueryHandler(plan_user_selected, pattern='^plan_user_')],
+             PLAN_DETAILS: [MessageHandler(TEXT_INPUT, plan_details_entered)]
+         }
+     }},
+    {'label': '📅 График выходных', 'handler': calendar_all, 'role': 'admin', 'row': 5},
+    {'label': '📅 Мои выходные', 'handler': admin_dayoff_start, 'role': 'admin', 'row': 5,
+     'conversation': {
+         'name': 'admin_dayoff',
+         'states': {
+             ADMIN_DAYOFF_WHO: [CallbackQueryHandler(admin_dayoff_who_selected, pattern='^admin_dayoff_')],
+             ADMIN_DAYOFF_DATES: [MessageHandler(TEXT_INPUT, admin_dayoff_dates_entered)]
+         }
+     }},
+    {'label': '🔔 Запросы выходных', 'handler': dayoff_requests, 'role': 'admin', 'row': 6},
+    {'label': '📢 Срочное сообщение', 'handler': broadcast_start, 'role': 'admin', 'row': 6,
+     'conversation': {
+         'name': 'broadcast',
+         'states': {
+             BROADCAST_MESSAGE: [MessageHandler(TEXT_INPUT, broadcast_send)]
+         }
+     }},
+    {'label': '🎯 Прогресс планов', 'handler': plans_overview, 'role': 'admin', 'row': 7},
+
+    # Девушки
+    {'label': '🎬 Создала видео', 'handler': handle_video_creation, 'role': 'user', 'row': 0,
+     'conversation': {
+         'name': 'video_creation',
+         'states': {
+             VIDEO_TYPE: [CallbackQueryHandler(video_type_selected, pattern='^video_type_')],
+             VIDEO_NAME: [MessageHandler(TEXT_INPUT, video_name_entered)]
+         }
+     }},
+    {'label': '📤 Загрузила видео', 'handler': handle_video_upload, 'role': 'user', 'row': 0,
+     'conversation': {
+         'name': 'video_upload',
+         'states': {
+             UPLOAD_COUNT: [MessageHandler(TEXT_INPUT, upload_count_entered)]
+         }
+     }},
+    {'label': '💰 Мой доход', 'handler': my_income, 'role': 'user', 'row': 1},
+    {'label': '📊 Моя статистика', 'handler': my_statistics, 'role': 'user', 'row': 1},
+    {'label': '📅 Мой план', 'handler': my_plan, 'role': 'user', 'row': 2},
+    {'label': '📅 Мой календарь', 'handler': my_calendar, 'role': 'user', 'row': 2},
+    {'label': '📅 Запросить выходной', 'handler': request_dayoff_start, 'role': 'user', 'row': 3,
+     'conversation': {
+         'name': 'dayoff_request',
+         'states': {
+             DAYOFF_DATE: [MessageHandler(TEXT_INPUT, dayoff_date_entered)],
+             DAYOFF_REASON: [MessageHandler(TEXT_INPUT, dayoff_reason_entered)]
+         }
+     }},
+    {'label': '🧾 С последней зарплаты', 'handler': since_last_salary, 'role': 'user', 'row': 3},
+]
+
+def build_keyboards() -> Dict[str, ReplyKeyboardMarkup]:
+    """Сборка клавиатур для каждой роли из реестра команд"""
+    rows_by_role = {}
+    for command in MENU_COMMANDS:
+        rows = rows_by_role.setdefault(command['role'], {})
+        rows.setdefault(command['row'], []).append(command['label'])
+
+    return {
+        role: ReplyKeyboardMarkup([rows[i] for i in sorted(rows)], resize_keyboard=True)
+        for role, rows in rows_by_role.items()
+    }
+
+def build_conversation_handlers() -> List[ConversationHandler]:
+    """Сборка ConversationHandler для всех диалогов из реестра команд"""
+    handlers = []
+    for command in MENU_COMMANDS:
+        conversation = command.get('conversation')
+        if not conversation:
+            continue
+        handlers.append(ConversationHandler(
+            entry_points=[MessageHandler(filters.Text([command['label']]), command['handler'])],
+            states=conversation['states'],
+            fallbacks=[CommandHandler('cancel', cancel)],
+            name=conversation['name'],
+            persistent=False
+        ))
+    return handlers
+
+# Готовые клавиатуры и маршруты (подпись кнопки → обработчик)
+MAIN_KEYBOARDS = build_keyboards()
+MENU_ROUTES = {
+    command['label']: command['handler']
+    for command in MENU_COMMANDS
+    if 'conversation' not in command
+}
+
 # ===========================
 # ОБРАБОТКА ТЕКСТОВЫХ СООБЩЕНИЙ
 # ===========================
@@ -1813,32 +4682,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Маршрутизация команд
-    if text == '💰 Мой доход':
-        await my_income(update, context)
-    elif text == '📊 Моя статистика':
-        await my_statistics(update, context)
-    elif text == '📅 Мой план':
-        await my_plan(update, context)
-    elif text == '📅 Мой календарь':
-        await my_calendar(update, context)
-    elif text == '📊 Полная статистика':
-        await full_statistics(update, context)
-    elif text == '⚙️ Текущий баланс':
-        await current_balance(update, context)
-    elif text == '💸 Выплатить зарплату':
-        await salary_payment(update, context)
-    elif text == '📈 История выплат':
-        await payment_history(update, context)
-    elif text == '🎬 Все видео':
-        await all_videos(update, context)
-    elif text == '🏆 Рейтинг девушек':
-        await ratings(update, context)
-    elif text == '📅 График выходных':
-        await calendar_all(update, context)
-    elif text == '🔔 Запросы выходных':
-        await dayoff_requests(update, context)
-    elif text == '📊 Экспорт в Excel':
-        await export_excel(update, context)
+    handler = MENU_ROUTES.get(text)
+    if handler:
+        await handler(update, context)
     else:
         await update.message.reply_text(
             "❓ Команда не распознана\n\n"
@@ -1849,6 +4695,92 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===========================
 # ГЛАВНАЯ ФУНКЦИЯ
 # ===========================
+async def on_startup(application: Application):
+    """Фоновые задачи после инициализации приложения"""
+    # БД грузится в отдельном потоке, обработчики дождутся её готовности
+    application.bot_data['outbox'] = asyncio.Queue()
+    application.bot_data['background_tasks'] = [
+        asyncio.create_task(measure_loop_lag()),
+        asyncio.create_task(asyncio.to_thread(ensure_database)),
+        asyncio.create_task(run_outbox(application))
+    ]
+    application.bot_data['watchdog_stop'] = start_loop_watchdog()
+    application.bot_data['metrics_server'] = await start_metrics_server(application)
+
+async def on_shutdown(application: Application):
+    """Остановка фоновых задач"""
+    for task in application.bot_data.get('background_tasks', []):
+        task.cancel()
+    outbox = application.bot_data.get('outbox')
+    if outbox is not None and not outbox.empty():
+        # Их ключи не отмечены отправленными — уйдут после перезапуска
+        logger.info(f"⏰ В исходящей очереди осталось сообщений: {outbox.qsize()}")
+    if 'watchdog_stop' in application.bot_data:
+        application.bot_data['watchdog_stop'].set()
+    server = application.bot_data.get('metrics_server')
+    if server:
+        server.close()
+        await server.wait_closed()
+    # Снимок для быстрого следующего старта (JSON к этому моменту уже сохранён)
+    if DB_STATE['loaded']:
+        await asyncio.to_thread(write_snapshot, db)
+
+def build_application(token: str, base_url: Optional[str] = None) -> Application:
+    """Создание приложения со всеми обработчиками
+
+    base_url позволяет направить бота на другой сервер Bot API
+    (например, на локальную заглушку нагрузочного теста).
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    
+    # Команды
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memsnap", memsnap_command))
+    application.add_handler(CommandHandler("period", period_command))
+    application.add_handler(CommandHandler("archive", archive_command))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("restore", restore_command))
+    application.add_handler(CommandHandler("maintenance", maintenance_command))
+    application.add_handler(CommandHandler("ics", ics_command))
+    
+    # ConversationHandlers для всех диалогов меню
+    for conv_handler in build_conversation_handlers():
+        application.add_handler(conv_handler)
+    
+    # CallbackQueryHandlers
+    application.add_handler(CallbackQueryHandler(process_salary_payment, pattern='^pay_salary_'))
+    application.add_handler(CallbackQueryHandler(payroll_selected, pattern='^pay_all_'))
+    application.add_handler(CallbackQueryHandler(dayoff_approve_reject, pattern='^dayoff_(approve|reject)_'))
+    application.add_handler(CallbackQueryHandler(ratings_window_selected, pattern='^ratings_'))
+    application.add_handler(CallbackQueryHandler(ics_export_selected, pattern='^ics_export$'))
+    
+    # Обработчик текстовых сообщений (должен быть ПОСЛЕДНИМ!)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Метрики по всем обработчикам и периодическая сводка в лог
+    instrument_application(application)
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            log_metrics_summary, interval=METRICS_LOG_INTERVAL, first=METRICS_LOG_INTERVAL
+        )
+        schedule_maintenance(application.job_queue)
+        application.job_queue.run_repeating(reminder_tick, interval=REMINDER_TICK, first=REMINDER_TICK)
+    else:
+        logger.warning("JobQueue недоступен: установи python-telegram-bot[job-queue]")
+    
+    return application
+
 def main():
     """Запуск бота"""
     # Получаем токен из переменной окружения
@@ -1858,127 +4790,21 @@ def main():
         logger.error("TELEGRAM_BOT_TOKEN не установлен!")
         return
     
-    # Создаём приложение
-    application = Application.builder().token(token).build()
-    
-    # Команда /start
-    application.add_handler(CommandHandler("start", start))
-    
-    # ConversationHandler для создания видео
-    video_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^🎬 Создала видео$'), handle_video_creation)],
-        states={
-            VIDEO_TYPE: [CallbackQueryHandler(video_type_selected, pattern='^video_type_')],
-            VIDEO_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, video_name_entered)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="video_creation",
-        persistent=False
-    )
-    
-    # ConversationHandler для загрузки видео
-    upload_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📤 Загрузила видео$'), handle_video_upload)],
-        states={
-            UPLOAD_COUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, upload_count_entered)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="video_upload",
-        persistent=False
-    )
-    
-    # ConversationHandler для удаления видео
-    delete_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^🗑️ Удалить видео$'), delete_video_start)],
-        states={
-            DELETE_VIDEO_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_video_selected)],
-            DELETE_VIDEO_CONFIRM: [CallbackQueryHandler(delete_video_confirmed, pattern='^delete_confirm_')]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="delete_video",
-        persistent=False
-    )
-    
-    # ConversationHandler для плана на неделю
-    plan_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📅 План на неделю$'), plan_week_start)],
-        states={
-            PLAN_USER: [CallbackQueryHandler(plan_user_selected, pattern='^plan_user_')],
-            PLAN_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, plan_details_entered)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="plan_week",
-        persistent=False
-    )
-    
-    # ConversationHandler для выплаты аванса
-    advance_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^💰 Выплатить аванс$'), advance_payment_start)],
-        states={
-            ADVANCE_USER: [CallbackQueryHandler(advance_user_selected, pattern='^advance_user_')],
-            ADVANCE_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, advance_amount_entered)],
-            ADVANCE_CONFIRM: [CallbackQueryHandler(advance_confirmed, pattern='^advance_confirm_')]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="advance_payment",
-        persistent=False
-    )
-    
-    # ConversationHandler для запроса выходного
-    dayoff_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📅 Запросить выходной$'), request_dayoff_start)],
-        states={
-            DAYOFF_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, dayoff_date_entered)],
-            DAYOFF_REASON: [MessageHandler(filters.TEXT & ~filters.COMMAND, dayoff_reason_entered)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="dayoff_request",
-        persistent=False
-    )
-    
-    # ConversationHandler для выходных админа
-    admin_dayoff_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📅 Мои выходные$'), admin_dayoff_start)],
-        states={
-            ADMIN_DAYOFF_WHO: [CallbackQueryHandler(admin_dayoff_who_selected, pattern='^admin_dayoff_')],
-            ADMIN_DAYOFF_DATES: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_dayoff_dates_entered)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="admin_dayoff",
-        persistent=False
-    )
-    
-    # Регистрируем ConversationHandlers
-    application.add_handler(video_conv_handler)
-    application.add_handler(upload_conv_handler)
-    application.add_handler(delete_conv_handler)
-    application.add_handler(plan_conv_handler)
-    application.add_handler(advance_conv_handler)
-    application.add_handler(dayoff_conv_handler)
-    application.add_handler(admin_dayoff_conv_handler)
-    
-    # ConversationHandler для срочного сообщения
-    broadcast_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^📢 Срочное сообщение$'), broadcast_start)],
-        states={
-            BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_send)]
-        },
-        fallbacks=[CommandHandler('cancel', cancel)],
-        name="broadcast",
-        persistent=False
-    )
-    application.add_handler(broadcast_conv_handler)
-    
-    # CallbackQueryHandlers
-    application.add_handler(CallbackQueryHandler(process_salary_payment, pattern='^pay_salary_'))
-    application.add_handler(CallbackQueryHandler(dayoff_approve_reject, pattern='^dayoff_(approve|reject)_'))
+    # БД грузится уже после запуска — нечитаемый файл проверяем заранее
+    try:
+        current_database_file()
+    except RuntimeError as e:
+        logger.error(f"Бот не запущен: {e}")
+        return
     
-    # Обработчик текстовых сообщений (должен быть ПОСЛЕДНИМ!)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Создаём приложение
+    application = build_application(token)
     
     # Запускаем бота
     logger.info("🤖 Бот запущен!")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
+STARTUP_TIMINGS['import'] = time.perf_counter() - IMPORT_STARTED
+
 if __name__ == '__main__':
     main()